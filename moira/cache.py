@@ -1,31 +1,111 @@
+from collections import OrderedDict
 from functools import wraps
 
 from twisted.internet import reactor, defer
+from twisted.python import failure
 
-CACHE = {}
+from moira import config
+from moira.metrics import spy
+
+
+class LRUCache(object):
+
+    """
+    Bounded mapping with expiration and least recently used eviction.
+    Items expire ttl seconds after set, get may override ttl. Size None means config.CACHE_SIZE.
+    """
+
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self.items = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.items)
+
+    def get(self, key, default=None, ttl=None):
+        item = self.items.pop(key, None)
+        if item is None:
+            self.misses += 1
+            return default
+        timestamp, value = item
+        if timestamp + (self.ttl if ttl is None else ttl) < reactor.seconds():
+            self.misses += 1
+            return default
+        self.items[key] = item
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        self.items.pop(key, None)
+        size = config.CACHE_SIZE if self.size is None else self.size
+        if size <= 0:
+            return
+        self.items[key] = (reactor.seconds(), value)
+        while len(self.items) > size:
+            self.items.popitem(last=False)
+            self.evictions += 1
+
+    def delete(self, key):
+        self.items.pop(key, None)
+
+    def clear(self):
+        self.items.clear()
+
+
+CACHE = LRUCache(None, 0)
+_MISSING = object()
+_IN_FLIGHT = {}
+
+
+def store(key, value):
+    evictions = CACHE.evictions
+    CACHE.set(key, value)
+    if CACHE.evictions > evictions:
+        spy.CACHE_EVICTIONS.report(CACHE.evictions - evictions)
 
 
 def cache(f):
+    """
+    Cache function result for cache_ttl seconds by cache_key if both are passed.
+    Concurrent calls with the same key share a single call of function.
+    Result of a call queueing commands to writes buffer is cached by Db.flushWrites
+    once the commands are sent.
+    """
     @wraps(f)
-    @defer.inlineCallbacks
     def wrapper(*args, **kwargs):
-        if 'cache_key' in kwargs and 'cache_ttl' in kwargs:
-            key = "%s%s" % (f, kwargs['cache_key'])
-            ttl = kwargs['cache_ttl']
-            del kwargs['cache_key']
-            del kwargs['cache_ttl']
-            now = reactor.seconds()
-
-            @defer.inlineCallbacks
-            def get_value():
-                result = yield f(*args, **kwargs)
-                defer.returnValue(result)
-            timestamp, result = CACHE.get(key, (0, None))
-            if timestamp + ttl < now:
-                CACHE[key] = (now, result)
-                result = yield get_value()
-                CACHE[key] = (now, result)
-        else:
-            result = yield f(*args, **kwargs)
-        defer.returnValue(result)
+        if 'cache_key' not in kwargs or 'cache_ttl' not in kwargs:
+            return f(*args, **kwargs)
+        key = (f, kwargs.pop('cache_key'))
+        ttl = kwargs.pop('cache_ttl')
+        result = CACHE.get(key, _MISSING, ttl)
+        if result is not _MISSING:
+            spy.CACHE_HITS.report(1)
+            return defer.succeed(result)
+        spy.CACHE_MISSES.report(1)
+        writes = kwargs.get('writes')
+        if writes is not None:
+
+            def queued(result):
+                writes.cached.append((key, result))
+                return result
+            return defer.maybeDeferred(f, *args, **kwargs).addCallback(queued)
+        waiters = _IN_FLIGHT.get(key)
+        if waiters is not None:
+            waiter = defer.Deferred()
+            waiters.append(waiter)
+            return waiter
+        waiters = _IN_FLIGHT[key] = []
+
+        def done(result):
+            del _IN_FLIGHT[key]
+            if not isinstance(result, failure.Failure):
+                store(key, result)
+            for waiter in waiters:
+                waiter.callback(result)
+            return result
+        return defer.maybeDeferred(f, *args, **kwargs).addBoth(done)
     return wrapper
@@ -1,7 +1,9 @@
+from bisect import bisect_left, bisect_right
 from time import time
 from twisted.internet import defer
 from moira.graphite import datalib
 from moira import config
+from moira.db import WriteBuffer
 from moira.checker import expression
 from moira.checker import state
 from moira.checker import event
@@ -23,6 +25,8 @@ def trigger(trigger, fromTime, now, cache_ttl):
     fromTime = str(fromTime - (trigger.ttl or 600))
     requestContext = datalib.createRequestContext(fromTime, endTime=str(now), allowRealTimeAlerting=trigger.is_simple)
 
+    # writes of the check are sent in one transaction at the end
+    writes = WriteBuffer()
     check = {
         "metrics": trigger.last_check["metrics"].copy(),
         "state": state.OK,
@@ -33,15 +37,17 @@ def trigger(trigger, fromTime, now, cache_ttl):
     try:
         time_series = yield trigger.get_timeseries(requestContext)
 
-        for metric in requestContext['metrics']:
-            yield trigger.db.cleanupMetricValues(metric, now - config.METRICS_TTL,
-                                                 cache_key=metric, cache_ttl=cache_ttl)
+        # old values are removed by RetentionSweeper if it is enabled
+        if config.RETENTION_SWEEP_INTERVAL <= 0:
+            for metric in requestContext['metrics']:
+                yield trigger.db.cleanupMetricValues(metric, now - config.METRICS_TTL,
+                                                     cache_key=metric, cache_ttl=cache_ttl, writes=writes)
 
         if not time_series:
             if trigger.ttl:
                 check["state"] = trigger.ttl_state
                 check["msg"] = "Trigger has no metrics"
-                yield event.compare_states(trigger, check, trigger.last_check, now)
+                yield event.compare_states(trigger, check, trigger.last_check, now, writes=writes)
         else:
 
             for t_series in time_series.values():
@@ -49,6 +55,16 @@ def trigger(trigger, fromTime, now, cache_ttl):
                     if not tN.stub:
                         check["metrics"][tN.name] = tN.last_state.copy()
 
+            targets = len(time_series)
+            warn_value = trigger.struct.get('warn_value')
+            error_value = trigger.struct.get('error_value')
+            evaluate = expression.getCompiledExpression(trigger.struct.get('expression'), targets,
+                                                        warn_value, error_value)
+            evaluate_arrays = None
+            if datalib.arraySeriesEnabled():
+                evaluate_arrays = expression.getArrayExpression(trigger.struct.get('expression'),
+                                                                warn_value, error_value)
+
             for t1 in time_series[1]:
 
                 log.debug("Checking timeserie {name}: {values}", name=t1.name, values=list(t1))
@@ -63,32 +79,39 @@ def trigger(trigger, fromTime, now, cache_ttl):
                                  metric_state.get("event_timestamp", 0))
                 log.debug("Checkpoint for {name}: {checkpoint}", name=t1.name, checkpoint=checkpoint)
 
-                for value_timestamp in xrange(t1.start, now + t1.step, t1.step):
-
-                    if value_timestamp <= checkpoint:
+                timestamps, states = time_series.get_window(t1, checkpoint, now, evaluate, evaluate_arrays,
+                                                            metric_state['state'])
+                changes = [position for position in xrange(1, len(states))
+                           if states[position] != states[position - 1]]
+                position = 0
+                last = len(timestamps) - 1
+
+                while position <= last:
+                    value_timestamp = timestamps[position]
+                    expression_state = states[position]
+
+                    if position < last and not event.is_state_changed(expression_state, metric_state,
+                                                                      t1.last_state, value_timestamp):
+                        # state is kept until next change or reminder, no need to compare states in between
+                        next_position = changes[bisect_right(changes, position)] \
+                            if changes and changes[-1] > position else last
+                        remind_interval = config.BAD_STATES_REMINDER.get(expression_state)
+                        if remind_interval is not None and "event_timestamp" in t1.last_state:
+                            next_position = bisect_left(timestamps, t1.last_state["event_timestamp"] + remind_interval,
+                                                        position + 1, next_position)
+                        position = next_position
                         continue
 
                     expression_values = time_series.get_expression_values(t1, value_timestamp)
-
-                    t1_value = expression_values["t1"]
-
                     log.debug("values for ts {timestamp}: {values}",
                               timestamp=value_timestamp, values=expression_values)
-                    if None in expression_values.values():
-                        continue
-
-                    expression_values.update({'warn_value': trigger.struct.get('warn_value'),
-                                              'error_value': trigger.struct.get('error_value'),
-                                              'PREV_STATE': metric_state['state']})
-
-                    expression_state = expression.getExpression(trigger.struct.get('expression'),
-                                                                **expression_values)
 
                     time_series.update_state(t1, check, expression_state, expression_values, value_timestamp)
 
                     yield event.compare_states(trigger, metric_state, t1.last_state,
-                                               value_timestamp, value=t1_value,
-                                               metric=t1.name)
+                                               value_timestamp, value=expression_values["t1"],
+                                               metric=t1.name, writes=writes)
+                    position += 1
 
                 # compare with last_check timestamp in case if we have not run checker for a long time
                 if trigger.ttl and metric_state["timestamp"] + trigger.ttl < trigger.last_check["timestamp"]:
@@ -100,12 +123,12 @@ def trigger(trigger, fromTime, now, cache_ttl):
                             log.info("Remove metric {name}", name=tName)
                             del check["metrics"][tName]
                         for pattern in trigger.struct.get("patterns"):
-                            yield trigger.db.delPatternMetrics(pattern)
+                            yield trigger.db.delPatternMetrics(pattern, writes=writes)
                         continue
                     time_series.update_state(t1, check, state.to_metric_state(trigger.ttl_state), None,
                                              trigger.last_check["timestamp"] - trigger.ttl)
                     yield event.compare_states(trigger, metric_state, t1.last_state, metric_state["timestamp"],
-                                               metric=t1.name)
+                                               metric=t1.name, writes=writes)
 
     except StopIteration:
         raise
@@ -113,7 +136,8 @@ def trigger(trigger, fromTime, now, cache_ttl):
         log.error("Trigger check failed: {e}", e=e)
         check["state"] = state.EXCEPTION
         check["msg"] = "Trigger evaluation exception"
-        yield event.compare_states(trigger, check, trigger.last_check, now)
+        yield event.compare_states(trigger, check, trigger.last_check, now, writes=writes)
     scores = sum(map(lambda m: state.SCORES[m["state"]], check["metrics"].itervalues()))
     check["score"] = scores + state.SCORES[check["state"]]
-    yield trigger.db.setTriggerLastCheck(trigger.id, check)
+    yield trigger.db.setTriggerLastCheck(trigger.id, check, writes=writes)
+    yield trigger.db.flushWrites(writes)
@@ -6,13 +6,30 @@ from moira.checker import state
 from moira.logs import log
 
 
+def is_reminder_due(state_value, last_state, timestamp):
+    remind_interval = config.BAD_STATES_REMINDER.get(state_value)
+    return remind_interval is not None and timestamp - last_state.get("event_timestamp", timestamp) >= remind_interval
+
+
+def is_state_changed(state_value, current_state, last_state, timestamp):
+    """
+    False if compare_states with current_state in state_value would change nothing
+    """
+    if current_state.get("event_timestamp") is None or state_value != last_state["state"]:
+        return True
+    if is_reminder_due(state_value, last_state, timestamp):
+        return True
+    return bool(last_state.get("suppressed")) and state_value != state.OK
+
+
 @defer.inlineCallbacks
 def compare_states(trigger,
                    current_state,
                    last_state,
                    timestamp,
                    value=None,
-                   metric=None):
+                   metric=None,
+                   writes=None):
     current_state_value = current_state["state"]
     last_state_value = last_state["state"]
     last_state["state"] = current_state_value
@@ -29,13 +46,12 @@ def compare_states(trigger,
     }
 
     if current_state_value == last_state_value:
-        remind_interval = config.BAD_STATES_REMINDER.get(current_state_value)
-        if remind_interval is None or timestamp - last_state.get("event_timestamp", timestamp) < remind_interval:
+        if not is_reminder_due(current_state_value, last_state, timestamp):
             if not last_state.get("suppressed") or current_state_value == state.OK:
                 raise StopIteration
         else:
             event["msg"] = "This metric has been in bad state for more than %s hours - please, fix." % \
-                           (remind_interval / 3600)
+                           (config.BAD_STATES_REMINDER[current_state_value] / 3600)
     current_state["event_timestamp"] = timestamp
     last_state["event_timestamp"] = timestamp
     if value is not None:
@@ -54,7 +70,7 @@ def compare_states(trigger,
                      event=str(event), metric=metric, date=datetime.fromtimestamp(state_maintenance))
         else:
             log.info("Writing new event: {event}", event=str(event))
-            yield trigger.db.pushEvent(event)
+            yield trigger.db.pushEvent(event, writes=writes)
     else:
         current_state["suppressed"] = True
         log.info("Event {event} suppressed due to trigger schedule", event=str(event))
@@ -1,24 +1,30 @@
 import ast
-import operator
 
+from moira import config
+from moira.cache import LRUCache
 from moira.checker import state
+from moira.graphite.datalib import numpy
 
-_default = ast.parse("ERROR if compare_operator(t1, error_value) else \
-    WARN if compare_operator(t1, warn_value) else OK", mode='eval')
-DEFAULT = compile(_default, '<string>', mode='eval')
+DEFAULT = {True: "ERROR if t1 >= error_value else WARN if t1 >= warn_value else OK",
+           False: "ERROR if t1 <= error_value else WARN if t1 <= warn_value else OK"}
+DEFAULT_STATES = [state.OK, state.WARN, state.ERROR]
 
 
 class ExpressionError(Exception):
     pass
 
 
-cache = {}
+cache = None
 
 
-def compile_expression(exp):
-    cached = cache.get(exp)
-    if cached is not None:
-        return cached
+def get_cache():
+    global cache
+    if cache is None:
+        cache = LRUCache(config.EXPRESSION_CACHE_SIZE, float('inf'))
+    return cache
+
+
+def parse_expression(exp):
     _exp = ast.parse(exp)
     nodes = [node for node in ast.walk(_exp)]
     if len(nodes) < 2 or not isinstance(nodes[1], ast.Expr):
@@ -28,22 +34,68 @@ def compile_expression(exp):
             raise ExpressionError("Call method is forbidden")
         if isinstance(node, ast.Lambda):
             raise ExpressionError("Lambda is strongly forbidden")
-    result = compile(exp, '<string>', mode='eval')
-    cache[exp] = result
-    return result
+    return ast.parse(exp, mode='eval').body
 
 
-def getExpression(trigger_expression=None, **kwargs):
+def _lambda(names, body, defaults=()):
+    args = ast.arguments(args=[ast.Name(id=name, ctx=ast.Param()) for name in names],
+                         vararg=None, kwarg=None, defaults=[ast.Name(id=name, ctx=ast.Load()) for name in defaults])
+    return ast.Lambda(args=args, body=body)
+
+
+def compile_expression(exp, targets=1):
+    """
+    Compile expression into factory(warn_value, error_value) of functions(t1, ..., tN, PREV_STATE)
+    """
+    names = ["t%s" % target_number for target_number in xrange(1, targets + 1)] + ["PREV_STATE"]
+    factory = _lambda(["warn_value", "error_value"], _lambda(names, parse_expression(exp), ["None"]))
+    tree = ast.fix_missing_locations(ast.Expression(body=factory))
     global_dict = {"OK": state.OK,
                    "WARN": state.WARN,
                    "WARNING": state.WARN,
                    "ERROR": state.ERROR,
                    "NODATA": state.NODATA}
-    for k, v in kwargs.iteritems():
-        global_dict[k] = v
+    return eval(compile(tree, '<string>', mode='eval'), global_dict)
+
+
+def getCompiledExpression(trigger_expression, targets, warn_value, error_value):
+    """
+    Function of t1, ..., tN values and PREV_STATE returning trigger state.
+    Default expression compares with thresholds in the direction fixed by warn_value and error_value.
+    """
     if not trigger_expression:
-        global_dict['compare_operator'] = operator.ge if global_dict['warn_value'] <= global_dict['error_value'] \
-            else operator.le
-        return eval(DEFAULT, global_dict)
-    else:
-        return eval(compile_expression(trigger_expression), global_dict)
+        trigger_expression = DEFAULT[warn_value <= error_value]
+    key = (trigger_expression, targets)
+    expressions = get_cache()
+    factory = expressions.get(key)
+    if factory is None:
+        factory = compile_expression(trigger_expression, targets)
+        expressions.set(key, factory)
+    return factory(warn_value, error_value)
+
+
+def getExpression(trigger_expression=None, **kwargs):
+    values = []
+    while "t%s" % (len(values) + 1) in kwargs:
+        values.append(kwargs["t%s" % (len(values) + 1)])
+    function = getCompiledExpression(trigger_expression, len(values),
+                                     kwargs.get('warn_value'), kwargs.get('error_value'))
+    return function(*values, PREV_STATE=kwargs.get('PREV_STATE'))
+
+
+def getArrayExpression(trigger_expression, warn_value, error_value):
+    """
+    Function of t1, ..., tN float arrays returning array of states, None if expression can't be vectorized.
+    Only default expression with numeric thresholds is vectorized.
+    """
+    if trigger_expression or numpy is None:
+        return None
+    if not all(isinstance(value, (int, long, float)) for value in (warn_value, error_value)):
+        return None
+    compare = numpy.greater_equal if warn_value <= error_value else numpy.less_equal
+    states = numpy.array(DEFAULT_STATES, dtype=object)
+
+    def evaluate(t1, *values):
+        with numpy.errstate(invalid='ignore'):
+            return states[numpy.where(compare(t1, error_value), 2, compare(t1, warn_value).astype(int))]
+    return evaluate
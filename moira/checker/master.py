@@ -7,13 +7,160 @@ from twisted.internet import defer, reactor
 from twisted.internet.task import LoopingCall
 
 from moira import config
+from moira.cache import LRUCache
+from moira.db import PATTERN_TRIGGERS_CHANNEL
 from moira.logs import log
 
 
-class MasterProtocol(redis.SubscriberProtocol):
+class PatternTriggersIndex(object):
+
+    """
+    Local pattern -> trigger ids index. Loaded by MasterService on start and every PATTERNS_RESYNC_INTERVAL,
+    updated by messages from PATTERN_TRIGGERS_CHANNEL. Until loaded all lookups are made in Redis.
+    """
+
+    def __init__(self):
+        self.triggers = None
+        self.changed = None
+
+    def __len__(self):
+        return 0 if self.triggers is None else len(self.triggers)
+
+    def clear(self):
+        self.triggers = None
+        self.changed = None
+
+    @defer.inlineCallbacks
+    def load(self, db):
+        self.changed = set()
+        patterns = list((yield db.getPatterns()))
+        results = yield db.getPatternsTriggers(patterns)
+        changed, self.changed = self.changed, None
+        self.triggers = dict((pattern, triggers) for pattern, triggers in zip(patterns, results) if triggers)
+        # changes received while loading may be missed by loaded sets
+        if changed:
+            yield self.update(db, list(changed))
+
+    @defer.inlineCallbacks
+    def update(self, db, patterns):
+        if self.changed is not None:
+            self.changed.update(patterns)
+        if self.triggers is None:
+            raise StopIteration
+        results = yield db.getPatternsTriggers(patterns)
+        for pattern, triggers in zip(patterns, results):
+            if triggers:
+                self.triggers[pattern] = triggers
+            else:
+                self.triggers.pop(pattern, None)
 
     @defer.inlineCallbacks
+    def get(self, db, patterns):
+        """
+        Same as Db.getPatternsTriggers
+        """
+        if self.triggers is None:
+            results = yield db.getPatternsTriggers(patterns)
+            defer.returnValue(results)
+        results = [self.triggers.get(pattern) for pattern in patterns]
+        # metrics of new trigger pattern may come before change message
+        missing = [i for i, triggers in enumerate(results) if triggers is None]
+        if missing:
+            found = yield db.getPatternsTriggers([patterns[i] for i in missing])
+            for i, triggers in zip(missing, found):
+                results[i] = triggers
+                if triggers and self.triggers is not None:
+                    self.triggers[patterns[i]] = triggers
+        defer.returnValue(results)
+
+
+PATTERN_TRIGGERS = PatternTriggersIndex()
+# trigger ids added to check in batch mode during last CHECK_INTERVAL
+SCHEDULED_TRIGGERS = LRUCache(None, 0)
+
+
+class MasterProtocol(redis.SubscriberProtocol):
+
+    batch = None
+
     def messageReceived(self, ignored, channel, message, nocache=False):
+        if channel == PATTERN_TRIGGERS_CHANNEL:
+            return self.patternsChanged(message)
+        if nocache or config.BATCH_INTERVAL <= 0:
+            return self.processMessage(message, nocache)
+        self.factory.db.last_data = reactor.seconds()
+        if self.batch is None:
+            self.batch = ([], [], reactor.callLater(config.BATCH_INTERVAL, self.flushBatch))
+        messages, waiters, _ = self.batch
+        messages.append(message)
+        waiter = defer.Deferred()
+        waiters.append(waiter)
+        if len(messages) >= config.BATCH_SIZE:
+            self.flushBatch()
+        return waiter
+
+    @defer.inlineCallbacks
+    def patternsChanged(self, message):
+        try:
+            patterns = anyjson.deserialize(message)
+            yield PATTERN_TRIGGERS.update(self.factory.db, patterns)
+        except Exception as e:
+            log.error("Failed to update pattern triggers: {e}", e=e)
+
+    @defer.inlineCallbacks
+    def flushBatch(self):
+        messages, waiters, delayed = self.batch
+        self.batch = None
+        if delayed.active():
+            delayed.cancel()
+        try:
+            yield self.processBatch(messages)
+        except Exception as e:
+            log.error("Failed to receive metrics: {e}", e=e)
+        for waiter in waiters:
+            waiter.callback(None)
+
+    @defer.inlineCallbacks
+    def processBatch(self, messages):
+        db = self.factory.db
+        pattern_metrics = {}
+        for message in messages:
+            try:
+                json = anyjson.deserialize(message)
+                pattern_metrics.setdefault(json["pattern"], set()).add(json["metric"])
+            except Exception as e:
+                log.error("Failed to receive metric: {e}", e=e)
+
+        patterns = list(pattern_metrics)
+        pattern_triggers = dict(zip(patterns, (yield PATTERN_TRIGGERS.get(db, patterns))))
+
+        ttl = config.CHECK_INTERVAL
+        trigger_ids = set()
+        for triggers in pattern_triggers.itervalues():
+            trigger_ids.update(triggers)
+        trigger_ids = set(trigger_id for trigger_id in trigger_ids
+                          if SCHEDULED_TRIGGERS.get(trigger_id, ttl=ttl) is None)
+        yield db.addPatternsMetricsAndTriggerChecks(
+            dict((pattern, metrics) for pattern, metrics in pattern_metrics.iteritems() if pattern_triggers[pattern]),
+            trigger_ids)
+        for trigger_id in trigger_ids:
+            SCHEDULED_TRIGGERS.set(trigger_id, True)
+
+        for pattern, triggers in pattern_triggers.iteritems():
+            if not triggers:
+                yield self.removePattern(pattern)
+
+    @defer.inlineCallbacks
+    def removePattern(self, pattern):
+        db = self.factory.db
+        yield db.removePattern(pattern)
+        metrics = yield db.getPatternMetrics(pattern)
+        for metric in metrics:
+            yield db.delMetric(metric)
+        yield db.delPatternMetrics(pattern)
+
+    @defer.inlineCallbacks
+    def processMessage(self, message, nocache=False):
         try:
             json = anyjson.deserialize(message)
             db = self.factory.db
@@ -21,13 +168,9 @@ class MasterProtocol(redis.SubscriberProtocol):
             pattern = json["pattern"]
             metric = json["metric"]
             yield db.addPatternMetric(pattern, metric)
-            triggers = yield db.getPatternTriggers(pattern)
+            [triggers] = yield PATTERN_TRIGGERS.get(db, [pattern])
             if not triggers:
-                yield db.removePattern(pattern)
-                metrics = yield db.getPatternMetrics(pattern)
-                for metric in metrics:
-                    yield db.delMetric(metric)
-                yield db.delPatternMetrics(pattern)
+                yield self.removePattern(pattern)
 
             for trigger_id in triggers:
                 if nocache:
@@ -55,10 +198,20 @@ class MasterService(service.Service):
         yield self.db.startService()
         yield reactor.connectTCP(config.REDIS_HOST, config.REDIS_PORT, factory)
         self.rc = yield factory.deferred
-        yield self.rc.subscribe(self.channel)
+        yield self.rc.subscribe([self.channel, PATTERN_TRIGGERS_CHANNEL])
         log.info('Subscribed to {channel}', channel=self.channel)
         self.lc = LoopingCall(self.checkNoData)
         self.nodata_check = self.lc.start(config.NODATA_CHECK_INTERVAL, now=True)
+        self.resync_lc = LoopingCall(self.resyncPatterns)
+        self.resync = self.resync_lc.start(config.PATTERNS_RESYNC_INTERVAL, now=True)
+
+    @defer.inlineCallbacks
+    def resyncPatterns(self):
+        try:
+            yield PATTERN_TRIGGERS.load(self.db)
+            log.info("Loaded triggers of {count} patterns", count=len(PATTERN_TRIGGERS))
+        except Exception as e:
+            log.error("Pattern triggers resync failed: {e}", e=e)
 
     @defer.inlineCallbacks
     def checkNoData(self):
@@ -79,4 +232,6 @@ class MasterService(service.Service):
     def stopService(self):
         yield self.lc.stop()
         yield self.nodata_check
+        yield self.resync_lc.stop()
+        yield self.resync
         yield self.rc.disconnect()
@@ -0,0 +1,183 @@
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+
+from twisted.internet import defer
+
+from moira import config
+from moira.metrics import spy
+
+
+# approximate memory taken by a point besides its member string
+POINT_BYTES = 64
+
+
+class MetricWindow(object):
+
+    """
+    Sorted by timestamp metric points read from Redis since start
+    """
+
+    def __init__(self, start):
+        self.start = start
+        self.scores = []
+        self.members = []
+        self.bytes = 0
+
+    def __len__(self):
+        return len(self.scores)
+
+    def weigh(self, members):
+        return sum(len(member) for member in members) + POINT_BYTES * len(members)
+
+    def tail(self):
+        # late points within CHECKPOINT_GAP may still change the check result
+        return max(self.start, self.scores[-1] - config.CHECKPOINT_GAP) if self.scores else self.start
+
+    def prepend(self, points):
+        points = [(member, score) for member, score in points if score < self.start]
+        self.members[:0] = [member for member, _ in points]
+        self.scores[:0] = [score for _, score in points]
+        self.bytes += self.weigh(self.members[:len(points)])
+
+    def extend(self, fromTime, points):
+        del self.scores[bisect_left(self.scores, fromTime):]
+        self.bytes -= self.weigh(self.members[len(self.scores):])
+        del self.members[len(self.scores):]
+        self.members.extend(member for member, _ in points)
+        self.scores.extend(score for _, score in points)
+        self.bytes += self.weigh(self.members[len(self.members) - len(points):])
+
+    def trim(self, toTime):
+        if toTime <= self.start:
+            return
+        index = bisect_left(self.scores, toTime)
+        del self.scores[:index]
+        self.bytes -= self.weigh(self.members[:index])
+        del self.members[:index]
+        self.start = toTime
+
+    def get(self, startTime, endTime):
+        begin = bisect_left(self.scores, startTime)
+        end = bisect_right(self.scores, endTime)
+        return zip(self.members[begin:end], self.scores[begin:end])
+
+
+class MetricsCache(object):
+
+    """
+    Per worker cache of metric points with LRU eviction. For metrics already in cache
+    only points after the last cached timestamp (less CHECKPOINT_GAP) are read from Redis.
+    Cache size is a number of points. Windows are updated synchronously before and after
+    the read, reads of the same metric wait for the one in flight, other reads run concurrently.
+    """
+
+    def __init__(self, db, size=None):
+        self.db = db
+        self.size = config.METRICS_CACHE_SIZE if size is None else size
+        self.windows = OrderedDict()
+        self.weight = 0
+        # metric -> Deferred fired when the read of its window is over
+        self.fetching = {}
+
+    @property
+    def points(self):
+        return self.weight
+
+    def weigh(self, window):
+        return len(window)
+
+    def report(self, fetched, served, hits, misses):
+        spy.METRICS_CACHE_FETCHED.report(fetched)
+        spy.METRICS_CACHE_SERVED.report(served)
+
+    def update(self, metric, window, change, *args):
+        # weight of windows evicted during the read is already taken off
+        weight = self.weigh(window)
+        change(*args)
+        if self.windows.get(metric) is window:
+            self.weight += self.weigh(window) - weight
+
+    @defer.inlineCallbacks
+    def getMetricsValues(self, metrics, startTime, endTime):
+        """
+        Same as Db.getMetricsValues
+        """
+        names = list(OrderedDict.fromkeys(metrics))
+        fetching = [self.fetching[metric] for metric in names if metric in self.fetching]
+        while fetching:
+            yield defer.DeferredList(fetching)
+            fetching = [self.fetching[metric] for metric in names if metric in self.fetching]
+
+        # points older than METRICS_TTL are removed from Redis by checker anyway
+        oldest = endTime - config.METRICS_TTL
+        heads = []
+        tails = []
+        windows = {}
+        # metrics with windows covering startTime
+        hits = 0
+        for metric in names:
+            window = self.windows.pop(metric, None)
+            if window is None:
+                window = MetricWindow(startTime)
+            elif window.start <= startTime:
+                hits += 1
+            self.windows[metric] = window
+            windows[metric] = window
+            self.update(metric, window, window.trim, min(oldest, startTime))
+            if startTime < window.start:
+                heads.append((metric, window, (metric, startTime, "(%s" % window.start)))
+            fromTime = window.tail()
+            if fromTime <= endTime:
+                tails.append((metric, window, fromTime, (metric, fromTime, endTime)))
+
+        ranges = [r for _, _, r in heads] + [r for _, _, _, r in tails]
+        done = defer.Deferred()
+        for metric in names:
+            self.fetching[metric] = done
+        fetched = 0
+        try:
+            results = (yield self.db.getMetricsValuesRanges(ranges)) if ranges else []
+            for (metric, window, (_, headStart, _)), points in zip(heads, results):
+                self.update(metric, window, self.prepend, window, headStart, points)
+                fetched += len(points)
+            for (metric, window, fromTime, _), points in zip(tails, results[len(heads):]):
+                self.update(metric, window, window.extend, fromTime, points)
+                fetched += len(points)
+        finally:
+            for metric in names:
+                del self.fetching[metric]
+            done.callback(None)
+
+        dataList = [windows[metric].get(startTime, endTime) for metric in metrics]
+        self.report(fetched, sum(len(data) for data in dataList), hits, len(names) - hits)
+
+        while self.weight > self.size and self.windows:
+            _, window = self.windows.popitem(last=False)
+            self.weight -= self.weigh(window)
+
+        defer.returnValue(dataList)
+
+    def prepend(self, window, start, points):
+        window.prepend(points)
+        window.start = start
+
+
+class HistoryCache(MetricsCache):
+
+    """
+    Metric points cache for shifted and bootstrap windows of timeShift, timeStack
+    and functions fetching data before the check interval. These windows are kept
+    apart from check windows, so checks do not trim them. Cache size is in bytes.
+    """
+
+    def __init__(self, db, size=None):
+        MetricsCache.__init__(self, db, config.HISTORY_CACHE_BYTES if size is None else size)
+
+    def weigh(self, window):
+        return window.bytes
+
+    def report(self, fetched, served, hits, misses):
+        spy.HISTORY_CACHE_FETCHED.report(fetched)
+        spy.HISTORY_CACHE_SERVED.report(served)
+        spy.HISTORY_CACHE_HITS.report(hits)
+        spy.HISTORY_CACHE_MISSES.report(misses)
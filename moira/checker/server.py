@@ -10,7 +10,9 @@ from twisted.internet.protocol import ProcessProtocol
 from moira import config
 from moira import logs
 from moira.logs import log
+from moira.metrics import graphite, spy
 from moira.checker.master import MasterService
+from moira.checker.sweeper import RetentionSweeper
 from moira.checker.worker import check
 from moira.db import Db
 
@@ -63,6 +65,21 @@ def run():
     sub_service = MasterService(db)
     sub_service.setServiceParent(top_service)
 
+    if config.RETENTION_SWEEP_INTERVAL > 0:
+        sweeper = RetentionSweeper(db)
+        sweeper.setServiceParent(top_service)
+
+        def get_metrics():
+            return [
+                ("checker.retention_sweep.keys.%s" % config.HOSTNAME,
+                    spy.RETENTION_SWEEP_KEYS.get_metrics()["sum"]),
+                ("checker.retention_sweep.deleted.%s" % config.HOSTNAME,
+                    spy.RETENTION_SWEEP_DELETED.get_metrics()["sum"]),
+                ("checker.retention_sweep.bytes.%s" % config.HOSTNAME,
+                    spy.RETENTION_SWEEP_BYTES.get_metrics()["sum"])]
+
+        graphite.sending(get_metrics)
+
     top_service.startService()
 
     reactor.addSystemEventTrigger('before', 'shutdown', top_service.stopService)
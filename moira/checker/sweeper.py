@@ -0,0 +1,84 @@
+from twisted.application import service
+from twisted.internet import defer, reactor
+from twisted.internet.task import LoopingCall, deferLater
+
+from moira import config
+from moira.logs import log
+from moira.metrics import spy
+
+
+# approximate memory taken by a value in a sorted set of metric values
+VALUE_BYTES = 64
+
+
+class RetentionSweeper(service.Service):
+
+    """
+    Removes metric values older than METRICS_TTL every RETENTION_SWEEP_INTERVAL instead of trigger checks.
+    Metrics are walked with SCAN and trimmed in pipelined batches of RETENTION_SWEEP_BATCH,
+    sending at most RETENTION_SWEEP_OPS redis commands per second. Removed values are not read,
+    reclaimed memory is estimated as VALUE_BYTES per value.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.lc = None
+        self.sweeping = None
+        self.stopping = False
+
+    def startService(self):
+        service.Service.startService(self)
+        self.stopping = False
+        self.lc = LoopingCall(self.sweep)
+        self.sweeping = self.lc.start(config.RETENTION_SWEEP_INTERVAL, now=False)
+
+    @defer.inlineCallbacks
+    def sweep(self):
+        try:
+            keys, deleted, size = yield self.sweepOnce()
+            log.info("Retention sweep trimmed {keys} metrics, deleted {deleted}, reclaimed about {size} bytes",
+                     keys=keys, deleted=deleted, size=size)
+        except Exception as e:
+            log.error("Retention sweep failed: {e}", e=e)
+
+    @defer.inlineCallbacks
+    def sweepOnce(self, now=None):
+        """
+        Single pass over all metrics, returns count of trimmed and deleted metrics and estimated bytes of removed values
+        """
+        toTime = int(now or reactor.seconds()) - config.METRICS_TTL
+        total_keys = total_deleted = total_size = 0
+        cursor = 0
+        while not self.stopping:
+            started = reactor.seconds()
+            cursor, metrics = yield self.db.scanMetrics(cursor, config.RETENTION_SWEEP_BATCH)
+            results = yield self.db.cleanupMetricsValues(metrics, toTime)
+            keys = deleted = size = 0
+            for removed, left in results:
+                if removed:
+                    keys += 1
+                    size += removed * VALUE_BYTES
+                    if not left:
+                        deleted += 1
+            spy.RETENTION_SWEEP_KEYS.report(keys)
+            spy.RETENTION_SWEEP_DELETED.report(deleted)
+            spy.RETENTION_SWEEP_BYTES.report(size)
+            total_keys += keys
+            total_deleted += deleted
+            total_size += size
+            if cursor == 0:
+                break
+            if config.RETENTION_SWEEP_OPS > 0:
+                # scan and two commands per metric
+                delay = float(1 + 2 * len(metrics)) / config.RETENTION_SWEEP_OPS - (reactor.seconds() - started)
+                if delay > 0:
+                    yield deferLater(reactor, delay, lambda: None)
+        defer.returnValue((total_keys, total_deleted, total_size))
+
+    @defer.inlineCallbacks
+    def stopService(self):
+        self.stopping = True
+        if self.lc is not None and self.lc.running:
+            self.lc.stop()
+        yield self.sweeping
+        service.Service.stopService(self)
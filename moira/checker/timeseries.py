@@ -1,20 +1,71 @@
+from moira.graphite.datalib import ArrayTimeSeries, numpy
+
+
 class TargetTimeSeries(dict):
 
     def __init__(self, *arg, **kwargs):
         super(TargetTimeSeries, self).__init__(*arg, **kwargs)
         self.other_targets_names = {}
 
-    def get_expression_values(self, t1, timestamp):
-        expression_values = {}
-        for target_number in xrange(1, len(self) + 1):
-            target_name = "t%s" % target_number
-            tN = self[target_number][0] if target_number > 1 else t1
+    def get_targets(self, t1):
+        return [t1] + [self[target_number][0] for target_number in xrange(2, len(self) + 1)]
+
+    def get_values(self, targets, timestamp):
+        values = []
+        for tN in targets:
             value_index = (timestamp - tN.start) / tN.step
-            tN_value = tN[value_index] if len(tN) > value_index else None
-            expression_values[target_name] = tN_value
+            tN_value = tN[value_index] if 0 <= value_index < len(tN) else None
+            values.append(tN_value)
             if tN_value is None:
                 break
-        return expression_values
+        return values
+
+    def get_expression_values(self, t1, timestamp):
+        values = self.get_values(self.get_targets(t1), timestamp)
+        return dict(("t%s" % (target_number + 1), value) for target_number, value in enumerate(values))
+
+    def get_window(self, t1, checkpoint, now, evaluate, evaluate_arrays=None, prev_state=None):
+        """
+        Timestamps and states of t1 points after checkpoint up to now with values of all targets.
+        evaluate takes t1, ..., tN values and PREV_STATE, evaluate_arrays takes aligned float arrays.
+        """
+        start = t1.start
+        if checkpoint >= start:
+            start += (int(checkpoint - start) / t1.step + 1) * t1.step
+        targets = self.get_targets(t1)
+        if evaluate_arrays is not None:
+            return self.get_array_window(targets, start, now, evaluate_arrays)
+        timestamps = []
+        states = []
+        for timestamp in xrange(start, now + t1.step, t1.step):
+            values = self.get_values(targets, timestamp)
+            if len(values) < len(targets) or values[-1] is None:
+                continue
+            prev_state = evaluate(*values, PREV_STATE=prev_state)
+            timestamps.append(timestamp)
+            states.append(prev_state)
+        return timestamps, states
+
+    def get_array_window(self, targets, start, now, evaluate_arrays):
+        timestamps = numpy.arange(start, now + targets[0].step, targets[0].step)
+        known = numpy.ones(len(timestamps), dtype=bool)
+        arrays = []
+        for tN in targets:
+            if isinstance(tN, ArrayTimeSeries):
+                values = tN.values
+                missing = numpy.isnan(values)
+            else:
+                values = numpy.array(list(tN.rawIter()), dtype=numpy.float64)
+                missing = numpy.fromiter((value is None for value in tN.rawIter()), dtype=bool, count=len(values))
+            value_indexes = (timestamps - tN.start) // tN.step
+            inside = (value_indexes >= 0) & (value_indexes < len(values))
+            if len(values) == 0:
+                values, missing = numpy.array([numpy.nan]), numpy.array([True])
+            value_indexes = numpy.where(inside, value_indexes, 0)
+            known &= inside & ~missing[value_indexes]
+            arrays.append(values[value_indexes])
+        states = evaluate_arrays(*arrays)
+        return timestamps[known].tolist(), states[known].tolist()
 
     def set_state_value(self, metric_state, expression_values, tN):
         if expression_values is None:
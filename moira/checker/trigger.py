@@ -1,6 +1,6 @@
 from datetime import datetime, timedelta
 
-from moira.graphite.evaluator import evaluateTarget
+from moira.graphite.evaluator import evaluateTarget, prefetchTargets
 from twisted.internet import defer
 
 from moira.checker import state
@@ -17,21 +17,19 @@ class Trigger(object):
     @defer.inlineCallbacks
     def init(self, now, fromTime=None):
         self.maintenance = 0
-        json, self.struct = yield self.db.getTrigger(self.id)
+        json, self.struct, self.last_check, tags = yield self.db.getTriggerContext(self.id)
         if json is None:
             defer.returnValue(False)
 
         self.is_simple = self.struct.get("is_simple_trigger", False)
 
         for tag in self.struct["tags"]:
-            tag_data = yield self.db.getTag(tag)
-            maintenance = tag_data.get('maintenance', 0)
+            maintenance = tags[tag].get('maintenance', 0)
             if maintenance > self.maintenance:
                 self.maintenance = maintenance
                 break
         self.ttl = self.struct.get("ttl")
         self.ttl_state = self.struct.get("ttl_state", state.NODATA)
-        self.last_check = yield self.db.getTriggerLastCheck(self.id)
         begin = (fromTime or now) - 3600
         if self.last_check is None:
             self.last_check = {
@@ -49,6 +47,7 @@ class Trigger(object):
         target_time_series = TargetTimeSeries()
         target_number = 1
 
+        yield prefetchTargets(requestContext, targets)
         for target in targets:
             time_series = yield evaluateTarget(requestContext, target)
 
@@ -2,9 +2,10 @@ import random
 
 from twisted.internet import defer, reactor, task
 
-from moira.graphite import datalib
-from moira import config
+from moira.graphite import datalib, evaluator
+from moira import cache, config
 from moira.checker.trigger import Trigger
+from moira.checker.metrics_cache import MetricsCache, HistoryCache
 from moira.db import Db
 from moira.metrics import spy, graphite
 from moira import logs
@@ -19,6 +20,9 @@ class TriggersCheck:
 
     def __init__(self, db):
         self.db = db
+        self.slots = defer.DeferredSemaphore(config.MAX_PARALLEL_CHECKS)
+        # checks still running
+        self.checks = set()
 
     def start(self):
         self.t = task.LoopingCall(self.perform)
@@ -32,18 +36,24 @@ class TriggersCheck:
 
     @defer.inlineCallbacks
     def perform(self):
+        # checks of a cycle share results of identical targets
+        evaluator.memo = evaluator.EvaluationMemo()
         try:
-            trigger_id = yield self.db.getTriggerToCheck()
-            while trigger_id is not None:
-                acquired = yield self.db.setTriggerCheckLock(trigger_id)
-                if acquired is not None:
-                    start = reactor.seconds()
-                    trigger = Trigger(trigger_id, self.db)
-                    yield trigger.check()
-                    end = reactor.seconds()
-                    yield self.db.delTriggerCheckLock(trigger_id)
-                    spy.TRIGGER_CHECK.report(end - start)
-                trigger_id = yield self.db.getTriggerToCheck()
+            trigger_ids = yield self.getTriggersToCheck()
+            while trigger_ids:
+                try:
+                    acquired = yield self.db.setTriggersCheckLock(trigger_ids)
+                except Exception:
+                    for _ in trigger_ids:
+                        self.slots.release()
+                    raise
+                for trigger_id in trigger_ids:
+                    if trigger_id in acquired:
+                        self.startCheck(trigger_id)
+                    else:
+                        self.slots.release()
+                trigger_ids = yield self.getTriggersToCheck()
+            yield defer.DeferredList(list(self.checks))
             yield task.deferLater(reactor, random.uniform(PERFORM_INTERVAL * 10, PERFORM_INTERVAL * 20), lambda: None)
         except GeneratorExit:
             pass
@@ -51,12 +61,55 @@ class TriggersCheck:
             spy.TRIGGER_CHECK_ERRORS.report(0)
             log.error("Failed to perform triggers check: {e}", e=e)
             yield task.deferLater(reactor, ERROR_TIMEOUT, lambda: None)
+        finally:
+            evaluator.memo = None
+
+    @defer.inlineCallbacks
+    def getTriggersToCheck(self):
+        # wait for a free slot and pop as many triggers as there are free slots
+        yield self.slots.acquire()
+        try:
+            trigger_ids = yield self.db.getTriggersToCheck(self.slots.tokens + 1)
+        except Exception:
+            self.slots.release()
+            raise
+        if not trigger_ids:
+            self.slots.release()
+        for _ in trigger_ids[1:]:
+            self.slots.acquire()
+        defer.returnValue(trigger_ids)
+
+    def startCheck(self, trigger_id):
+        check = self.checkTrigger(trigger_id)
+        if not check.called:
+            self.checks.add(check)
+            check.addBoth(lambda _: self.checks.discard(check))
+
+    @defer.inlineCallbacks
+    def checkTrigger(self, trigger_id):
+        # errors are reported per trigger, failed trigger stays locked until the lock expires
+        try:
+            start = reactor.seconds()
+            trigger = Trigger(trigger_id, self.db)
+            yield trigger.check()
+            end = reactor.seconds()
+            yield self.db.delTriggerCheckLock(trigger_id)
+            spy.TRIGGER_CHECK.report(end - start)
+        except Exception as e:
+            spy.TRIGGER_CHECK_ERRORS.report(0)
+            log.error("Failed to check trigger {id}: {e}", id=trigger_id, e=e)
+        finally:
+            self.slots.release()
 
 
 def run(callback):
 
     db = Db()
     datalib.db = db
+    if config.METRICS_CACHE_SIZE:
+        datalib.metrics_cache = MetricsCache(db)
+    if config.HISTORY_CACHE_BYTES:
+        datalib.history_cache = HistoryCache(db)
     init = db.startService()
     init.addCallback(callback)
 
@@ -78,7 +131,67 @@ def main(number):
             ("checker.errors.%s.%s" %
              (config.HOSTNAME,
               number),
-                spy.TRIGGER_CHECK_ERRORS.get_metrics()["count"])]
+                spy.TRIGGER_CHECK_ERRORS.get_metrics()["count"]),
+            ("checker.metrics_cache.fetched.%s.%s" %
+             (config.HOSTNAME,
+              number),
+                spy.METRICS_CACHE_FETCHED.get_metrics()["sum"]),
+            ("checker.metrics_cache.served.%s.%s" %
+             (config.HOSTNAME,
+              number),
+                spy.METRICS_CACHE_SERVED.get_metrics()["sum"]),
+            ("checker.history_cache.fetched.%s.%s" %
+             (config.HOSTNAME,
+              number),
+                spy.HISTORY_CACHE_FETCHED.get_metrics()["sum"]),
+            ("checker.history_cache.served.%s.%s" %
+             (config.HOSTNAME,
+              number),
+                spy.HISTORY_CACHE_SERVED.get_metrics()["sum"]),
+            ("checker.history_cache.hits.%s.%s" %
+             (config.HOSTNAME,
+              number),
+                spy.HISTORY_CACHE_HITS.get_metrics()["sum"]),
+            ("checker.history_cache.misses.%s.%s" %
+             (config.HOSTNAME,
+              number),
+                spy.HISTORY_CACHE_MISSES.get_metrics()["sum"]),
+            ("checker.history_cache.bytes.%s.%s" %
+             (config.HOSTNAME,
+              number),
+                datalib.history_cache.weight if datalib.history_cache else 0),
+            ("checker.evaluation_memo.hits.%s.%s" %
+             (config.HOSTNAME,
+              number),
+                spy.EVALUATION_MEMO_HITS.get_metrics()["count"]),
+            ("checker.evaluation_memo.misses.%s.%s" %
+             (config.HOSTNAME,
+              number),
+                spy.EVALUATION_MEMO_MISSES.get_metrics()["count"]),
+            ("checker.plans.hits.%s.%s" %
+             (config.HOSTNAME,
+              number),
+                evaluator.plans.hits),
+            ("checker.plans.misses.%s.%s" %
+             (config.HOSTNAME,
+              number),
+                evaluator.plans.misses),
+            ("checker.cache.hits.%s.%s" %
+             (config.HOSTNAME,
+              number),
+                spy.CACHE_HITS.get_metrics()["count"]),
+            ("checker.cache.misses.%s.%s" %
+             (config.HOSTNAME,
+              number),
+                spy.CACHE_MISSES.get_metrics()["count"]),
+            ("checker.cache.evictions.%s.%s" %
+             (config.HOSTNAME,
+              number),
+                spy.CACHE_EVICTIONS.get_metrics()["sum"]),
+            ("checker.cache.size.%s.%s" %
+             (config.HOSTNAME,
+              number),
+                len(cache.CACHE))]
 
     graphite.sending(get_metrics)
 
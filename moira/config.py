@@ -42,6 +42,27 @@ CHECKPOINT_GAP = 120
 PREFIX = "/api"
 HOSTNAME = socket.gethostname().split('.')[0]
 BAD_STATES_REMINDER = {'ERROR': 86400, 'NODATA': 86400}
+ARRAY_SERIES = True
+METRICS_CACHE_SIZE = 1000000
+PLAN_CACHE_SIZE = 10000
+RETENTION_CACHE_SIZE = 100000
+RETENTION_CACHE_TTL = 60
+CACHE_SIZE = 100000
+BATCH_INTERVAL = 0
+BATCH_SIZE = 1000
+PATTERNS_RESYNC_INTERVAL = 600
+MAX_PARALLEL_CHECKS = 10
+HOLT_WINTERS_CACHE_SIZE = 1000
+HISTORY_CACHE_BYTES = 256 * 1024 * 1024
+EVALUATION_MEMO_SIZE = 10000
+EXPRESSION_CACHE_SIZE = 1000
+RETENTION_SWEEP_INTERVAL = 0
+RETENTION_SWEEP_OPS = 1000
+RETENTION_SWEEP_BATCH = 500
+TAG_CACHE_SIZE = 10000
+# tag data is cached by each process, setTag clears only the cache of the process handling the request,
+# so checker workers see changed tag data such as maintenance up to TAG_CACHE_TTL seconds later
+TAG_CACHE_TTL = 10
 ARGS = None
 
 
@@ -72,6 +93,25 @@ def read():
     global ARGS
     global STOP_CHECKING_INTERVAL
     global CONFIG_PATH
+    global ARRAY_SERIES
+    global METRICS_CACHE_SIZE
+    global PLAN_CACHE_SIZE
+    global RETENTION_CACHE_SIZE
+    global RETENTION_CACHE_TTL
+    global CACHE_SIZE
+    global BATCH_INTERVAL
+    global BATCH_SIZE
+    global PATTERNS_RESYNC_INTERVAL
+    global MAX_PARALLEL_CHECKS
+    global HOLT_WINTERS_CACHE_SIZE
+    global HISTORY_CACHE_BYTES
+    global EVALUATION_MEMO_SIZE
+    global EXPRESSION_CACHE_SIZE
+    global RETENTION_SWEEP_INTERVAL
+    global RETENTION_SWEEP_OPS
+    global RETENTION_SWEEP_BATCH
+    global TAG_CACHE_SIZE
+    global TAG_CACHE_TTL
 
     parser = get_parser()
     args = parser.parse_args()
@@ -101,6 +141,25 @@ def read():
             CHECK_INTERVAL = cfg['checker'].get('check_interval', 5)
             METRICS_TTL = cfg['checker'].get('metrics_ttl', 3600)
             STOP_CHECKING_INTERVAL = cfg['checker'].get('stop_checking_interval', 30)
+            ARRAY_SERIES = cfg['checker'].get('array_series', True)
+            METRICS_CACHE_SIZE = cfg['checker'].get('metrics_cache_size', 1000000)
+            PLAN_CACHE_SIZE = cfg['checker'].get('plan_cache_size', 10000)
+            RETENTION_CACHE_SIZE = cfg['checker'].get('retention_cache_size', 100000)
+            RETENTION_CACHE_TTL = cfg['checker'].get('retention_cache_ttl', 60)
+            CACHE_SIZE = cfg['checker'].get('cache_size', 100000)
+            BATCH_INTERVAL = cfg['checker'].get('batch_interval', 0)
+            BATCH_SIZE = cfg['checker'].get('batch_size', 1000)
+            PATTERNS_RESYNC_INTERVAL = cfg['checker'].get('patterns_resync_interval', 600)
+            MAX_PARALLEL_CHECKS = cfg['checker'].get('max_parallel_checks', 10)
+            HOLT_WINTERS_CACHE_SIZE = cfg['checker'].get('holt_winters_cache_size', 1000)
+            HISTORY_CACHE_BYTES = cfg['checker'].get('history_cache_bytes', 256 * 1024 * 1024)
+            EVALUATION_MEMO_SIZE = cfg['checker'].get('evaluation_memo_size', 10000)
+            EXPRESSION_CACHE_SIZE = cfg['checker'].get('expression_cache_size', 1000)
+            RETENTION_SWEEP_INTERVAL = cfg['checker'].get('retention_sweep_interval', 0)
+            RETENTION_SWEEP_OPS = cfg['checker'].get('retention_sweep_ops', 1000)
+            RETENTION_SWEEP_BATCH = cfg['checker'].get('retention_sweep_batch', 500)
+            TAG_CACHE_SIZE = cfg['checker'].get('tag_cache_size', 10000)
+            TAG_CACHE_TTL = cfg['checker'].get('tag_cache_ttl', 10)
 
     if args.l:
         LOG_DIRECTORY = args.l
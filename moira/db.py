@@ -9,7 +9,8 @@ from twisted.application import service
 from twisted.internet import defer, task, reactor
 
 from moira import config
-from moira.cache import cache
+from moira.cache import cache, store, LRUCache
+from moira.graphite import evaluator
 from moira import logs
 from moira.trigger import trigger_reformat
 
@@ -75,6 +76,7 @@ TAG_PREFIX = "moira-tag:{0}"
 TRIGGER_CHECK_LOCK_PREFIX = "moira-metric-check-lock:{0}"
 TRIGGER_IN_BAD_STATE = "moira-bad-state-triggers"
 CHECKS_COUNTER = "moira-selfstate:checks-counter"
+PATTERN_TRIGGERS_CHANNEL = "moira-pattern-triggers-changes"
 
 TRIGGER_EVENTS_TTL = 3600 * 24 * 30
 
@@ -152,6 +154,35 @@ def audit(f):
     return decorator
 
 
+class WriteBuffer(object):
+
+    """
+    Redis commands of one trigger check queued by Db methods called with writes
+    and sent in a single transaction by Db.flushWrites. Results of cached calls
+    which queued them are kept in cached until then.
+    """
+
+    def __init__(self):
+        self.commands = []
+        self.queued = set()
+        self.cached = []
+
+    def __len__(self):
+        return len(self.commands)
+
+    def add(self, name, *args, **kwargs):
+        self.commands.append((name, args, kwargs))
+
+    def addOnce(self, name, *args, **kwargs):
+        """
+        Same as add unless the same command is already queued
+        """
+        command = (name, args, tuple(sorted(kwargs.items())))
+        if command not in self.queued:
+            self.queued.add(command)
+            self.add(name, *args, **kwargs)
+
+
 class Db(service.Service):
 
     """
@@ -160,6 +191,8 @@ class Db(service.Service):
 
     def __init__(self):
         self.rc = None
+        self.retentions = LRUCache(config.RETENTION_CACHE_SIZE, config.RETENTION_CACHE_TTL)
+        self.tags = LRUCache(config.TAG_CACHE_SIZE, config.TAG_CACHE_TTL)
 
     @defer.inlineCallbacks
     def startService(self):
@@ -402,7 +435,8 @@ class Db(service.Service):
         TRIGGER_PREFIX.format("<trigger_id>"),
         TRIGGERS,
         PATTERNS,
-        PATTERN_TRIGGERS_PREFIX.format("<pattern>"))
+        PATTERN_TRIGGERS_PREFIX.format("<pattern>"),
+        PATTERN_TRIGGERS_CHANNEL)
     def saveTrigger(self, trigger_id, trigger, existing=None):
         """
         saveTrigger(self, trigger_id, trigger)
@@ -413,6 +447,9 @@ class Db(service.Service):
             - Update patterns set {2}
             - Update trigger patterns set {3}
 
+        Drops compiled plans of old and new trigger targets from the process plan cache
+        and publishes changed patterns to channel {4}
+
         :param trigger: trigger json object
         :type trigger: dict
         :param trigger_id: trigger identity
@@ -445,12 +482,16 @@ class Db(service.Service):
         for tag in tags:
             yield self.addTriggerTag(trigger_id, tag, t)
         yield t.commit()
+        evaluator.plans.invalidate(trigger.get("targets", []))
+        if existing is not None:
+            evaluator.plans.invalidate(existing.get("targets", []))
         for pattern in cleanup_patterns:
             triggers = yield self.getPatternTriggers(pattern)
             if not triggers:
                 yield self.removePatternTriggers(pattern)
                 yield self.removePattern(pattern)
                 yield self.delPatternMetrics(pattern)
+        yield self.publishPatternsChange(set(patterns) | set(cleanup_patterns))
 
     @defer.inlineCallbacks
     @docstring_parameters(PATTERNS)
@@ -492,6 +533,24 @@ class Db(service.Service):
         trigger_id = yield self.rc.spop(TRIGGERS_TO_CHECK)
         defer.returnValue(trigger_id)
 
+    @defer.inlineCallbacks
+    @docstring_parameters(TRIGGERS_TO_CHECK)
+    def getTriggersToCheck(self, count):
+        """
+        getTriggersToCheck(self, count)
+
+        Pop up to *count* trigger ids from set {0} in one pipeline
+
+        :param count: maximum number of trigger ids
+        :type count: int
+        :rtype: list of strings
+        """
+        pipeline = yield self.rc.pipeline()
+        for _ in range(count):
+            pipeline.spop(TRIGGERS_TO_CHECK)
+        results = yield pipeline.execute_pipeline()
+        defer.returnValue([trigger_id for trigger_id in results if trigger_id is not None])
+
     @cache
     @defer.inlineCallbacks
     @docstring_parameters(TRIGGER_PREFIX.format("<trigger_id>"))
@@ -518,6 +577,34 @@ class Db(service.Service):
             trigger = trigger_reformat(trigger, trigger_id, trigger_tags)
         defer.returnValue((json, trigger))
 
+    @defer.inlineCallbacks
+    @docstring_parameters(TRIGGER_PREFIX.format("<trigger_id>"),
+                          TRIGGER_TAGS_PREFIX.format("<trigger_id>"),
+                          LAST_CHECK_PREFIX.format("<trigger_id>"))
+    def getTriggerContext(self, trigger_id):
+        """
+        getTriggerContext(self, trigger_id)
+
+        - Read trigger by key {0}, its tags {1} and last check {2} in one pipeline
+        - Unpack trigger json and last check
+        - Read data of trigger tags, see getTagsData
+
+        :param trigger_id: trigger identity
+        :type trigger_id: string
+        :rtype: tuple(json, trigger, last check, dict of tag data)
+        """
+        pipeline = yield self.rc.pipeline()
+        pipeline.get(TRIGGER_PREFIX.format(trigger_id))
+        pipeline.smembers(TRIGGER_TAGS_PREFIX.format(trigger_id))
+        pipeline.get(LAST_CHECK_PREFIX.format(trigger_id))
+        json, trigger_tags, last_check = yield pipeline.execute_pipeline()
+        if json is None:
+            defer.returnValue((None, {}, None, {}))
+        trigger = trigger_reformat(anyjson.deserialize(json), trigger_id, trigger_tags)
+        last_check = None if last_check is None else anyjson.deserialize(last_check)
+        tags = yield self.getTagsData(trigger["tags"])
+        defer.returnValue((json, trigger, last_check, tags))
+
     @defer.inlineCallbacks
     def _getTriggersChecks(self, triggers_ids):
         triggers = []
@@ -746,6 +833,37 @@ class Db(service.Service):
         tag = yield self.rc.get(TAG_PREFIX.format(tag))
         defer.returnValue({} if tag is None else anyjson.loads(tag))
 
+    @defer.inlineCallbacks
+    @docstring_parameters(TAG_PREFIX.format("<tag>"))
+    def getTagsData(self, tags):
+        """
+        getTagsData(self, tags)
+
+        Returns data of multiple tags from keys {0} read in one pipeline.
+        Data is cached for TAG_CACHE_TTL seconds and shared by all triggers with the tag.
+
+        :type tags: list of strings
+        :rtype: dict of json dicts
+        """
+        result = {}
+        missing = []
+        for tag in tags:
+            data = self.tags.get(tag)
+            if data is None:
+                missing.append(tag)
+            else:
+                result[tag] = data
+        if missing:
+            pipeline = yield self.rc.pipeline()
+            for tag in missing:
+                pipeline.get(TAG_PREFIX.format(tag))
+            results = yield pipeline.execute_pipeline()
+            for tag, data in zip(missing, results):
+                data = {} if data is None else anyjson.loads(data)
+                self.tags.set(tag, data)
+                result[tag] = data
+        defer.returnValue(result)
+
     @audit
     @defer.inlineCallbacks
     @docstring_parameters(TAG_PREFIX)
@@ -760,6 +878,7 @@ class Db(service.Service):
         :rtype: json dict
         """
         yield self.rc.set(TAG_PREFIX.format(tag), anyjson.dumps(data))
+        self.tags.delete(tag)
 
     @defer.inlineCallbacks
     @docstring_parameters(
@@ -841,7 +960,7 @@ class Db(service.Service):
     @audit
     @defer.inlineCallbacks
     @docstring_parameters(TRIGGER_PREFIX.format("<trigger_id>"),
-                          TRIGGERS, PATTERN_TRIGGERS_PREFIX.format("<pattern>"))
+                          TRIGGERS, PATTERN_TRIGGERS_PREFIX.format("<pattern>"), PATTERN_TRIGGERS_CHANNEL)
     def removeTrigger(self, trigger_id, existing=None):
         """
         removeTrigger(self, trigger_id)
@@ -851,6 +970,8 @@ class Db(service.Service):
             - Remove *trigger_id* from set {1}
             - Remove *trigger_id* from set {2}
 
+        Publishes trigger patterns to channel {3}
+
         :param trigger_id: trigger identity
         :type trigger_id: string
         """
@@ -871,6 +992,7 @@ class Db(service.Service):
                     for metric in (yield self.getPatternMetrics(pattern)):
                         yield self.rc.delete(METRIC_PREFIX.format(metric))
                     yield self.rc.delete(PATTERN_METRICS_PREFIX.format(pattern))
+            yield self.publishPatternsChange(existing.get("patterns", []))
 
     @defer.inlineCallbacks
     @docstring_parameters(TRIGGERS)
@@ -903,7 +1025,7 @@ class Db(service.Service):
 
     @defer.inlineCallbacks
     @docstring_parameters(LAST_CHECK_PREFIX.format("<trigger_id>"))
-    def setTriggerLastCheck(self, trigger_id, check):
+    def setTriggerLastCheck(self, trigger_id, check, writes=None):
         """
         setTriggerLastCheck(self, trigger_id, check)
 
@@ -913,17 +1035,43 @@ class Db(service.Service):
         :type trigger_id: string
         :param check: trigger checking result
         :type check: json dict
+        :param writes: buffer to queue commands to instead of sending them
+        :type writes: WriteBuffer
         """
         json = anyjson.serialize(check)
-        t = yield self.rc.multi()
-        yield t.set(LAST_CHECK_PREFIX.format(trigger_id), json)
-        yield t.zadd(TRIGGERS_CHECKS, check.get("score", 0), trigger_id)
-        yield t.incr(CHECKS_COUNTER)
+        flush = writes is None
+        if flush:
+            writes = WriteBuffer()
+        writes.add('set', LAST_CHECK_PREFIX.format(trigger_id), json)
+        writes.add('zadd', TRIGGERS_CHECKS, check.get("score", 0), trigger_id)
+        writes.add('incr', CHECKS_COUNTER)
         if check.get("score", 0) > 0:
-            yield t.sadd(TRIGGER_IN_BAD_STATE, trigger_id)
+            writes.add('sadd', TRIGGER_IN_BAD_STATE, trigger_id)
         else:
-            yield t.srem(TRIGGER_IN_BAD_STATE, trigger_id)
-        yield t.commit()
+            writes.add('srem', TRIGGER_IN_BAD_STATE, trigger_id)
+        if flush:
+            yield self.flushWrites(writes)
+
+    @defer.inlineCallbacks
+    def flushWrites(self, writes):
+        """
+        flushWrites(self, writes)
+
+        Send commands queued in write buffer in one pipelined transaction
+        and cache results of the calls which queued them
+
+        :param writes: commands of trigger check
+        :type writes: WriteBuffer
+        """
+        commands, cached = writes.commands, writes.cached
+        writes.commands, writes.queued, writes.cached = [], set(), []
+        if commands:
+            t = yield self.rc.multi()
+            for name, args, kwargs in commands:
+                getattr(t, name)(*args, **kwargs)
+            yield t.commit()
+        for key, result in cached:
+            store(key, result)
 
     @defer.inlineCallbacks
     @docstring_parameters(TRIGGER_CHECK_LOCK_PREFIX.format("<trigger_id>"))
@@ -940,6 +1088,26 @@ class Db(service.Service):
                                expire=config.CHECK_LOCK_TTL, only_if_not_exists=True)
         defer.returnValue(ok)
 
+    @defer.inlineCallbacks
+    @docstring_parameters(TRIGGER_CHECK_LOCK_PREFIX.format("<trigger_id>"))
+    def setTriggersCheckLock(self, trigger_ids):
+        """
+        setTriggersCheckLock(self, trigger_ids)
+
+        Try to acquire locks {0} for multiple trigger checks in one pipeline
+
+        :param trigger_ids: trigger identities
+        :type trigger_ids: list of strings
+        :rtype: list of acquired trigger identities
+        """
+        now = time.time()
+        pipeline = yield self.rc.pipeline()
+        for trigger_id in trigger_ids:
+            pipeline.set(TRIGGER_CHECK_LOCK_PREFIX.format(trigger_id), now,
+                         expire=config.CHECK_LOCK_TTL, only_if_not_exists=True)
+        results = yield pipeline.execute_pipeline()
+        defer.returnValue([trigger_id for trigger_id, ok in zip(trigger_ids, results) if ok is not None])
+
     @defer.inlineCallbacks
     def acquireTriggerCheckLock(self, trigger_id, timeout):
         """
@@ -1031,7 +1199,7 @@ class Db(service.Service):
     @audit
     @defer.inlineCallbacks
     @docstring_parameters(PATTERN_METRICS_PREFIX.format("<pattern>"))
-    def delPatternMetrics(self, pattern, existing=None):
+    def delPatternMetrics(self, pattern, existing=None, writes=None):
         """
         delPatternMetrics(self, pattern)
 
@@ -1039,8 +1207,13 @@ class Db(service.Service):
 
         :param pattern: pattern of graphite that match multiple metric
         :type pattern: string
+        :param writes: buffer to queue command to instead of sending it
+        :type writes: WriteBuffer
         """
-        yield self.rc.delete(PATTERN_METRICS_PREFIX.format(pattern))
+        if writes is not None:
+            writes.add('delete', PATTERN_METRICS_PREFIX.format(pattern))
+        else:
+            yield self.rc.delete(PATTERN_METRICS_PREFIX.format(pattern))
 
     @defer.inlineCallbacks
     @docstring_parameters(PATTERN_METRICS_PREFIX.format("<pattern>"))
@@ -1057,6 +1230,24 @@ class Db(service.Service):
         result = yield self.rc.smembers(PATTERN_METRICS_PREFIX.format(pattern))
         defer.returnValue(result)
 
+    @defer.inlineCallbacks
+    @docstring_parameters(PATTERN_METRICS_PREFIX.format("<pattern>"))
+    def getPatternsMetrics(self, patterns):
+        """
+        getPatternsMetrics(self, patterns)
+
+        Read all metrics from sets {0} for multiple patterns
+
+        :param patterns: list of graphite patterns
+        :type patterns: list of string
+        :rtype: list of set of strings
+        """
+        pipeline = yield self.rc.pipeline()
+        for pattern in patterns:
+            pipeline.smembers(PATTERN_METRICS_PREFIX.format(pattern))
+        results = yield pipeline.execute_pipeline()
+        defer.returnValue(results)
+
     @defer.inlineCallbacks
     @docstring_parameters(METRIC_PREFIX.format("<metric>"))
     def getMetricsValues(self, metrics, startTime, endTime='+inf'):
@@ -1079,19 +1270,88 @@ class Db(service.Service):
         results = yield pipeline.execute_pipeline()
         defer.returnValue(results)
 
+    @defer.inlineCallbacks
+    @docstring_parameters(METRIC_PREFIX.format("<metric>"))
+    def getMetricsValuesRanges(self, ranges):
+        """
+        getMetricsValuesRanges(self, ranges)
+
+        Read metric values from sorted sets {0} for individual score ranges
+
+        :param ranges: list of (metric, min, max) with ZRANGEBYSCORE bounds
+        :type ranges: list of tuple
+        :rtype: list of list of tuple ('value timestamp', long)
+        """
+        if not ranges:
+            defer.returnValue([])
+        pipeline = yield self.rc.pipeline()
+        for metric, startTime, endTime in ranges:
+            pipeline.zrangebyscore(METRIC_PREFIX.format(metric), min=startTime, max=endTime, withscores=True)
+        results = yield pipeline.execute_pipeline()
+        defer.returnValue(results)
+
     @cache
     @defer.inlineCallbacks
     @docstring_parameters(METRIC_PREFIX.format("<metric>"))
-    def cleanupMetricValues(self, metric, toTime):
+    def cleanupMetricValues(self, metric, toTime, writes=None):
         """
         cleanupMetricValues(self, metric, toTime)
 
-        Remove metric values from sorted set {0} until toTime
+        Remove metric values from sorted set {0} until toTime.
+        Cleanup is queued once per buffer.
 
         :param startTime: unix epoch time
         :type startTime: long
+        :param writes: buffer to queue command to instead of sending it
+        :type writes: WriteBuffer
         """
-        yield self.rc.zremrangebyscore(METRIC_PREFIX.format(metric), min="-inf", max=toTime)
+        if writes is not None:
+            writes.addOnce('zremrangebyscore', METRIC_PREFIX.format(metric), min="-inf", max=toTime)
+        else:
+            yield self.rc.zremrangebyscore(METRIC_PREFIX.format(metric), min="-inf", max=toTime)
+
+    @defer.inlineCallbacks
+    @docstring_parameters(METRIC_PREFIX.format("*"))
+    def scanMetrics(self, cursor, count):
+        """
+        scanMetrics(self, cursor, count)
+
+        Iterate over sorted sets {0} of metric values with SCAN
+
+        :param cursor: cursor returned by previous call, 0 to start
+        :type cursor: int
+        :param count: SCAN COUNT hint
+        :type count: int
+        :rtype: tuple (next cursor, list of metrics), next cursor is 0 when iteration is complete
+        """
+        cursor, keys = yield self.rc.scan(cursor, pattern=METRIC_PREFIX.format("*"), count=count)
+        prefix = len(METRIC_PREFIX.format(""))
+        defer.returnValue((int(cursor), [key[prefix:] for key in keys]))
+
+    @defer.inlineCallbacks
+    @docstring_parameters(METRIC_PREFIX.format("<metric>"))
+    def cleanupMetricsValues(self, metrics, toTime):
+        """
+        cleanupMetricsValues(self, metrics, toTime)
+
+        Remove values until toTime from sorted sets {0} of multiple metrics in one pipeline
+        of ZREMRANGEBYSCORE and ZCARD for every metric
+
+        :param metrics: list of graphite metric path
+        :type metrics: list of string
+        :param toTime: unix epoch time
+        :type toTime: long
+        :rtype: list of tuple (count of removed values, count of values left)
+        """
+        if not metrics:
+            defer.returnValue([])
+        pipeline = yield self.rc.pipeline()
+        for metric in metrics:
+            key = METRIC_PREFIX.format(metric)
+            pipeline.zremrangebyscore(key, min="-inf", max=toTime)
+            pipeline.zcard(key)
+        results = yield pipeline.execute_pipeline()
+        defer.returnValue(zip(results[::2], results[1::2]))
 
     @defer.inlineCallbacks
     @docstring_parameters(PATTERN_TRIGGERS_PREFIX.format("<pattern>"))
@@ -1108,6 +1368,60 @@ class Db(service.Service):
         result = yield self.rc.smembers(PATTERN_TRIGGERS_PREFIX.format(pattern))
         defer.returnValue(result)
 
+    @defer.inlineCallbacks
+    @docstring_parameters(PATTERN_TRIGGERS_PREFIX.format("<pattern>"))
+    def getPatternsTriggers(self, patterns):
+        """
+        getPatternsTriggers(self, patterns)
+
+        Returns trigger identifiers from sets {0} for multiple patterns
+
+        :param patterns: list of graphite patterns
+        :type patterns: list of string
+        :rtype: list of set of strings
+        """
+        pipeline = yield self.rc.pipeline()
+        for pattern in patterns:
+            pipeline.smembers(PATTERN_TRIGGERS_PREFIX.format(pattern))
+        results = yield pipeline.execute_pipeline()
+        defer.returnValue(results)
+
+    @defer.inlineCallbacks
+    @docstring_parameters(PATTERN_TRIGGERS_CHANNEL)
+    def publishPatternsChange(self, patterns):
+        """
+        publishPatternsChange(self, patterns)
+
+        Publish json list of patterns with changed triggers to channel {0}
+
+        :param patterns: list of graphite patterns
+        :type patterns: list of string
+        """
+        if patterns:
+            yield self.rc.publish(PATTERN_TRIGGERS_CHANNEL, anyjson.serialize(sorted(patterns)))
+
+    @defer.inlineCallbacks
+    @docstring_parameters(PATTERN_METRICS_PREFIX.format("<pattern>"), TRIGGERS_TO_CHECK)
+    def addPatternsMetricsAndTriggerChecks(self, pattern_metrics, trigger_ids):
+        """
+        addPatternsMetricsAndTriggerChecks(self, pattern_metrics, trigger_ids)
+
+        Add metrics to sets {0} and *trigger_ids* to set {1} in one pipeline
+
+        :param pattern_metrics: metrics of graphite by pattern
+        :type pattern_metrics: dict of set of strings
+        :param trigger_ids: trigger identities
+        :type trigger_ids: set of strings
+        """
+        if not pattern_metrics and not trigger_ids:
+            raise StopIteration
+        pipeline = yield self.rc.pipeline()
+        for pattern, metrics in pattern_metrics.iteritems():
+            pipeline.sadd(PATTERN_METRICS_PREFIX.format(pattern), *metrics)
+        if trigger_ids:
+            pipeline.sadd(TRIGGERS_TO_CHECK, *trigger_ids)
+        yield pipeline.execute_pipeline()
+
     @defer.inlineCallbacks
     @docstring_parameters(PATTERN_TRIGGERS_PREFIX.format("<pattern>"))
     def removePatternTriggers(self, pattern):
@@ -1138,7 +1452,7 @@ class Db(service.Service):
     @audit
     @defer.inlineCallbacks
     @docstring_parameters(EVENTS)
-    def pushEvent(self, event, ui=True, existing=None):
+    def pushEvent(self, event, ui=True, existing=None, writes=None):
         """
         pushEvent(self, event)
 
@@ -1148,19 +1462,24 @@ class Db(service.Service):
 
         :param event: trigger state changing event
         :type event: dict
+        :param writes: buffer to queue commands to instead of sending them
+        :type writes: WriteBuffer
         """
         event_json = anyjson.serialize(event)
-        t = yield self.rc.multi()
-        yield t.lpush(EVENTS, event_json)
+        flush = writes is None
+        if flush:
+            writes = WriteBuffer()
+        writes.add('lpush', EVENTS, event_json)
         trigger_id = event.get("trigger_id")
         if trigger_id is not None:
-            yield t.zadd(TRIGGER_EVENTS.format(event["trigger_id"]), event["timestamp"], event_json)
-            yield t.zremrangebyscore(TRIGGER_EVENTS.format(trigger_id),
-                                     min="-inf", max=int(time.time() - TRIGGER_EVENTS_TTL))
+            writes.add('zadd', TRIGGER_EVENTS.format(event["trigger_id"]), event["timestamp"], event_json)
+            writes.add('zremrangebyscore', TRIGGER_EVENTS.format(trigger_id),
+                       min="-inf", max=int(time.time() - TRIGGER_EVENTS_TTL))
         if ui:
-            yield t.lpush(EVENTS_UI, event_json)
-            yield t.ltrim(EVENTS_UI, 0, 100)
-        yield t.commit()
+            writes.add('lpush', EVENTS_UI, event_json)
+            writes.add('ltrim', EVENTS_UI, 0, 100)
+        if flush:
+            yield self.flushWrites(writes)
 
     @defer.inlineCallbacks
     @docstring_parameters(EVENTS)
@@ -1203,7 +1522,6 @@ class Db(service.Service):
         key = METRIC_PREFIX.format(metric)
         yield self.rc.delete(key)
 
-    @cache
     @defer.inlineCallbacks
     @docstring_parameters(METRIC_RETENTION_PREFIX.format("<metric>"))
     def getMetricRetention(self, metric):
@@ -1216,9 +1534,33 @@ class Db(service.Service):
         :type metric: string
         :rtype: integer
         """
-        key = METRIC_RETENTION_PREFIX.format(metric)
-        result = yield self.rc.get(key)
-        defer.returnValue(60 if result is None else int(result))
+        retentions = yield self.getMetricsRetentions([metric])
+        defer.returnValue(retentions[0])
+
+    @defer.inlineCallbacks
+    @docstring_parameters(METRIC_RETENTION_PREFIX.format("<metric>"))
+    def getMetricsRetentions(self, metrics):
+        """
+        getMetricsRetentions(self, metrics)
+
+        Returns retentions in seconds from keys {0} for given metrics.
+        Reads metrics missing in shared retention cache with a single MGET.
+
+        :param metrics: list of graphite metrics
+        :type metrics: list of string
+        :rtype: list of integer
+        """
+        retentions = [self.retentions.get(metric) for metric in metrics]
+        missing = [metric for metric, retention in zip(metrics, retentions) if retention is None]
+        if missing:
+            results = yield self.rc.mget([METRIC_RETENTION_PREFIX.format(metric) for metric in missing])
+            fetched = {}
+            for metric, result in zip(missing, results):
+                fetched[metric] = 60 if result is None else int(result)
+                self.retentions.set(metric, fetched[metric])
+            retentions = [fetched[metric] if retention is None else retention
+                          for metric, retention in zip(metrics, retentions)]
+        defer.returnValue(retentions)
 
     @defer.inlineCallbacks
     def sendMetric(self, pattern, metric, timestamp, value):
@@ -12,11 +12,26 @@ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 See the License for the specific language governing permissions and
 limitations under the License."""
 
+from collections import OrderedDict
+
 from moira.graphite.util import epoch
 from moira.graphite.attime import parseATTime
 from twisted.internet import defer
 
+from moira import config
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 db = None
+metrics_cache = None
+history_cache = None
+
+
+def arraySeriesEnabled():
+    return numpy is not None and config.ARRAY_SERIES
 
 
 def createRequestContext(fromTime, endTime, allowRealTimeAlerting):
@@ -30,6 +45,28 @@ def createRequestContext(fromTime, endTime, allowRealTimeAlerting):
             'metrics': set()}
 
 
+# names of series are split once for all checks, the cache is cleared when full as re module does
+NODES_CACHE_SIZE = 100000
+_nodesCache = {}
+
+
+def splitNodes(name):
+    """
+    Tuple of dot separated nodes of metric name, cached by name. Nodes of byte string
+    names are interned, so series of a wildcard share their equal nodes.
+    """
+    nodes = _nodesCache.get(name)
+    if nodes is None:
+        if len(_nodesCache) >= NODES_CACHE_SIZE:
+            _nodesCache.clear()
+        if isinstance(name, str):
+            nodes = tuple(map(intern, name.split('.')))
+        else:
+            nodes = tuple(name.split('.'))
+        _nodesCache[name] = nodes
+    return nodes
+
+
 class TimeSeries(list):
 
     def __init__(self, name, start, end, step, values, consolidate='average'):
@@ -45,9 +82,18 @@ class TimeSeries(list):
 
     def __iter__(self):
         if self.valuesPerPoint > 1:
-            return self.__consolidatingGenerator(list.__iter__(self))
+            return self.__consolidatingGenerator(self.rawIter())
         else:
-            return list.__iter__(self)
+            return self.rawIter()
+
+    def rawIter(self):
+        """Iterate over stored values ignoring consolidation"""
+        return list.__iter__(self)
+
+    @property
+    def nodes(self):
+        """Dot separated nodes of name, see splitNodes"""
+        return splitNodes(self.name)
 
     def consolidate(self, valuesPerPoint):
         self.valuesPerPoint = int(valuesPerPoint)
@@ -90,6 +136,14 @@ class TimeSeries(list):
         return 'TimeSeries(name=%s, start=%s, end=%s, step=%s)' % (
             self.name, self.start, self.end, self.step)
 
+    def copy(self):
+        """Copy of the series with all attributes, values of array series are shared as they are read-only"""
+        series = TimeSeries.__new__(type(self))
+        list.__init__(series, list.__iter__(self))
+        series.__dict__.update(self.__dict__)
+        series.options = self.options.copy()
+        return series
+
     def getInfo(self):
         """Pickle-friendly representation of the series"""
         return {
@@ -101,6 +155,97 @@ class TimeSeries(list):
         }
 
 
+def _readOnly(self, *args, **kwargs):
+    raise TypeError("ArrayTimeSeries is read-only, use asTimeSeries() to get a mutable copy")
+
+
+class ArrayTimeSeries(TimeSeries):
+    """
+    TimeSeries backed by a float64 numpy array where NaN stands for a missing point.
+    Behaves as a read-only list of floats and None for code that is not array-aware.
+    """
+
+    def __init__(self, name, start, end, step, values, consolidate='average'):
+        TimeSeries.__init__(self, name, start, end, step, [], consolidate)
+        self.values = toArray(values)
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return toList(self.values[index])
+        value = self.values[index]
+        return None if value != value else float(value)
+
+    def __getslice__(self, i, j):
+        return self.__getitem__(slice(max(0, i), max(0, j)))
+
+    def __contains__(self, value):
+        if value is None:
+            return bool(numpy.isnan(self.values).any())
+        return list.__contains__(toList(self.values), value)
+
+    def __reversed__(self):
+        return reversed(toList(self.values))
+
+    def __eq__(self, other):
+        return toList(self.values) == list(other)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def rawIter(self):
+        return iter(toList(self.values))
+
+    def index(self, value, *args):
+        return toList(self.values).index(value, *args)
+
+    def count(self, value):
+        return toList(self.values).count(value)
+
+    __setitem__ = __delitem__ = __setslice__ = __delslice__ = _readOnly
+    __iadd__ = __imul__ = append = extend = insert = pop = remove = reverse = sort = _readOnly
+
+    def asTimeSeries(self):
+        """Mutable list-backed copy of the series with all attributes preserved"""
+        series = TimeSeries(self.name, self.start, self.end, self.step, toList(self.values), self.consolidationFunc)
+        series.__dict__.update((k, v) for k, v in self.__dict__.iteritems() if k != 'values')
+        series.options = self.options.copy()
+        return series
+
+
+def toArray(values):
+    """Convert series values to a float64 array with NaN instead of None"""
+    if isinstance(values, ArrayTimeSeries) and values.valuesPerPoint == 1:
+        return values.values
+    if numpy is not None and isinstance(values, numpy.ndarray):
+        result = values.astype(numpy.float64, copy=False)
+    else:
+        if not isinstance(values, list) or isinstance(values, TimeSeries):
+            values = list(values)
+        result = numpy.array(values, dtype=numpy.float64)
+    result.flags.writeable = False
+    return result
+
+
+def toList(values):
+    """Convert float64 array back to list of floats with None instead of NaN"""
+    result = values.tolist()
+    for i in numpy.flatnonzero(numpy.isnan(values)):
+        result[i] = None
+    return result
+
+
+def asTimeSeries(value):
+    """Replace array-backed series with mutable list-backed copies, recursing into lists of series"""
+    if isinstance(value, ArrayTimeSeries):
+        return value.asTimeSeries()
+    if isinstance(value, list) and not isinstance(value, TimeSeries):
+        return [asTimeSeries(item) for item in value]
+    return value
+
+
 def unpackTimeSeries(dataList, retention, startTime, endTime, bootstrap, allowRealTimeAlerting):
 
     def getTimeSlot(timestamp):
@@ -127,45 +272,190 @@ def unpackTimeSeries(dataList, retention, startTime, endTime, bootstrap, allowRe
     return valuesList
 
 
+def unpackTimeSeriesMatrix(dataList, retention, startTime, endTime, bootstrap, allowRealTimeAlerting):
+    """
+    Bulk version of unpackTimeSeries decoding the whole getMetricsValues reply at once.
+    Returns float64 slot matrix with NaN for missing points and length of every row,
+    matrix[i, :lengths[i]] holds the same values as unpackTimeSeries()[i].
+    """
+    lastTimeSlot = int((endTime - startTime) / retention)
+    if lastTimeSlot < 0:
+        valuesList = unpackTimeSeries(dataList, retention, startTime, endTime, bootstrap, allowRealTimeAlerting)
+        return numpy.full((len(valuesList), 0), numpy.nan), numpy.zeros(len(valuesList), dtype=numpy.intp)
+
+    columns = lastTimeSlot + 1
+    matrix = numpy.full(len(dataList) * columns, numpy.nan)
+
+    counts = [len(data) for data in dataList]
+    points = [point for data in dataList for point in data]
+    if points:
+        members, timestamps = zip(*points)
+        timestamps = numpy.array(timestamps, dtype=numpy.float64)
+        # members are "timestamp value" strings, parse them all with a single call
+        parsed = numpy.fromstring(' '.join(members), dtype=numpy.float64, sep=' ')
+        if len(parsed) != 2 * len(members):
+            values = numpy.array([float(value.split()[1]) for value in members], dtype=numpy.float64)
+        else:
+            values = parsed[1::2]
+        slots = numpy.trunc((timestamps - startTime) / retention).astype(numpy.intp)
+        rows = numpy.repeat(numpy.arange(len(dataList), dtype=numpy.intp), counts)
+        inWindow = (slots >= 0) & (slots <= lastTimeSlot)
+        cells = (rows * columns + slots)[inWindow]
+        values = values[inWindow]
+        # the latest point wins when several points fall into the same slot
+        if len(cells) > 1 and (cells[1:] >= cells[:-1]).all():
+            last = numpy.append(cells[1:] != cells[:-1], True)
+            cells, values = cells[last], values[last]
+        elif len(cells) > 1:
+            cells, last = numpy.unique(cells[::-1], return_index=True)
+            values = values[::-1][last]
+        matrix[cells] = values
+
+    matrix = matrix.reshape(len(dataList), columns)
+    lengths = numpy.full(len(dataList), lastTimeSlot, dtype=numpy.intp)
+    if bootstrap:
+        lengths += 1
+    elif allowRealTimeAlerting:
+        lengths += ~numpy.isnan(matrix[:, lastTimeSlot])
+    return matrix, lengths
+
+
+def getFetchInterval(requestContext):
+    return (int(epoch(requestContext['startTime'])),
+            int(epoch(requestContext['endTime'])),
+            requestContext['bootstrap'])
+
+
+def getValuesEndTime(startTime, endTime, bootstrap, retention):
+    if bootstrap:
+        # in bootstrap mode in order to avoid overlapping of bootstrap time series with current time series
+        # we have to fetch all points up to the last retention time slot boundary preceding endTime
+        # not including that boundary because endTime is set to be equal startTime from the original requestContext
+        endTime -= int((endTime - startTime) % retention) + 1
+    return endTime
+
+
 @defer.inlineCallbacks
-def fetchData(requestContext, pathExpr):
+def getMetricsData(metrics, retentions, startTime, endTime, bootstrap, history=False):
+    """
+    Read values of metrics with one request per distinct values end time,
+    history windows are read through history_cache
+    """
+    cache = history_cache if history else metrics_cache
+    groups = OrderedDict()
+    for i, retention in enumerate(retentions):
+        groups.setdefault(getValuesEndTime(startTime, endTime, bootstrap, retention), []).append(i)
+    dataList = [None] * len(metrics)
+    for valuesEndTime, indexes in groups.iteritems():
+        data = yield (cache or db).getMetricsValues([metrics[i] for i in indexes], startTime, valuesEndTime)
+        for i, values in zip(indexes, data):
+            dataList[i] = values
+    defer.returnValue(dataList)
 
-    global db
 
+@defer.inlineCallbacks
+def prefetchData(requestContext, pathExprs):
+    """
+    Read pattern metrics, retentions and values for all pathExprs with one batch of requests
+    per kind and keep them in requestContext['prefetched'] for fetchData
+    """
     if db is None:
-        raise Exception("Redis connection is not initialized")
+        raise StopIteration
+
+    prefetched = requestContext.setdefault('prefetched', {})
+    interval = getFetchInterval(requestContext)
+    startTime, endTime, bootstrap = interval
+    pathExprs = list(OrderedDict.fromkeys(p for p in pathExprs if (p, interval) not in prefetched))
+    if not pathExprs:
+        raise StopIteration
+
+    metricsList = [list(metrics) for metrics in (yield db.getPatternsMetrics(pathExprs))]
+    allMetrics = [metric for metrics in metricsList for metric in metrics]
+    retentions = (yield db.getMetricsRetentions(allMetrics)) if allMetrics else []
+    dataList = yield getMetricsData(allMetrics, retentions, startTime, endTime, bootstrap,
+                                    requestContext.get('history', False))
+    offset = 0
+    for pathExpr, metrics in zip(pathExprs, metricsList):
+        end = offset + len(metrics)
+        prefetched[(pathExpr, interval)] = (metrics, retentions[offset:end], dataList[offset:end])
+        offset = end
+
+
+def unpackSeries(metrics, retentions, dataList, startTime, endTime, bootstrap, allowRealTimeAlerting):
+    """
+    Build series of metrics values, every series keeps its own retention
+    """
+    groups = OrderedDict()
+    for i, retention in enumerate(retentions):
+        groups.setdefault(retention, []).append(i)
+    seriesList = [None] * len(metrics)
+    for retention, indexes in groups.iteritems():
+        valuesEndTime = getValuesEndTime(startTime, endTime, bootstrap, retention)
+        data = [dataList[i] for i in indexes]
+        if arraySeriesEnabled():
+            matrix, lengths = unpackTimeSeriesMatrix(
+                data, retention, startTime, valuesEndTime, bootstrap, allowRealTimeAlerting)
+            valuesList = [matrix[row, :length] for row, length in enumerate(lengths)]
+            seriesClass = ArrayTimeSeries
+        else:
+            valuesList = unpackTimeSeries(data, retention, startTime, valuesEndTime, bootstrap, allowRealTimeAlerting)
+            seriesClass = TimeSeries
+        for i, values in zip(indexes, valuesList):
+            seriesList[i] = seriesClass(
+                metrics[i],
+                startTime,
+                valuesEndTime,
+                retention,
+                values)
+    return seriesList
+
+
+def isPrefetched(requestContext, pathExpr):
+    return (pathExpr, getFetchInterval(requestContext)) in requestContext.get('prefetched', {})
 
-    startTime = int(epoch(requestContext['startTime']))
-    endTime = int(epoch(requestContext['endTime']))
-    bootstrap = requestContext['bootstrap']
-    allowRealTimeAlerting = requestContext['allowRealTimeAlerting']
 
+def buildSeriesList(requestContext, pathExpr, metrics, retentions, dataList):
+    startTime, endTime, bootstrap = getFetchInterval(requestContext)
     seriesList = []
-    metrics = list((yield db.getPatternMetrics(pathExpr)))
     if len(metrics) == 0:
         series = TimeSeries(pathExpr, startTime, startTime, 60, [])
         series.pathExpression = pathExpr
         series.stub = True
         seriesList.append(series)
     else:
-        first_metric = metrics[0]
-        retention = yield db.getMetricRetention(first_metric, cache_key=first_metric, cache_ttl=60)
-        if bootstrap:
-            # in bootstrap mode in order to avoid overlapping of bootstrap time series with current time series
-            # we have to fetch all points up to the last retention time slot boundary preceding endTime
-            # not including that boundary because endTime is set to be equal startTime from the original requestContext
-            endTime -= int((endTime - startTime) % retention) + 1
-        dataList = yield db.getMetricsValues(metrics, startTime, endTime)
-        valuesList = unpackTimeSeries(dataList, retention, startTime, endTime, bootstrap, allowRealTimeAlerting)
-        for i, metric in enumerate(metrics):
+        for metric, series in zip(metrics, unpackSeries(metrics, retentions, dataList, startTime, endTime,
+                                                        bootstrap, requestContext['allowRealTimeAlerting'])):
             requestContext['metrics'].add(metric)
-            series = TimeSeries(
-                metric,
-                startTime,
-                endTime,
-                retention,
-                valuesList[i])
             series.pathExpression = pathExpr
             seriesList.append(series)
+    return seriesList
+
+
+def fetchPrefetchedData(requestContext, pathExpr):
+    """
+    Synchronous fetchData for path expressions already read by prefetchData
+    """
+    metrics, retentions, dataList = requestContext['prefetched'][(pathExpr, getFetchInterval(requestContext))]
+    return buildSeriesList(requestContext, pathExpr, metrics, retentions, dataList)
+
 
-    defer.returnValue(seriesList)
+@defer.inlineCallbacks
+def fetchData(requestContext, pathExpr):
+
+    global db
+
+    if db is None:
+        raise Exception("Redis connection is not initialized")
+
+    if isPrefetched(requestContext, pathExpr):
+        defer.returnValue(fetchPrefetchedData(requestContext, pathExpr))
+
+    startTime, endTime, bootstrap = getFetchInterval(requestContext)
+    metrics = list((yield db.getPatternMetrics(pathExpr)))
+    retentions = []
+    dataList = []
+    if metrics:
+        retentions = yield db.getMetricsRetentions(metrics)
+        dataList = yield getMetricsData(metrics, retentions, startTime, endTime, bootstrap,
+                                        requestContext.get('history', False))
+    defer.returnValue(buildSeriesList(requestContext, pathExpr, metrics, retentions, dataList))
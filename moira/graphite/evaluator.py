@@ -13,55 +13,88 @@ See the License for the specific language governing permissions and
 limitations under the License."""
 
 import re
+from collections import OrderedDict
 
-from moira.graphite.grammar import grammar
-from moira.graphite.datalib import TimeSeries, fetchData
+from moira import config
+from moira.cache import LRUCache
+from moira.metrics import spy
+from moira.graphite.parser import parseTarget
+from moira.graphite.datalib import (TimeSeries, ArrayTimeSeries, asTimeSeries, fetchData, fetchPrefetchedData,
+                                    getFetchInterval, isPrefetched, prefetchData)
 from twisted.internet import defer
 
 
-@defer.inlineCallbacks
-def evaluateTarget(requestContext, target):
-    tokens = grammar.parseString(target)
-    result = yield evaluateTokens(requestContext, tokens)
-    if isinstance(result, TimeSeries):
-        # we have to return a list of TimeSeries objects
-        defer.returnValue([result])
-    else:
-        defer.returnValue(result)
+def isReady(node, requestContext):
+    """Node can be evaluated synchronously with data prefetched for requestContext"""
+    return node.synchronous and all(isPrefetched(requestContext, path) for path in node.paths())
 
 
-@defer.inlineCallbacks
-def evaluateTokens(requestContext, tokens, replacements=None):
-    if tokens.template:
+class TemplateNode(object):
+
+    synchronous = False
+
+    def __init__(self, kwargs, args, body):
+        self.kwargs = kwargs
+        self.args = args
+        self.body = body
+
+    @defer.inlineCallbacks
+    def __call__(self, requestContext, replacements=None):
         arglist = dict()
-        if tokens.template.kwargs:
-            arglist.update(dict([(kwarg.argname, (yield evaluateTokens(requestContext, kwarg.args[0])))
-                                 for kwarg in tokens.template.kwargs]))
-        if tokens.template.args:
-            arglist.update(dict([(str(i + 1), (yield evaluateTokens(requestContext, arg)))
-                           for i, arg in enumerate(tokens.template.args)]))
+        if self.kwargs:
+            arglist.update(dict([(name, (yield node(requestContext))) for name, node in self.kwargs]))
+        if self.args:
+            arglist.update(dict([(name, (yield node(requestContext))) for name, node in self.args]))
         if 'template' in requestContext:
             arglist.update(requestContext['template'])
-        result = yield evaluateTokens(requestContext, tokens.template, arglist)
+        result = yield self.body(requestContext, arglist)
         defer.returnValue(result)
-        raise StopIteration
 
-    elif tokens.expression:
-        result = yield evaluateTokens(requestContext, tokens.expression, replacements=replacements)
-        for exp in tokens.expression:
-            if type(exp) is not unicode:
-                continue
+    def paths(self):
+        for name, node in self.kwargs + self.args:
+            for path in node.paths():
+                yield path
+        for path in self.body.paths():
+            yield path
+
+
+class ExpressionNode(object):
+
+    def __init__(self, body, patterns):
+        self.body = body
+        self.patterns = patterns
+        self.synchronous = body.synchronous
+
+    def resolve(self, requestContext, result):
+        for exp in self.patterns:
             for r in result:
                 if not isinstance(r, TimeSeries):
                     continue
                 resolve = requestContext['graphite_patterns'].get(exp, set())
                 resolve.add(r.name)
                 requestContext['graphite_patterns'][exp] = resolve
-        defer.returnValue(result)
-        raise StopIteration
+        return result
 
-    elif tokens.pathExpression:
-        expression = tokens.pathExpression
+    @defer.inlineCallbacks
+    def __call__(self, requestContext, replacements=None):
+        result = yield self.body(requestContext, replacements=replacements)
+        defer.returnValue(self.resolve(requestContext, result))
+
+    def evaluate(self, requestContext, replacements=None):
+        return self.resolve(requestContext, self.body.evaluate(requestContext, replacements=replacements))
+
+    def paths(self):
+        return self.body.paths()
+
+
+class PathNode(object):
+
+    def __init__(self, expression):
+        self.expression = expression
+        self.synchronous = '$' not in expression
+
+    def __call__(self, requestContext, replacements=None):
+        expression = self.expression
         if replacements:
             for name in replacements:
                 if expression == '$' + name:
@@ -71,61 +104,313 @@ def evaluateTokens(requestContext, tokens, replacements=None):
                             str) and not isinstance(
                             val,
                             basestring):
-                        defer.returnValue(val)
-                        raise StopIteration
+                        return defer.succeed(val)
                     elif re.match('^-?[\d.]+$', val):
-                        defer.returnValue(float(val))
-                        raise StopIteration
+                        return defer.succeed(float(val))
                     else:
-                        defer.returnValue(val)
-                        raise StopIteration
+                        return defer.succeed(val)
                 else:
                     expression = expression.replace(
                         '$' + name, str(replacements[name]))
-        timeseries = yield fetchData(requestContext, expression)
-        defer.returnValue(timeseries)
-        raise StopIteration
+        return fetchData(requestContext, expression)
 
-    elif tokens.call:
+    def evaluate(self, requestContext, replacements=None):
+        return fetchPrefetchedData(requestContext, self.expression)
+
+    def paths(self):
+        # template placeholders are known only at evaluation time
+        if '$' not in self.expression:
+            yield self.expression
+
+
+class CallNode(object):
 
-        if tokens.call.funcname == 'template':
+    def __init__(self, funcname, args, kwargs):
+        self.funcname = funcname
+        self.args = args
+        self.kwargs = kwargs
+        func = SeriesFunctions.get(funcname)
+        self.synchronous = func is not None and func not in AsyncSeriesFunctions and \
+            all(node.synchronous for node in args) and all(node.synchronous for _, node in kwargs)
+
+    def getFunction(self):
+        if self.funcname == 'template':
             # if template propagates down here, it means the grammar didn't match the invocation
             # as tokens.template. this generally happens if you try to pass
             # non-numeric/string args
             raise ValueError(
                 "invaild template() syntax, only string/numeric arguments are allowed")
+        return SeriesFunctions[self.funcname]
 
-        func = SeriesFunctions[tokens.call.funcname]
-        args = [(yield evaluateTokens(requestContext, arg, replacements=replacements)) for arg in tokens.call.args]
-        kwargs = dict([(kwarg.argname, (yield evaluateTokens(requestContext, kwarg.args[0], replacements=replacements)))
-                       for kwarg in tokens.call.kwargs])
+    @defer.inlineCallbacks
+    def __call__(self, requestContext, replacements=None):
+        func = self.getFunction()
+        # subtrees of pure functions over prefetched data do not need a Deferred per node
+        args = [node.evaluate(requestContext, replacements=replacements) if isReady(node, requestContext)
+                else (yield node(requestContext, replacements=replacements)) for node in self.args]
+        kwargs = dict([(name, node.evaluate(requestContext, replacements=replacements)
+                        if isReady(node, requestContext)
+                        else (yield node(requestContext, replacements=replacements)))
+                       for name, node in self.kwargs])
+        if func not in ArraySeriesFunctions:
+            args = asTimeSeries(args)
+            kwargs = dict((name, asTimeSeries(value)) for name, value in kwargs.iteritems())
         try:
+            # functions out of AsyncSeriesFunctions return results, not Deferred
             defer.returnValue((yield func(requestContext, *args, **kwargs)))
         except NormalizeEmptyResultError:
             defer.returnValue([])
-        raise StopIteration
+
+    def evaluate(self, requestContext, replacements=None):
+        func = self.getFunction()
+        args = [node.evaluate(requestContext, replacements=replacements) for node in self.args]
+        kwargs = dict((name, node.evaluate(requestContext, replacements=replacements))
+                      for name, node in self.kwargs)
+        if func not in ArraySeriesFunctions:
+            args = asTimeSeries(args)
+            kwargs = dict((name, asTimeSeries(value)) for name, value in kwargs.iteritems())
+        try:
+            return func(requestContext, *args, **kwargs)
+        except NormalizeEmptyResultError:
+            return []
+
+    def paths(self):
+        for node in self.args:
+            for path in node.paths():
+                yield path
+        for name, node in self.kwargs:
+            for path in node.paths():
+                yield path
+
+
+class PointwiseNode(object):
+
+    """
+    Chain of pointwise function calls with constant arguments, like scale(offset(a.*, 1), 2).
+    Values of every series are transformed by all functions of the chain in one pass.
+    """
+
+    def __init__(self, calls, source):
+        self.calls = calls
+        self.source = source
+        self.synchronous = source.synchronous
+        # calls of the chain innermost first with their constant arguments
+        self.steps = [(SeriesFunctions[call.funcname], [node.value for node in call.args[1:]],
+                       dict((name, node.value) for name, node in call.kwargs)) for call in calls]
+
+    @classmethod
+    def fuse(cls, call):
+        """Merge call of pointwise function with pointwise calls in its first argument"""
+        if not cls.fusable(call):
+            return call
+        if call.args[0].patterns:
+            return call
+        body = call.args[0].body
+        if isinstance(body, PointwiseNode):
+            return cls(body.calls + [call], body.source)
+        if isinstance(body, CallNode) and cls.fusable(body):
+            return cls([body, call], body.args[0])
+        return call
+
+    @staticmethod
+    def fusable(call):
+        return SeriesFunctions.get(call.funcname) in PointwiseFunctions and len(call.args) > 0 and \
+            isinstance(call.args[0], ExpressionNode) and \
+            all(isinstance(node, ValueNode) for node in call.args[1:]) and \
+            all(isinstance(node, ValueNode) for _, node in call.kwargs)
+
+    def apply(self, requestContext, seriesList):
+        arrays = any(isinstance(series, ArrayTimeSeries) for series in seriesList)
+        if any(series.valuesPerPoint != 1 for series in seriesList) or \
+                arrays and all(func in ArraySeriesFunctions for func, _, _ in self.steps):
+            # consolidated series are transformed differently and arrays are transformed faster by each function
+            for func, args, kwargs in self.steps:
+                if func not in ArraySeriesFunctions:
+                    seriesList = asTimeSeries(seriesList)
+                seriesList = func(requestContext, seriesList, *args, **kwargs)
+            return seriesList
+        steps = [PointwiseFunctions[func](*args, **kwargs) for func, args, kwargs in self.steps]
+        return applyPointwise(asTimeSeries(seriesList), steps)
+
+    @defer.inlineCallbacks
+    def __call__(self, requestContext, replacements=None):
+        if isReady(self.source, requestContext):
+            seriesList = self.source.evaluate(requestContext, replacements=replacements)
+        else:
+            seriesList = yield self.source(requestContext, replacements=replacements)
+        defer.returnValue(self.apply(requestContext, seriesList))
+
+    def evaluate(self, requestContext, replacements=None):
+        return self.apply(requestContext, self.source.evaluate(requestContext, replacements=replacements))
+
+    def paths(self):
+        return self.source.paths()
+
+
+class ValueNode(object):
+
+    synchronous = True
+
+    def __init__(self, value):
+        self.value = value
+
+    def __call__(self, requestContext, replacements=None):
+        return defer.succeed(self.value)
+
+    def evaluate(self, requestContext, replacements=None):
+        return self.value
+
+    def paths(self):
+        return []
+
+
+def compileTokens(tokens):
+    """Lower parsed target tokens into a tree of callable nodes"""
+    if tokens.template:
+        kwargs = [(kwarg.argname, compileTokens(kwarg.args[0])) for kwarg in tokens.template.kwargs]
+        args = [(str(i + 1), compileTokens(arg)) for i, arg in enumerate(tokens.template.args)]
+        return TemplateNode(kwargs, args, compileTokens(tokens.template))
+
+    elif tokens.expression:
+        patterns = [exp for exp in tokens.expression if type(exp) is unicode]
+        return ExpressionNode(compileTokens(tokens.expression), patterns)
+
+    elif tokens.pathExpression:
+        return PathNode(tokens.pathExpression)
+
+    elif tokens.call:
+        args = [compileTokens(arg) for arg in tokens.call.args]
+        kwargs = [(kwarg.argname, compileTokens(kwarg.args[0])) for kwarg in tokens.call.kwargs]
+        return PointwiseNode.fuse(CallNode(tokens.call.funcname, args, kwargs))
 
     elif tokens.number:
         if tokens.number.integer:
-            defer.returnValue(int(tokens.number.integer))
-            raise StopIteration
+            return ValueNode(int(tokens.number.integer))
         elif tokens.number.float:
-            defer.returnValue(float(tokens.number.float))
-            raise StopIteration
+            return ValueNode(float(tokens.number.float))
         elif tokens.number.scientific:
-            defer.returnValue(float(tokens.number.scientific[0]))
-            raise StopIteration
+            return ValueNode(float(tokens.number.scientific[0]))
+        return ValueNode(None)
 
     elif tokens.string:
-        defer.returnValue(tokens.string[1:-1])
-        raise StopIteration
+        return ValueNode(tokens.string[1:-1])
 
     elif tokens.boolean:
-        defer.returnValue(tokens.boolean[0] == 'true')
-        raise StopIteration
+        return ValueNode(tokens.boolean[0] == 'true')
     else:
         raise ValueError("unknown token in target evaulator")
 
 
+class PlanCache(object):
+
+    """
+    Bounded LRU cache of compiled target plans
+    """
+
+    def __init__(self, size=None):
+        self.size = size
+        self.plans = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, target):
+        # patterns are registered for unicode targets only, see compileTokens
+        key = (type(target), target)
+        plan = self.plans.pop(key, None)
+        if plan is None:
+            self.misses += 1
+            plan = compileTokens(parseTarget(target))
+        else:
+            self.hits += 1
+        size = config.PLAN_CACHE_SIZE if self.size is None else self.size
+        if size > 0:
+            self.plans[key] = plan
+            while len(self.plans) > size:
+                self.plans.popitem(last=False)
+        return plan
+
+    def invalidate(self, targets):
+        for target in targets:
+            self.plans.pop((type(target), target), None)
+
+    def clear(self):
+        self.plans.clear()
+
+
+plans = PlanCache()
+
+
+class EvaluationMemo(object):
+
+    """
+    Results of targets evaluated from prefetched data, shared by trigger checks of a worker cycle.
+    An entry is used while data prefetched for all paths of its target stays the same,
+    so new points of any pattern expire it. Callers get copies of memoized series.
+    """
+
+    def __init__(self, size=None, ttl=60):
+        self.results = LRUCache(config.EVALUATION_MEMO_SIZE if size is None else size, ttl)
+
+    def evaluate(self, requestContext, target, plan):
+        interval = getFetchInterval(requestContext)
+        key = (type(target), target, interval, requestContext['allowRealTimeAlerting'])
+        data = [requestContext['prefetched'][(path, interval)] for path in plan.paths()]
+        entry = self.results.get(key)
+        if entry is not None and entry[0] == data:
+            spy.EVALUATION_MEMO_HITS.report(1)
+            _, seriesList, metrics, patterns = entry
+            self.merge(requestContext, metrics, patterns)
+            return [series.copy() for series in seriesList]
+        spy.EVALUATION_MEMO_MISSES.report(1)
+        context = dict(requestContext, metrics=set(), graphite_patterns={})
+        result = plan.evaluate(context)
+        self.merge(requestContext, context['metrics'], context['graphite_patterns'])
+        if isinstance(result, list) and all(isinstance(series, TimeSeries) for series in result):
+            self.results.set(key, (data, [series.copy() for series in result],
+                                   context['metrics'], context['graphite_patterns']))
+        return result
+
+    @staticmethod
+    def merge(requestContext, metrics, patterns):
+        requestContext['metrics'].update(metrics)
+        for exp, names in patterns.iteritems():
+            requestContext['graphite_patterns'].setdefault(exp, set()).update(names)
+
+
+# set by checker worker for every cycle of checks
+memo = None
+
+
+def prefetchTargets(requestContext, targets):
+    """Fetch data of all path expressions of targets with batched requests before evaluation"""
+    paths = []
+    for target in targets:
+        paths.extend(plans.get(target).paths())
+    return prefetchData(requestContext, paths)
+
+
+@defer.inlineCallbacks
+def evaluateTarget(requestContext, target):
+    plan = plans.get(target)
+    yield prefetchData(requestContext, plan.paths())
+    if isReady(plan, requestContext):
+        if memo is not None:
+            result = memo.evaluate(requestContext, target, plan)
+        else:
+            result = plan.evaluate(requestContext)
+    else:
+        result = yield plan(requestContext)
+    if isinstance(result, TimeSeries):
+        # we have to return a list of TimeSeries objects
+        defer.returnValue([result])
+    else:
+        defer.returnValue(result)
+
+
+def evaluateTokens(requestContext, tokens, replacements=None):
+    return compileTokens(tokens)(requestContext, replacements=replacements)
+
+
 # Avoid import circularities
-from moira.graphite.functions import (SeriesFunctions, NormalizeEmptyResultError)  # noqa
+from moira.graphite.functions import (SeriesFunctions, ArraySeriesFunctions, AsyncSeriesFunctions,  # noqa
+                                      PointwiseFunctions, NormalizeEmptyResultError, applyPointwise)
@@ -12,18 +12,25 @@ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 See the License for the specific language governing permissions and
 limitations under the License."""
 
+import bisect
+import copy
+import heapq
 import math
 import random
 import re
 import time
 
-from datetime import datetime, timedelta
+from array import array
+from collections import deque
+from datetime import timedelta
 from itertools import izip, imap
 
+from moira import config
+from moira.cache import LRUCache
 from moira.graphite.attime import parseTimeOffset, parseATTime
 from moira.graphite.util import epoch
 
-from moira.graphite.datalib import TimeSeries
+from moira.graphite.datalib import TimeSeries, ArrayTimeSeries, arraySeriesEnabled, toArray, numpy, splitNodes
 from twisted.internet import defer
 from twisted.internet.defer import inlineCallbacks, returnValue
 from functools import reduce
@@ -33,6 +40,8 @@ INF = float('inf')
 DAY = 86400
 HOUR = 3600
 MINUTE = 60
+# points lists shorter than this are sorted rather than partitioned with numpy
+SELECTION_THRESHOLD = 256
 
 UnitSystems = {
     'binary': (
@@ -193,6 +202,224 @@ def safeIsNotEmpty(values):
     safeValues = [v for v in values if v is not None]
     return len(safeValues) > 0
 
+
+def safeMedian(values):
+    safeValues = [v for v in values if v is not None]
+    if safeValues:
+        return sorted(safeValues)[len(safeValues) / 2]
+
+
+def groupSeriesByNodes(seriesList, positions, exclude=False):
+    """
+    Groups series by name nodes at positions, or by all other nodes if exclude, in a single pass.
+    Returns pairs of key and list of series in order of the first series of each group, key is
+    the nodes joined with dots.
+    """
+    positions = list(positions)
+    if exclude:
+        excluded = frozenset(positions)
+        keys = ['.'.join([node for i, node in enumerate(splitNodes(series.name)) if i not in excluded])
+                for series in seriesList]
+    elif len(positions) == 1:
+        position = positions[0]
+        keys = [splitNodes(series.name)[position] for series in seriesList]
+    else:
+        keys = ['.'.join([nodes[i] for i in positions]) for nodes in (splitNodes(s.name) for s in seriesList)]
+    groups = {}
+    order = []
+    for key, series in izip(keys, seriesList):
+        group = groups.get(key)
+        if group is None:
+            group = groups[key] = []
+            order.append(key)
+        group.append(series)
+    return [(key, groups[key]) for key in order]
+
+
+# Sliding window functions. Min, max and median windows are updated by the point
+# entering and the point leaving them instead of being sliced and folded again.
+
+
+def movingWindow(values, offset, length, windowPoints, func):
+    """
+    Same as [safeFunc(values[i + offset - windowPoints + 1:i + offset + 1]) for i in range(length)]
+    for func in 'avg', 'min', 'max' and 'median'
+    """
+    safeFunc = {'avg': safeAvg, 'min': safeMin, 'max': safeMax, 'median': safeMedian}[func]
+    first = offset - windowPoints + 1
+    # negative slice bounds count from the end, such windows are sliced as is
+    direct = min(length, max(0, -first, -offset - 1))
+    if func == 'avg' or any(v != v for v in values):
+        # running sum differs from safeSum by float rounding and inf - inf, nan is unordered
+        direct = length
+    result = [safeFunc(values[i + first:i + offset + 1]) for i in xrange(direct)]
+    if direct == length:
+        return result
+    if windowPoints <= 0:
+        return result + [None] * (length - direct)
+    start = direct + first
+    end = start + windowPoints
+    if func == 'median':
+        result.extend(_movingMedian(values, start, end, length - direct))
+    else:
+        result.extend(_movingExtremum(values, start, end, length - direct, func == 'max'))
+    return result
+
+
+def _movingExtremum(values, start, end, length, maximum):
+    # indices of window points, each greater (less) than every later one. The oldest
+    # of equal points is kept first as builtin max (min) returns the first of them.
+    windowPoints = end - start
+    candidates = deque()
+    for i in xrange(start, end + length - 1):
+        value = values[i]
+        if value is not None:
+            while candidates and (values[candidates[-1]] < value if maximum else values[candidates[-1]] > value):
+                candidates.pop()
+            candidates.append(i)
+        if i >= end - 1:
+            while candidates and candidates[0] <= i - windowPoints:
+                candidates.popleft()
+            yield values[candidates[0]] if candidates else None
+
+
+def _movingMedian(values, start, end, length):
+    window = sorted(v for v in values[start:end - 1] if v is not None)
+    for i in xrange(length):
+        if i:
+            value = values[start + i - 1]
+            if value is not None:
+                del window[bisect.bisect_left(window, value)]
+        value = values[end + i - 1]
+        if value is not None:
+            bisect.insort(window, value)
+        yield window[len(window) / 2] if window else None
+
+
+def bucketValues(values, buckets, bucketCount, func):
+    """
+    Folds value i into bucket buckets[i] of bucketCount, buckets must not decrease. Values
+    out of range of buckets and None are dropped. Same as sum, average, min, max or last
+    of points of each bucket for func 'sum', 'avg', 'min', 'max' and 'last', any other func
+    is 'sum'. Empty buckets are None.
+    """
+    values = list(values)  # consolidated points of series
+    length = min(len(values), len(buckets))
+    result = [None] * bucketCount
+    hi = bisect.bisect_left(buckets, 0, 0, length)
+    for bucket in xrange(bucketCount):
+        lo = hi
+        hi = bisect.bisect_left(buckets, bucket + 1, lo, length)
+        points = [v for v in values[lo:hi] if v is not None]
+        if not points:
+            continue
+        if func == 'avg':
+            result[bucket] = float(sum(points)) / float(len(points))
+        elif func == 'last':
+            result[bucket] = points[-1]
+        elif func == 'max':
+            result[bucket] = max(points)
+        elif func == 'min':
+            result[bucket] = min(points)
+        else:
+            result[bucket] = sum(points)
+    return result
+
+# Array utility functions, NaN stands for None. Points are folded in the same
+# order as the safe* functions above do to produce exactly the same floats.
+
+
+def seriesArrays(seriesList):
+    arrays = [toArray(s) for s in seriesList]
+    length = min(len(a) for a in arrays)
+    # izip stops when it hits the end of the shortest series
+    return [a[:length] for a in arrays]
+
+
+def arraySum(arrays):
+    total = numpy.zeros(len(arrays[0]))
+    count = numpy.zeros(len(arrays[0]))
+    for values in arrays:
+        present = ~numpy.isnan(values)
+        numpy.add(total, values, out=total, where=present)
+        count += present
+    total[count == 0] = NAN
+    return total, count
+
+
+def arrayDiv(a, b):
+    result = numpy.full(len(a), NAN)
+    valid = ~numpy.isnan(a) & ~numpy.isnan(b) & (b != 0)
+    numpy.divide(a, b, out=result, where=valid)
+    return result
+
+
+def arrayMovingWindow(values, offset, length, windowPoints, func):
+    # window for point i is values[i + offset - windowPoints + 1:i + offset + 1]
+    first = offset - windowPoints + 1
+    total = numpy.zeros(length)
+    count = numpy.zeros(length)
+    result = numpy.full(length, NAN)
+    for j in xrange(windowPoints):
+        column = values[first + j:first + j + length]
+        if func == 'avg':
+            present = ~numpy.isnan(column)
+            numpy.add(total, column, out=total, where=present)
+            count += present
+        elif func == 'min':
+            numpy.fmin(result, column, out=result)
+        else:
+            numpy.fmax(result, column, out=result)
+    if func == 'avg':
+        return arrayDiv(total, count)
+    return result
+
+
+def arrayDerivative(values, maxValue=None):
+    result = numpy.full(len(values), NAN)
+    if len(values) < 2:
+        return result
+    prev = values[:-1]
+    current = values[1:]
+    diff = current - prev
+    with numpy.errstate(invalid='ignore'):
+        increased = diff >= 0
+        result[1:][increased] = diff[increased]
+        if maxValue is not None:
+            wrapped = (diff < 0) & (maxValue >= current)
+            result[1:][wrapped] = ((maxValue - prev) + current + 1)[wrapped]
+    return result
+
+
+def arrayBucketValues(values, buckets, bucketCount, func):
+    # same as bucketValues, bincount and ufunc.at fold values of each bucket in order,
+    # so buckets may come in any order here
+    length = min(len(values), len(buckets))
+    values = values[:length]
+    buckets = numpy.asarray(buckets, dtype=numpy.intp)[:length]
+    present = ~numpy.isnan(values) & (buckets >= 0) & (buckets < bucketCount)
+    values = values[present]
+    buckets = buckets[present]
+    if len(values) == 0:
+        return numpy.full(bucketCount, NAN)
+    counts = numpy.bincount(buckets, minlength=bucketCount)
+    if func == 'min':
+        result = numpy.full(bucketCount, INF)
+        numpy.minimum.at(result, buckets, values)
+    elif func == 'max':
+        result = numpy.full(bucketCount, -INF)
+        numpy.maximum.at(result, buckets, values)
+    elif func == 'last':
+        last = numpy.full(bucketCount, -1, dtype=numpy.intp)
+        numpy.maximum.at(last, buckets, numpy.arange(len(values)))
+        result = values[last]
+    else:
+        result = numpy.bincount(buckets, weights=values, minlength=bucketCount)
+        if func == 'avg':
+            result /= numpy.maximum(counts, 1)
+    result[counts == 0] = NAN
+    return result
+
 # Greatest common divisor
 
 
@@ -238,6 +465,109 @@ def formatPathExpressions(seriesList):
      for s in seriesList if not pathExpressions.count(s.pathExpression)]
     return ','.join(pathExpressions)
 
+# Pointwise steps. A step renames series as its function does and returns series
+# to keep the result in and transform of a single value. Steps of chained pointwise
+# functions are applied to every series in one pass, see applyPointwise.
+
+
+def scalePoints(factor):
+    def step(series):
+        series.name = "scale(%s,%g)" % (series.name, float(factor))
+        series.pathExpression = series.name
+        return series, lambda value: safeMul(value, factor)
+    return step
+
+
+def scaleToSecondsPoints(seconds):
+    def step(series):
+        series.name = "scaleToSeconds(%s,%d)" % (series.name, seconds)
+        series.pathExpression = series.name
+        factor = seconds * 1.0 / series.step
+        return series, lambda value: safeMul(value, factor)
+    return step
+
+
+def powPoints(factor):
+    def step(series):
+        series.name = "pow(%s,%g)" % (series.name, float(factor))
+        series.pathExpression = series.name
+        return series, lambda value: safePow(value, factor)
+    return step
+
+
+def squareRootPoints():
+    def step(series):
+        series.name = "squareRoot(%s)" % (series.name)
+        return series, lambda value: safePow(value, 0.5)
+    return step
+
+
+def invertPoints():
+    def step(series):
+        series.name = "invert(%s)" % (series.name)
+        return series, lambda value: safePow(value, -1)
+    return step
+
+
+def absolutePoints():
+    def step(series):
+        series.name = "absolute(%s)" % (series.name)
+        series.pathExpression = series.name
+        return series, safeAbs
+    return step
+
+
+def offsetPoints(factor):
+    def step(series):
+        series.name = "offset(%s,%g)" % (series.name, float(factor))
+        series.pathExpression = series.name
+        return series, lambda value: value if value is None else value + factor
+    return step
+
+
+def logarithmPoints(base=10):
+    def transform(value):
+        if value is None or value <= 0:
+            return None
+        return math.log(value, base)
+
+    def step(series):
+        newName = "log(%s, %s)" % (series.name, base)
+        newSeries = TimeSeries(newName, series.start, series.end, series.step, [])
+        newSeries.pathExpression = newName
+        return newSeries, transform
+    return step
+
+
+def transformNullPoints(default=0):
+    def step(series):
+        series.name = "transformNull(%s,%g)" % (series.name, default)
+        series.pathExpression = series.name
+        return series, lambda value: default if value is None else value
+    return step
+
+
+def applySteps(series, steps):
+    result = series
+    transforms = []
+    for step in steps:
+        result, transform = step(result)
+        transforms.append(transform)
+    if len(transforms) == 1:
+        values = [transforms[0](value) for value in series]
+    else:
+        values = []
+        for value in series:
+            for transform in transforms:
+                value = transform(value)
+            values.append(value)
+    result[:len(values)] = values
+    return result
+
+
+def applyPointwise(seriesList, steps):
+    return [applySteps(series, steps) for series in seriesList]
+
 # Series Functions
 
 # NOTE: Some of the functions below use izip, which may be problematic.
@@ -246,7 +576,6 @@ def formatPathExpressions(seriesList):
 # the same interval, despite having possibly different steps...
 
 
-@inlineCallbacks
 def sumSeries(requestContext, *seriesLists):
     """
     Short form: sum()
@@ -266,19 +595,21 @@ def sumSeries(requestContext, *seriesLists):
     of the other metrics is averaged for the metrics with finer retention rates.
 
     """
-    yield defer.succeed(None)
     try:
         (seriesList, start, end, step) = normalize(seriesLists)
     except:
-        returnValue([])
+        return []
     name = "sumSeries(%s)" % formatPathExpressions(seriesList)
-    values = (safeSum(row) for row in izip(*seriesList))
-    series = TimeSeries(name, start, end, step, values)
+    if arraySeriesEnabled():
+        total, _ = arraySum(seriesArrays(seriesList))
+        series = ArrayTimeSeries(name, start, end, step, total)
+    else:
+        values = (safeSum(row) for row in izip(*seriesList))
+        series = TimeSeries(name, start, end, step, values)
     series.pathExpression = name
-    returnValue([series])
+    return [series]
 
 
-@inlineCallbacks
 def sumSeriesWithWildcards(requestContext, seriesList, *position):  # XXX
     """
     Call sumSeries after inserting wildcards at the given position(s).
@@ -293,30 +624,23 @@ def sumSeriesWithWildcards(requestContext, seriesList, *position):  # XXX
     ``target=sumSeries(host.cpu-[0-7].cpu-user.value)&target=sumSeries(host.cpu-[0-7].cpu-system.value)``
 
     """
-    yield defer.succeed(None)
     if isinstance(position, int):
         positions = [position]
     else:
         positions = position
 
-    newSeries = {}
-    newNames = list()
-
-    for series in seriesList:
-        newname = '.'.join(map(lambda x: x[1], filter(
-            lambda i: i[0] not in positions, enumerate(series.name.split('.')))))
-        if newname in newSeries:
-            newSeries[newname] = (yield sumSeries(
-                requestContext, (series, newSeries[newname])))[0]
-        else:
-            newSeries[newname] = series
-            newNames.append(newname)
-        newSeries[newname].name = newname
+    result = []
+    for newname, group in groupSeriesByNodes(seriesList, positions, exclude=True):
+        newSeries = group[0]
+        newSeries.name = newname
+        for series in group[1:]:
+            newSeries = sumSeries(requestContext, (series, newSeries))[0]
+            newSeries.name = newname
+        result.append(newSeries)
 
-    returnValue([newSeries[name] for name in newNames])
+    return result
 
 
-@inlineCallbacks
 def averageSeriesWithWildcards(requestContext, seriesList, *position):  # XXX
     """
     Call averageSeries after inserting wildcards at the given position(s).
@@ -331,26 +655,17 @@ def averageSeriesWithWildcards(requestContext, seriesList, *position):  # XXX
     ``target=averageSeries(host.*.cpu-user.value)&target=averageSeries(host.*.cpu-system.value)``
 
     """
-    yield defer.succeed(None)
     if isinstance(position, int):
         positions = [position]
     else:
         positions = position
     result = []
-    matchedList = {}
-    for series in seriesList:
-        newname = '.'.join(map(lambda x: x[1], filter(
-            lambda i: i[0] not in positions, enumerate(series.name.split('.')))))
-        if newname not in matchedList:
-            matchedList[newname] = []
-        matchedList[newname].append(series)
-    for name in matchedList.keys():
-        result.append((yield averageSeries(requestContext, (matchedList[name])))[0])
+    for name, group in groupSeriesByNodes(seriesList, positions, exclude=True):
+        result.append(averageSeries(requestContext, group)[0])
         result[-1].name = name
-    returnValue(result)
+    return result
 
 
-@inlineCallbacks
 def multiplySeriesWithWildcards(requestContext, seriesList, *position):  # XXX
     """
     Call multiplySeries after inserting wildcards at the given position(s).
@@ -366,29 +681,22 @@ def multiplySeriesWithWildcards(requestContext, seriesList, *position):  # XXX
     web.host-1.avg-response.value, web.host-1.total-request.value)...``
 
     """
-    yield defer.succeed(None)
     if isinstance(position, int):
         positions = [position]
     else:
         positions = position
 
-    newSeries = {}
-    newNames = list()
-
-    for series in seriesList:
-        newname = '.'.join(map(lambda x: x[1], filter(
-            lambda i: i[0] not in positions, enumerate(series.name.split('.')))))
-        if newname in newSeries:
-            newSeries[newname] = multiplySeries(
-                requestContext, (newSeries[newname], series))[0]
-        else:
-            newSeries[newname] = series
-            newNames.append(newname)
-        newSeries[newname].name = newname
-    returnValue([newSeries[name] for name in newNames])
+    result = []
+    for newname, group in groupSeriesByNodes(seriesList, positions, exclude=True):
+        newSeries = group[0]
+        newSeries.name = newname
+        for series in group[1:]:
+            newSeries = multiplySeries(requestContext, (newSeries, series))[0]
+            newSeries.name = newname
+        result.append(newSeries)
+    return result
 
 
-@inlineCallbacks
 def diffSeries(requestContext, *seriesLists):
     """
     Subtracts series 2 through n from series 1.
@@ -411,16 +719,14 @@ def diffSeries(requestContext, *seriesLists):
       &target=offset(diffSeries(service.connections.total,service.connections.failed),-4)
 
     """
-    yield defer.succeed(None)
     (seriesList, start, end, step) = normalize(seriesLists)
     name = "diffSeries(%s)" % formatPathExpressions(seriesList)
     values = (safeDiff(row) for row in izip(*seriesList))
     series = TimeSeries(name, start, end, step, values)
     series.pathExpression = name
-    returnValue([series])
+    return [series]
 
 
-@inlineCallbacks
 def averageSeries(requestContext, *seriesLists):
     """
     Short Alias: avg()
@@ -435,16 +741,18 @@ def averageSeries(requestContext, *seriesLists):
       &target=averageSeries(company.server.*.threads.busy)
 
     """
-    yield defer.succeed(None)
     (seriesList, start, end, step) = normalize(seriesLists)
     name = "averageSeries(%s)" % formatPathExpressions(seriesList)
-    values = (safeDiv(safeSum(row), safeLen(row)) for row in izip(*seriesList))
-    series = TimeSeries(name, start, end, step, values)
+    if arraySeriesEnabled():
+        total, count = arraySum(seriesArrays(seriesList))
+        series = ArrayTimeSeries(name, start, end, step, arrayDiv(total, count))
+    else:
+        values = (safeDiv(safeSum(row), safeLen(row)) for row in izip(*seriesList))
+        series = TimeSeries(name, start, end, step, values)
     series.pathExpression = name
-    returnValue([series])
+    return [series]
 
 
-@inlineCallbacks
 def stddevSeries(requestContext, *seriesLists):
     """
 
@@ -458,16 +766,14 @@ def stddevSeries(requestContext, *seriesLists):
       &target=stddevSeries(company.server.*.threads.busy)
 
     """
-    yield defer.succeed(None)
     (seriesList, start, end, step) = normalize(seriesLists)
     name = "stddevSeries(%s)" % formatPathExpressions(seriesList)
     values = (safeStdDev(row) for row in izip(*seriesList))
     series = TimeSeries(name, start, end, step, values)
     series.pathExpression = name
-    returnValue([series])
+    return [series]
 
 
-@inlineCallbacks
 def minSeries(requestContext, *seriesLists):
     """
     Takes one metric or a wildcard seriesList.
@@ -479,16 +785,14 @@ def minSeries(requestContext, *seriesLists):
 
       &target=minSeries(Server*.connections.total)
     """
-    yield defer.succeed(None)
     (seriesList, start, end, step) = normalize(seriesLists)
     name = "minSeries(%s)" % formatPathExpressions(seriesList)
     values = (safeMin(row) for row in izip(*seriesList))
     series = TimeSeries(name, start, end, step, values)
     series.pathExpression = name
-    returnValue([series])
+    return [series]
 
 
-@inlineCallbacks
 def maxSeries(requestContext, *seriesLists):
     """
     Takes one metric or a wildcard seriesList.
@@ -501,16 +805,14 @@ def maxSeries(requestContext, *seriesLists):
       &target=maxSeries(Server*.connections.total)
 
     """
-    yield defer.succeed(None)
     (seriesList, start, end, step) = normalize(seriesLists)
     name = "maxSeries(%s)" % formatPathExpressions(seriesList)
     values = (safeMax(row) for row in izip(*seriesList))
     series = TimeSeries(name, start, end, step, values)
     series.pathExpression = name
-    returnValue([series])
+    return [series]
 
 
-@inlineCallbacks
 def rangeOfSeries(requestContext, *seriesLists):
     """
     Takes a wildcard seriesList.
@@ -523,16 +825,14 @@ def rangeOfSeries(requestContext, *seriesLists):
         &target=rangeOfSeries(Server*.connections.total)
 
     """
-    yield defer.succeed(None)
     (seriesList, start, end, step) = normalize(seriesLists)
     name = "rangeOfSeries(%s)" % formatPathExpressions(seriesList)
     values = (safeSubtract(max(row), min(row)) for row in izip(*seriesList))
     series = TimeSeries(name, start, end, step, values)
     series.pathExpression = name
-    returnValue([series])
+    return [series]
 
 
-@inlineCallbacks
 def percentileOfSeries(requestContext, seriesList, n, interpolate=False):
     """
     percentileOfSeries returns a single series which is composed of the n-percentile
@@ -540,7 +840,6 @@ def percentileOfSeries(requestContext, seriesList, n, interpolate=False):
     set to True, percentile values are actual values contained in one of the
     supplied series.
     """
-    yield defer.succeed(None)
     if n <= 0:
         raise ValueError(
             'The requested percent is required to be greater than 0')
@@ -551,10 +850,9 @@ def percentileOfSeries(requestContext, seriesList, n, interpolate=False):
     resultSeries = TimeSeries(name, start, end, step, values)
     resultSeries.pathExpression = name
 
-    returnValue([resultSeries])
+    return [resultSeries]
 
 
-@inlineCallbacks
 def keepLastValue(requestContext, seriesList, limit=INF):
     """
     Takes one metric or a wildcard seriesList, and optionally a limit to the number
@@ -570,7 +868,6 @@ def keepLastValue(requestContext, seriesList, limit=INF):
       &target=keepLastValue(Server01.connections.handled, 10)
 
     """
-    yield defer.succeed(None)
     for series in seriesList:
         series.name = "keepLastValue(%s)" % (series.name)
         series.pathExpression = series.name
@@ -601,10 +898,9 @@ def keepLastValue(requestContext, seriesList, limit=INF):
             for index in xrange(len(series) - consecutiveNones, len(series)):
                 series[index] = series[len(series) - consecutiveNones - 1]
 
-    returnValue(seriesList)
+    return seriesList
 
 
-@inlineCallbacks
 def changed(requestContext, seriesList):
     """
     Takes one metric or a wildcard seriesList.
@@ -617,7 +913,6 @@ def changed(requestContext, seriesList):
       &target=changed(Server01.connections.handled)
 
     """
-    yield defer.succeed(None)
     for series in seriesList:
         series.name = "changed(%s)" % (series.name)
         series.pathExpression = series.name
@@ -631,10 +926,9 @@ def changed(requestContext, seriesList):
                 previous = value
             else:
                 series[i] = 0
-    returnValue(seriesList)
+    return seriesList
 
 
-@inlineCallbacks
 def asPercent(requestContext, seriesList, total=None):
     """
 
@@ -653,9 +947,11 @@ def asPercent(requestContext, seriesList, total=None):
       &target=asPercent(Server01.cpu.*.jiffies)
 
     """
-    yield defer.succeed(None)
     normalize([seriesList])
 
+    if arraySeriesEnabled():
+        return _arrayAsPercent(seriesList, total)
+
     if total is None:
         totalValues = [safeSum(row) for row in izip(*seriesList)]
         totalText = None  # series.pathExpression
@@ -689,10 +985,40 @@ def asPercent(requestContext, seriesList, total=None):
         resultSeries.pathExpression = name
         resultList.append(resultSeries)
 
-    returnValue(resultList)
+    return resultList
+
+
+def _arrayAsPercent(seriesList, total):
+    if total is None:
+        totalValues, _ = arraySum(seriesArrays(seriesList))
+        totalText = None
+    elif isinstance(total, list):
+        if len(total) != 1:
+            raise ValueError(
+                "asPercent second argument must reference exactly 1 series")
+        normalize([seriesList, total])
+        totalValues = toArray(total[0])
+        totalText = total[0].name
+    else:
+        totalValues = numpy.full(len(seriesList[0]), float(total))
+        totalText = str(total)
+
+    resultList = []
+    for series in seriesList:
+        values, totalSlice = seriesArrays([series, totalValues])
+        name = "asPercent(%s, %s)" % (
+            series.name, totalText or series.pathExpression)
+        resultSeries = ArrayTimeSeries(
+            name,
+            series.start,
+            series.end,
+            series.step,
+            arrayDiv(values, totalSlice) * 100.0)
+        resultSeries.pathExpression = name
+        resultList.append(resultSeries)
+    return resultList
 
 
-@inlineCallbacks
 def divideSeries(requestContext, dividendSeriesList, divisorSeries):
     """
     Takes a dividend metric and a divisor metric and draws the division result.
@@ -708,7 +1034,6 @@ def divideSeries(requestContext, dividendSeriesList, divisorSeries):
 
 
     """
-    yield defer.succeed(None)
     if len(divisorSeries) != 1:
         raise ValueError(
             "divideSeries second argument must reference exactly 1 series")
@@ -729,16 +1054,18 @@ def divideSeries(requestContext, dividendSeriesList, divisorSeries):
         end = max([s.end for s in bothSeries])
         end -= (end - start) % step
 
-        values = (safeDiv(v1, v2) for v1, v2 in izip(*bothSeries))
-
-        quotientSeries = TimeSeries(name, start, end, step, values)
+        if arraySeriesEnabled():
+            dividend, divisor = seriesArrays(bothSeries)
+            quotientSeries = ArrayTimeSeries(name, start, end, step, arrayDiv(dividend, divisor))
+        else:
+            values = (safeDiv(v1, v2) for v1, v2 in izip(*bothSeries))
+            quotientSeries = TimeSeries(name, start, end, step, values)
         quotientSeries.pathExpression = name
         results.append(quotientSeries)
 
-    returnValue(results)
+    return results
 
 
-@inlineCallbacks
 def multiplySeries(requestContext, *seriesLists):
     """
     Takes two or more series and multiplies their points. A constant may not be
@@ -753,20 +1080,18 @@ def multiplySeries(requestContext, *seriesLists):
 
     """
 
-    yield defer.succeed(None)
     (seriesList, start, end, step) = normalize(seriesLists)
 
     if len(seriesList) == 1:
-        returnValue(seriesList)
+        return seriesList
 
     name = "multiplySeries(%s)" % ','.join([s.name for s in seriesList])
     product = imap(lambda x: safeMul(*x), izip(*seriesList))
     resultSeries = TimeSeries(name, start, end, step, product)
     resultSeries.pathExpression = name
-    returnValue([resultSeries])
+    return [resultSeries]
 
 
-@inlineCallbacks
 def weightedAverage(requestContext, seriesListAvg, seriesListWeight, node):
     """
     Takes a series of average values and a series of weights and
@@ -783,16 +1108,15 @@ def weightedAverage(requestContext, seriesListAvg, seriesListWeight, node):
 
     """
 
-    yield defer.succeed(None)
     sortedSeries = {}
 
     for seriesAvg, seriesWeight in izip(seriesListAvg, seriesListWeight):
-        key = seriesAvg.name.split(".")[node]
+        key = seriesAvg.nodes[node]
         if key not in sortedSeries:
             sortedSeries[key] = {}
 
         sortedSeries[key]['avg'] = seriesAvg
-        key = seriesWeight.name.split(".")[node]
+        key = seriesWeight.nodes[node]
         if key not in sortedSeries:
             sortedSeries[key] = {}
         sortedSeries[key]['weight'] = seriesWeight
@@ -838,7 +1162,7 @@ def weightedAverage(requestContext, seriesListAvg, seriesListWeight, node):
         sumProducts.step,
         resultValues)
     resultSeries.pathExpression = name
-    returnValue(resultSeries)
+    return resultSeries
 
 
 @inlineCallbacks
@@ -887,29 +1211,21 @@ def movingMedian(requestContext, seriesList, windowSize):
             newName = 'movingMedian(%s,"%s")' % (series.name, windowSize)
         else:
             newName = "movingMedian(%s,%d)" % (series.name, windowPoints)
+
+        offset = len(bootstrap) - len(series)
+        # median window ends before the current point
         newSeries = TimeSeries(
             newName,
             series.start,
             series.end,
             series.step,
-            [])
+            movingWindow(bootstrap, offset - 1, len(series), windowPoints, 'median'))
         newSeries.pathExpression = newName
-
-        offset = len(bootstrap) - len(series)
-        for i in range(len(series)):
-            window = bootstrap[i + offset - windowPoints:i + offset]
-            nonNull = [v for v in window if v is not None]
-            if nonNull:
-                m_index = len(nonNull) / 2
-                newSeries.append(sorted(nonNull)[m_index])
-            else:
-                newSeries.append(None)
         result.append(newSeries)
 
     returnValue(result)
 
 
-@inlineCallbacks
 def scale(requestContext, seriesList, factor):
     """
     Takes one metric or a wildcard seriesList followed by a constant, and multiplies the datapoint
@@ -923,16 +1239,16 @@ def scale(requestContext, seriesList, factor):
       &target=scale(Server.instance*.threads.busy,10)
 
     """
-    yield defer.succeed(None)
+    step = scalePoints(factor)
     for series in seriesList:
-        series.name = "scale(%s,%g)" % (series.name, float(factor))
-        series.pathExpression = series.name
-        for i, value in enumerate(series):
-            series[i] = safeMul(value, factor)
-    returnValue(seriesList)
+        if isinstance(series, ArrayTimeSeries):
+            step(series)
+            series.values = toArray(series.values * float(factor))
+        else:
+            applySteps(series, [step])
+    return seriesList
 
 
-@inlineCallbacks
 def scaleToSeconds(requestContext, seriesList, seconds):
     """
     Takes one metric or a wildcard seriesList and returns "value per seconds" where
@@ -942,17 +1258,9 @@ def scaleToSeconds(requestContext, seriesList, seconds):
     to normalize its result to a known resolution for arbitrary retentions
     """
 
-    yield defer.succeed(None)
-    for series in seriesList:
-        series.name = "scaleToSeconds(%s,%d)" % (series.name, seconds)
-        series.pathExpression = series.name
-        for i, value in enumerate(series):
-            factor = seconds * 1.0 / series.step
-            series[i] = safeMul(value, factor)
-    returnValue(seriesList)
+    return applyPointwise(seriesList, [scaleToSecondsPoints(seconds)])
 
 
-@inlineCallbacks
 def pow(requestContext, seriesList, factor):
     """
     Takes one metric or a wildcard seriesList followed by a constant, and raises the datapoint
@@ -966,16 +1274,9 @@ def pow(requestContext, seriesList, factor):
       &target=pow(Server.instance*.threads.busy,10)
 
     """
-    yield defer.succeed(None)
-    for series in seriesList:
-        series.name = "pow(%s,%g)" % (series.name, float(factor))
-        series.pathExpression = series.name
-        for i, value in enumerate(series):
-            series[i] = safePow(value, factor)
-    returnValue(seriesList)
+    return applyPointwise(seriesList, [powPoints(factor)])
 
 
-@inlineCallbacks
 def squareRoot(requestContext, seriesList):
     """
     Takes one metric or a wildcard seriesList, and computes the square root of each datapoint.
@@ -987,15 +1288,9 @@ def squareRoot(requestContext, seriesList):
       &target=squareRoot(Server.instance01.threads.busy)
 
     """
-    yield defer.succeed(None)
-    for series in seriesList:
-        series.name = "squareRoot(%s)" % (series.name)
-        for i, value in enumerate(series):
-            series[i] = safePow(value, 0.5)
-    returnValue(seriesList)
+    return applyPointwise(seriesList, [squareRootPoints()])
 
 
-@inlineCallbacks
 def invert(requestContext, seriesList):
     """
     Takes one metric or a wildcard seriesList, and inverts each datapoint (i.e. 1/x).
@@ -1007,15 +1302,9 @@ def invert(requestContext, seriesList):
       &target=invert(Server.instance01.threads.busy)
 
     """
-    yield defer.succeed(None)
-    for series in seriesList:
-        series.name = "invert(%s)" % (series.name)
-        for i, value in enumerate(series):
-            series[i] = safePow(value, -1)
-    returnValue(seriesList)
+    return applyPointwise(seriesList, [invertPoints()])
 
 
-@inlineCallbacks
 def absolute(requestContext, seriesList):
     """
     Takes one metric or a wildcard seriesList and applies the mathematical abs function to each
@@ -1028,13 +1317,7 @@ def absolute(requestContext, seriesList):
       &target=absolute(Server.instance01.threads.busy)
       &target=absolute(Server.instance*.threads.busy)
     """
-    yield defer.succeed(None)
-    for series in seriesList:
-        series.name = "absolute(%s)" % (series.name)
-        series.pathExpression = series.name
-        for i, value in enumerate(series):
-            series[i] = safeAbs(value)
-    returnValue(seriesList)
+    return applyPointwise(seriesList, [absolutePoints()])
 
 
 def offset(requestContext, seriesList, factor):
@@ -1049,16 +1332,16 @@ def offset(requestContext, seriesList, factor):
       &target=offset(Server.instance01.threads.busy,10)
 
     """
+    step = offsetPoints(factor)
     for series in seriesList:
-        series.name = "offset(%s,%g)" % (series.name, float(factor))
-        series.pathExpression = series.name
-        for i, value in enumerate(series):
-            if value is not None:
-                series[i] = value + factor
+        if isinstance(series, ArrayTimeSeries):
+            step(series)
+            series.values = toArray(series.values + factor)
+        else:
+            applySteps(series, [step])
     return seriesList
 
 
-@inlineCallbacks
 def offsetToZero(requestContext, seriesList):
     """
     Offsets a metric or wildcard seriesList by subtracting the minimum
@@ -1089,14 +1372,13 @@ def offsetToZero(requestContext, seriesList):
       &target=offsetToZero(Server.instance*.responseTime)
 
     """
-    yield defer.succeed(None)
     for series in seriesList:
         series.name = "offsetToZero(%s)" % (series.name)
         minimum = safeMin(series)
         for i, value in enumerate(series):
             if value is not None:
                 series[i] = value - minimum
-    returnValue(seriesList)
+    return seriesList
 
 
 @inlineCallbacks
@@ -1146,19 +1428,26 @@ def movingAverage(requestContext, seriesList, windowSize, func='avg'):
             newName = 'movingAverage(%s,"%s")' % (series.name, windowSize)
         else:
             newName = "movingAverage(%s,%s)" % (series.name, windowSize)
+
+        offset = len(bootstrap) - len(series)
+        if arraySeriesEnabled() and func in t_funcs and 0 <= windowPoints <= offset + 1:
+            newSeries = ArrayTimeSeries(
+                newName,
+                series.start,
+                series.end,
+                series.step,
+                arrayMovingWindow(toArray(bootstrap), offset, len(series), windowPoints, func))
+            newSeries.pathExpression = newName
+            result.append(newSeries)
+            continue
+
         newSeries = TimeSeries(
             newName,
             series.start,
             series.end,
             series.step,
-            [])
+            movingWindow(bootstrap, offset, len(series), windowPoints, func))
         newSeries.pathExpression = newName
-
-        offset = len(bootstrap) - len(series)
-        for i in range(len(series)):
-            window = bootstrap[i + offset - windowPoints + 1:i + offset + 1]
-            newSeries.append(t_funcs[func](window))
-
         result.append(newSeries)
 
     returnValue(result)
@@ -1191,19 +1480,15 @@ def movingMax(requestContext, seriesList, windowSize):
             newName = 'movingMax(%s,"%s")' % (series.name, windowSize)
         else:
             newName = "movingMax(%s,%s)" % (series.name, windowSize)
+
+        offset = len(bootstrap) - len(series)
         newSeries = TimeSeries(
             newName,
             series.start,
             series.end,
             series.step,
-            [])
+            movingWindow(bootstrap, offset, len(series), windowPoints, 'max'))
         newSeries.pathExpression = newName
-
-        offset = len(bootstrap) - len(series)
-        for i in range(len(series)):
-            window = bootstrap[i + offset - windowPoints + 1:i + offset + 1]
-            newSeries.append(safeMax(window))
-
         result.append(newSeries)
 
     returnValue(result)
@@ -1236,24 +1521,19 @@ def movingMin(requestContext, seriesList, windowSize):
             newName = 'movingMin(%s,"%s")' % (series.name, windowSize)
         else:
             newName = "movingMin(%s,%s)" % (series.name, windowSize)
+
+        offset = len(bootstrap) - len(series)
         newSeries = TimeSeries(
             newName,
             series.start,
             series.end,
             series.step,
-            [])
+            movingWindow(bootstrap, offset, len(series), windowPoints, 'min'))
         newSeries.pathExpression = newName
-
-        offset = len(bootstrap) - len(series)
-        for i in range(len(series)):
-            window = bootstrap[i + offset - windowPoints + 1:i + offset + 1]
-            newSeries.append(safeMin(window))
-
         result.append(newSeries)
 
     returnValue(result)
 
-@inlineCallbacks
 def cumulative(requestContext, seriesList, consolidationFunc='sum'):
     """
     Takes one metric or a wildcard seriesList, and an optional function.
@@ -1269,12 +1549,9 @@ def cumulative(requestContext, seriesList, consolidationFunc='sum'):
       &target=cumulative(Sales.widgets.largeBlue)
 
     """
-    yield defer.succeed(None)
-    result = yield consolidateBy(requestContext, seriesList, 'sum')
-    returnValue(result)
+    return consolidateBy(requestContext, seriesList, 'sum')
 
 
-@inlineCallbacks
 def consolidateBy(requestContext, seriesList, consolidationFunc):
     """
     Takes one metric or a wildcard seriesList and a consolidation function name.
@@ -1294,7 +1571,6 @@ def consolidateBy(requestContext, seriesList, consolidationFunc):
       &target=consolidateBy(Servers.web01.sda1.free_space, 'max')
 
     """
-    yield defer.succeed(None)
     for series in seriesList:
         # datalib will throw an exception, so it's not necessary to validate
         # here
@@ -1302,10 +1578,9 @@ def consolidateBy(requestContext, seriesList, consolidationFunc):
         series.name = 'consolidateBy(%s,"%s")' % (
             series.name, series.consolidationFunc)
         series.pathExpression = series.name
-    returnValue(seriesList)
+    return seriesList
 
 
-@inlineCallbacks
 def derivative(requestContext, seriesList):
     """
     This is the opposite of the integral function.  This is useful for taking a
@@ -1325,7 +1600,6 @@ def derivative(requestContext, seriesList):
     idea of the packets per minute sent or received, even though you're only
     recording the total.
     """
-    yield defer.succeed(None)
     results = []
     for series in seriesList:
         newValues = []
@@ -1346,10 +1620,9 @@ def derivative(requestContext, seriesList):
             newValues)
         newSeries.pathExpression = newName
         results.append(newSeries)
-    returnValue(results)
+    return results
 
 
-@inlineCallbacks
 def perSecond(requestContext, seriesList, maxValue=None):
     """
     Derivative adjusted for the series time interval
@@ -1367,9 +1640,19 @@ def perSecond(requestContext, seriesList, maxValue=None):
     idea of the packets per minute sent or received, even though you're only
     recording the total.
     """
-    yield defer.succeed(None)
     results = []
     for series in seriesList:
+        if arraySeriesEnabled():
+            newName = "perSecond(%s)" % series.name
+            newSeries = ArrayTimeSeries(
+                newName,
+                series.start,
+                series.end,
+                series.step,
+                arrayDerivative(toArray(series), maxValue) / series.step)
+            newSeries.pathExpression = newName
+            results.append(newSeries)
+            continue
         newValues = []
         prev = None
         for val in series:
@@ -1397,10 +1680,9 @@ def perSecond(requestContext, seriesList, maxValue=None):
             newValues)
         newSeries.pathExpression = newName
         results.append(newSeries)
-    returnValue(results)
+    return results
 
 
-@inlineCallbacks
 def integral(requestContext, seriesList):
     """
     This will show the sum over time, sort of like a continuous addition function.
@@ -1416,7 +1698,6 @@ def integral(requestContext, seriesList):
     minute, and show the total sales for the time period selected at the right
     side, (time now, or the time specified by '&until=').
     """
-    yield defer.succeed(None)
     results = []
     for series in seriesList:
         newValues = []
@@ -1436,10 +1717,9 @@ def integral(requestContext, seriesList):
             newValues)
         newSeries.pathExpression = newName
         results.append(newSeries)
-    returnValue(results)
+    return results
 
 
-@inlineCallbacks
 def nonNegativeDerivative(requestContext, seriesList, maxValue=None):
     """
     Same as the derivative function above, but ignores datapoints that trend
@@ -1454,10 +1734,20 @@ def nonNegativeDerivative(requestContext, seriesList, maxValue=None):
       &target=nonNegativederivative(company.server.application01.ifconfig.TXPackets)
 
     """
-    yield defer.succeed(None)
     results = []
 
     for series in seriesList:
+        if arraySeriesEnabled():
+            newName = "nonNegativeDerivative(%s)" % series.name
+            newSeries = ArrayTimeSeries(
+                newName,
+                series.start,
+                series.end,
+                series.step,
+                arrayDerivative(toArray(series), maxValue))
+            newSeries.pathExpression = newName
+            results.append(newSeries)
+            continue
         newValues = []
         prev = None
 
@@ -1487,10 +1777,9 @@ def nonNegativeDerivative(requestContext, seriesList, maxValue=None):
         newSeries.pathExpression = newName
         results.append(newSeries)
 
-    returnValue(results)
+    return results
 
 
-@inlineCallbacks
 def stacked(requestContext, seriesLists, stackName='__DEFAULT__'):
     """
     Takes one metric or a wildcard seriesList and change them so they are
@@ -1508,7 +1797,6 @@ def stacked(requestContext, seriesLists, stackName='__DEFAULT__'):
       &target=stacked(company.server.application01.ifconfig.TXPackets, 'tx')
 
     """
-    yield defer.succeed(None)
     if 'totalStack' in requestContext:
         totalStack = requestContext['totalStack'].get(stackName, [])
     else:
@@ -1543,10 +1831,9 @@ def stacked(requestContext, seriesLists, stackName='__DEFAULT__'):
         newSeries.pathExpression = newName
         results.append(newSeries)
     requestContext['totalStack'][stackName] = totalStack
-    returnValue(results)
+    return results
 
 
-@inlineCallbacks
 def areaBetween(requestContext, seriesList):
     """
     Draws the vertical area in between the two series in seriesList. Useful for
@@ -1576,7 +1863,6 @@ def areaBetween(requestContext, seriesList):
 
       &target=areaBetween(group(minSeries(a.*.min),maxSeries(a.*.max)))
     """
-    yield defer.succeed(None)
     assert len(
         seriesList) == 2, "areaBetween series argument must reference *exactly* 2 series"
     lower = seriesList[0]
@@ -1587,10 +1873,9 @@ def areaBetween(requestContext, seriesList):
 
     upper.options['stacked'] = True
     lower.name = upper.name = "areaBetween(%s)" % upper.pathExpression
-    returnValue(seriesList)
+    return seriesList
 
 
-@inlineCallbacks
 def aliasSub(requestContext, seriesList, search, replace):
     """
     Runs series names through a regex search/replace.
@@ -1599,13 +1884,12 @@ def aliasSub(requestContext, seriesList, search, replace):
 
       &target=aliasSub(ip.*TCP*,"^.*TCP(\d+)","\\1")
     """
-    yield defer.succeed(None)
     try:
         seriesList.name = re.sub(search, replace, seriesList.name)
     except AttributeError:
         for series in seriesList:
             series.name = re.sub(search, replace, series.name)
-    returnValue(seriesList)
+    return seriesList
 
 
 def alias(requestContext, seriesList, newName):
@@ -1626,7 +1910,6 @@ def alias(requestContext, seriesList, newName):
     return seriesList
 
 
-@inlineCallbacks
 def cactiStyle(requestContext, seriesList, system=None):
     """
     Takes a series list and modifies the aliases to provide column aligned
@@ -1653,9 +1936,8 @@ def cactiStyle(requestContext, seriesList, system=None):
       &target=cactiStyle(group(metricA,metricB))
 
     """
-    yield defer.succeed(None)
     if 0 == len(seriesList):
-        returnValue(seriesList)
+        return seriesList
     if system:
         fmt = lambda x: "%.2f%s" % format_units(x, system=system)
     else:
@@ -1691,10 +1973,9 @@ def cactiStyle(requestContext, seriesList, system=None):
              -lastLen, last,
              -maxLen, maximum,
              -minLen, minimum)
-    returnValue(seriesList)
+    return seriesList
 
 
-@inlineCallbacks
 def aliasByNode(requestContext, seriesList, *nodes):
     """
     Takes a seriesList and applies an alias derived from one or more "node"
@@ -1708,19 +1989,19 @@ def aliasByNode(requestContext, seriesList, *nodes):
     cb_pattern = re.compile(r"{([^,]+\,)*([^,])+}")
     mp_pattern = re.compile(r"(?:.*\()?(?P<name>[-\w*\.]+)(?:,|\)?.*)?")
     substitution = 'UNKNOWN'
-    yield defer.succeed(None)
     if isinstance(nodes, int):
         nodes = [nodes]
     for series in seriesList:
         curly_brackets = cb_pattern.search(series.name)
         if curly_brackets:
             substitution = curly_brackets.groups()[-1]
-        metric_pieces = mp_pattern.search(cb_pattern.sub(substitution, series.name)).groups()[0].split('.')
+        metric_name = mp_pattern.search(cb_pattern.sub(substitution, series.name)).groups()[0]
+        # plain metric names are split once
+        metric_pieces = series.nodes if metric_name == series.name else metric_name.split('.')
         series.name = '.'.join(metric_pieces[n] for n in nodes)
-    returnValue(seriesList)
+    return seriesList
 
 
-@inlineCallbacks
 def aliasByMetric(requestContext, seriesList):
     """
     Takes a seriesList and applies an alias derived from the base metric name.
@@ -1730,13 +2011,11 @@ def aliasByMetric(requestContext, seriesList):
       &target=aliasByMetric(carbon.agents.graphite.creates)
 
     """
-    yield defer.succeed(None)
     for series in seriesList:
-        series.name = series.name.split('.')[-1].split(',')[0]
-    returnValue(seriesList)
+        series.name = series.nodes[-1].split(',')[0]
+    return seriesList
 
 
-@inlineCallbacks
 def legendValue(requestContext, seriesList, *valueTypes):
     """
     Takes one metric or a wildcard seriesList and a string in quotes.
@@ -1750,7 +2029,6 @@ def legendValue(requestContext, seriesList, *valueTypes):
     &target=legendValue(Sales.widgets.largeBlue, 'avg', 'max', 'si')
 
     """
-    yield defer.succeed(None)
 
     def last(s):
         "Work-around for the missing last point"
@@ -1784,21 +2062,18 @@ def legendValue(requestContext, seriesList, *valueTypes):
                 series.name = "%-20s%-5s%-10s" % (series.name,
                                                   valueType,
                                                   formatted)
-    returnValue(seriesList)
+    return seriesList
 
 
-@inlineCallbacks
 def alpha(requestContext, seriesList, alpha):
     """
     Assigns the given alpha transparency setting to the series. Takes a float value between 0 and 1.
     """
-    yield defer.succeed(None)
     for series in seriesList:
         series.options['alpha'] = alpha
-    returnValue(seriesList)
+    return seriesList
 
 
-@inlineCallbacks
 def color(requestContext, seriesList, theColor):
     """
     Assigns the given color to the seriesList
@@ -1813,13 +2088,11 @@ def color(requestContext, seriesList, theColor):
       &target=color(collectd.hostname.cpu.0.idle, '6464ffaa')
 
     """
-    yield defer.succeed(None)
     for series in seriesList:
         series.color = theColor
-    returnValue(seriesList)
+    return seriesList
 
 
-@inlineCallbacks
 def substr(requestContext, seriesList, start=0, stop=0):
     """
     Takes one metric or a wildcard seriesList followed by 1 or 2 integers.  Assume that the
@@ -1837,24 +2110,22 @@ def substr(requestContext, seriesList, start=0, stop=0):
     The label would be printed as "hostname.avgUpdateTime".
 
     """
-    yield defer.succeed(None)
     for series in seriesList:
         left = series.name.rfind('(') + 1
         right = series.name.find(')')
         if right < 0:
             right = len(series.name) + 1
-        cleanName = series.name[left:right:]
+        nodes = series.nodes if left == 0 and right > len(series.name) else series.name[left:right:].split('.')
         if int(stop) == 0:
-            series.name = '.'.join(cleanName.split('.')[int(start)::])
+            series.name = '.'.join(nodes[int(start)::])
         else:
-            series.name = '.'.join(cleanName.split('.')[int(start):int(stop):])
+            series.name = '.'.join(nodes[int(start):int(stop):])
 
         # substr(func(a.b,'c'),1) becomes b instead of b,'c'
         series.name = re.sub(',.*$', '', series.name)
-    returnValue(seriesList)
+    return seriesList
 
 
-@inlineCallbacks
 def logarithm(requestContext, seriesList, base=10):
     """
     Takes one metric or a wildcard seriesList, a base, and draws the y-axis in logarithmic
@@ -1867,30 +2138,9 @@ def logarithm(requestContext, seriesList, base=10):
       &target=log(carbon.agents.hostname.avgUpdateTime,2)
 
     """
-    yield defer.succeed(None)
-    results = []
-    for series in seriesList:
-        newValues = []
-        for val in series:
-            if val is None:
-                newValues.append(None)
-            elif val <= 0:
-                newValues.append(None)
-            else:
-                newValues.append(math.log(val, base))
-        newName = "log(%s, %s)" % (series.name, base)
-        newSeries = TimeSeries(
-            newName,
-            series.start,
-            series.end,
-            series.step,
-            newValues)
-        newSeries.pathExpression = newName
-        results.append(newSeries)
-    returnValue(results)
+    return applyPointwise(seriesList, [logarithmPoints(base)])
 
 
-@inlineCallbacks
 def maximumAbove(requestContext, seriesList, n):
     """
     Takes one metric or a wildcard seriesList followed by a constant n.
@@ -1904,15 +2154,13 @@ def maximumAbove(requestContext, seriesList, n):
 
     This would only display interfaces which sent more than 1000 packets/min.
     """
-    yield defer.succeed(None)
     results = []
     for series in seriesList:
         if max(series) > n:
             results.append(series)
-    returnValue(results)
+    return results
 
 
-@inlineCallbacks
 def minimumAbove(requestContext, seriesList, n):
     """
     Takes one metric or a wildcard seriesList followed by a constant n.
@@ -1926,15 +2174,13 @@ def minimumAbove(requestContext, seriesList, n):
 
     This would only display interfaces which sent more than 1000 packets/min.
     """
-    yield defer.succeed(None)
     results = []
     for series in seriesList:
         if min(series) > n:
             results.append(series)
-    returnValue(results)
+    return results
 
 
-@inlineCallbacks
 def maximumBelow(requestContext, seriesList, n):
     """
     Takes one metric or a wildcard seriesList followed by a constant n.
@@ -1949,15 +2195,13 @@ def maximumBelow(requestContext, seriesList, n):
     This would only display interfaces which sent less than 1000 packets/min.
     """
 
-    yield defer.succeed(None)
     result = []
     for series in seriesList:
         if max(series) <= n:
             result.append(series)
-    returnValue(result)
+    return result
 
 
-@inlineCallbacks
 def minimumBelow(requestContext, seriesList, n):
     """
     Takes one metric or a wildcard seriesList followed by a constant n.
@@ -1972,15 +2216,29 @@ def minimumBelow(requestContext, seriesList, n):
     This would only display interfaces which at one point sent less than 1000 packets/min.
     """
 
-    yield defer.succeed(None)
     result = []
     for series in seriesList:
         if min(series) <= n:
             result.append(series)
-    returnValue(result)
+    return result
+
+
+def _nsmallest(items, n, key):
+    """Same as sorted(items, key=key)[:n], but selects n items with a heap"""
+    if not isinstance(n, (int, long)) or n <= 0:
+        return sorted(items, key=key)[:n]
+    return heapq.nsmallest(n, items, key=key)
+
+
+def _nlargest(items, n, key):
+    """Same as sorted(items, key=key)[-n:], but selects n items with a heap"""
+    if not isinstance(n, (int, long)) or not 0 < n < len(items):
+        return sorted(items, key=key)[-n:]
+    # index breaks ties like a stable sort does and keeps items themselves out of comparison
+    top = heapq.nlargest(n, [(key(item), i, item) for i, item in enumerate(items)])
+    return [item for _, _, item in reversed(top)]
 
 
-@inlineCallbacks
 def highestCurrent(requestContext, seriesList, n):
     """
     Takes one metric or a wildcard seriesList followed by an integer N.
@@ -1996,11 +2254,9 @@ def highestCurrent(requestContext, seriesList, n):
     Draws the 5 servers with the highest busy threads.
 
     """
-    yield defer.succeed(None)
-    returnValue(sorted(seriesList, key=safeLast)[-n:])
+    return _nlargest(seriesList, n, key=safeLast)
 
 
-@inlineCallbacks
 def highestMax(requestContext, seriesList, n):
     """
     Takes one metric or a wildcard seriesList followed by an integer N.
@@ -2018,13 +2274,11 @@ def highestMax(requestContext, seriesList, n):
     period specified.
 
     """
-    yield defer.succeed(None)
-    result_list = sorted(seriesList, key=lambda s: max(s))[-n:]
+    result_list = _nlargest(seriesList, n, key=max)
 
-    returnValue(sorted(result_list, key=lambda s: max(s), reverse=True))
+    return sorted(result_list, key=lambda s: max(s), reverse=True)
 
 
-@inlineCallbacks
 def lowestCurrent(requestContext, seriesList, n):
     """
     Takes one metric or a wildcard seriesList followed by an integer N.
@@ -2041,11 +2295,9 @@ def lowestCurrent(requestContext, seriesList, n):
 
     """
 
-    yield defer.succeed(None)
-    returnValue(sorted(seriesList, key=safeLast)[:n])
+    return _nsmallest(seriesList, n, key=safeLast)
 
 
-@inlineCallbacks
 def currentAbove(requestContext, seriesList, n):
     """
     Takes one metric or a wildcard seriesList followed by an integer N.
@@ -2061,11 +2313,9 @@ def currentAbove(requestContext, seriesList, n):
     Draws the servers with more than 50 busy threads.
 
     """
-    yield defer.succeed(None)
-    returnValue([series for series in seriesList if safeLast(series) >= n])
+    return [series for series in seriesList if safeLast(series) >= n]
 
 
-@inlineCallbacks
 def currentBelow(requestContext, seriesList, n):
     """
     Takes one metric or a wildcard seriesList followed by an integer N.
@@ -2081,11 +2331,9 @@ def currentBelow(requestContext, seriesList, n):
     Draws the servers with less than 3 busy threads.
 
     """
-    yield defer.succeed(None)
-    returnValue([series for series in seriesList if safeLast(series) <= n])
+    return [series for series in seriesList if safeLast(series) <= n]
 
 
-@inlineCallbacks
 def highestAverage(requestContext, seriesList, n):
     """
     Takes one metric or a wildcard seriesList followed by an integer N.
@@ -2102,12 +2350,9 @@ def highestAverage(requestContext, seriesList, n):
 
     """
 
-    yield defer.succeed(None)
-    returnValue(
-        sorted(seriesList, key=lambda s: safeDiv(safeSum(s), safeLen(s)))[-n:])
+    return _nlargest(seriesList, n, key=lambda s: safeDiv(safeSum(s), safeLen(s)))
 
 
-@inlineCallbacks
 def lowestAverage(requestContext, seriesList, n):
     """
     Takes one metric or a wildcard seriesList followed by an integer N.
@@ -2124,17 +2369,9 @@ def lowestAverage(requestContext, seriesList, n):
 
     """
 
-    yield defer.succeed(None)
-    returnValue(
-        sorted(
-            seriesList,
-            key=lambda s: safeDiv(
-                safeSum(s),
-                safeLen(s)))[
-            :n])
+    return _nsmallest(seriesList, n, key=lambda s: safeDiv(safeSum(s), safeLen(s)))
 
 
-@inlineCallbacks
 def averageAbove(requestContext, seriesList, n):
     """
     Takes one metric or a wildcard seriesList followed by an integer N.
@@ -2150,12 +2387,10 @@ def averageAbove(requestContext, seriesList, n):
     Draws the servers with average values above 25.
 
     """
-    yield defer.succeed(None)
-    returnValue([series for series in seriesList if safeDiv(
-        safeSum(series), safeLen(series)) >= n])
+    return [series for series in seriesList if safeDiv(
+        safeSum(series), safeLen(series)) >= n]
 
 
-@inlineCallbacks
 def averageBelow(requestContext, seriesList, n):
     """
     Takes one metric or a wildcard seriesList followed by an integer N.
@@ -2171,9 +2406,8 @@ def averageBelow(requestContext, seriesList, n):
     Draws the servers with average values below 25.
 
     """
-    yield defer.succeed(None)
-    returnValue([series for series in seriesList if safeDiv(
-        safeSum(series), safeLen(series)) <= n])
+    return [series for series in seriesList if safeDiv(
+        safeSum(series), safeLen(series)) <= n]
 
 
 def _getPercentile(points, n, interpolate=False):
@@ -2182,10 +2416,10 @@ def _getPercentile(points, n, interpolate=False):
     Statistics Handbook:
     http://www.itl.nist.gov/div898/handbook/prc/section2/prc252.htm
     """
-    sortedPoints = sorted([p for p in points if p is not None])
-    if len(sortedPoints) == 0:
+    points = [p for p in points if p is not None]
+    if len(points) == 0:
         return None
-    fractionalRank = (n / 100.0) * (len(sortedPoints) + 1)
+    fractionalRank = (n / 100.0) * (len(points) + 1)
     rank = int(fractionalRank)
     rankFraction = fractionalRank - rank
 
@@ -2193,60 +2427,79 @@ def _getPercentile(points, n, interpolate=False):
         rank += int(math.ceil(rankFraction))
 
     if rank == 0:
-        percentile = sortedPoints[0]
-    elif rank - 1 == len(sortedPoints):
-        percentile = sortedPoints[-1]
+        index = 0
+    elif rank - 1 == len(points):
+        index = -1
     else:
-        percentile = sortedPoints[rank - 1]  # Adjust for 0-index
+        index = rank - 1  # Adjust for 0-index
 
-    if interpolate:
-        if rank != len(sortedPoints):  # if a next value exists
-            nextValue = sortedPoints[rank]
-            percentile = percentile + rankFraction * (nextValue - percentile)
+    if interpolate and rank != len(points):  # if a next value exists
+        percentile, nextValue = _selectRanks(points, [index, rank])
+        percentile = percentile + rankFraction * (nextValue - percentile)
+    else:
+        percentile, = _selectRanks(points, [index])
 
     return percentile
 
 
-@inlineCallbacks
+def _selectRanks(points, ranks):
+    """
+    Returns sorted(points)[rank] for each of ranks. Long lists of numbers are
+    partitioned with numpy instead of being sorted, and ties are resolved in order
+    of points as a stable sort does, so the very same objects are returned.
+    """
+    length = len(points)
+    values = None
+    if numpy is not None and length >= SELECTION_THRESHOLD and all(-length <= r < length for r in ranks):
+        values = numpy.array(points)
+        # NaN, objects and longs beyond int64 have no total order numpy could select by
+        if values.dtype.kind not in 'if' or values.dtype.kind == 'f' and numpy.isnan(values).any():
+            values = None
+    if values is None:
+        sortedPoints = sorted(points)
+        return [sortedPoints[rank] for rank in ranks]
+
+    ranks = [rank % length for rank in ranks]
+    partitioned = numpy.partition(values, ranks)
+    result = []
+    for rank in ranks:
+        value = partitioned[rank]
+        less = numpy.count_nonzero(values < value)
+        equal = numpy.flatnonzero(values == value)
+        result.append(points[equal[rank - less]])
+    return result
+
+
 def nPercentile(requestContext, seriesList, n):
     """Returns n-percent of each series in the seriesList."""
     assert n, 'The requested percent is required to be greater than 0'
 
-    yield defer.succeed(None)
     results = []
     for s in seriesList:
-        # Create a sorted copy of the TimeSeries excluding None values in the
-        # values list.
-        s_copy = TimeSeries(s.name,
-                            s.start,
-                            s.end,
-                            s.step,
-                            sorted([item for item in s if item is not None]))
-        if not s_copy:
+        points = [item for item in s if item is not None]
+        if not points:
             continue  # Skip this series because it is empty.
 
-        perc_val = _getPercentile(s_copy, n)
+        perc_val = _getPercentile(points, n)
         if perc_val is not None:
-            name = 'nPercentile(%s, %g)' % (s_copy.name, n)
+            name = 'nPercentile(%s, %g)' % (s.name, n)
             point_count = int((s.end - s.start) / s.step)
             perc_series = TimeSeries(
                 name,
-                s_copy.start,
-                s_copy.end,
-                s_copy.step,
+                s.start,
+                s.end,
+                s.step,
                 [perc_val] *
                 point_count)
             perc_series.pathExpression = name
             results.append(perc_series)
-    returnValue(results)
+    return results
 
 
-@inlineCallbacks
 def averageOutsidePercentile(requestContext, seriesList, n):
     """
     Removes functions lying inside an average percentile interval
     """
-    yield defer.succeed(None)
     averages = []
 
     for s in seriesList:
@@ -2258,16 +2511,14 @@ def averageOutsidePercentile(requestContext, seriesList, n):
     lowPercentile = _getPercentile(averages, 100 - n)
     highPercentile = _getPercentile(averages, n)
 
-    returnValue([s for s in seriesList if not lowPercentile < safeDiv(
-        safeSum(s), safeLen(s)) < highPercentile])
+    return [s for s in seriesList if not lowPercentile < safeDiv(
+        safeSum(s), safeLen(s)) < highPercentile]
 
 
-@inlineCallbacks
 def removeBetweenPercentile(requestContext, seriesList, n):
     """
     Removes lines who do not have an value lying in the x-percentile of all the values at a moment
     """
-    yield defer.succeed(None)
     if n < 50:
         n = 100 - n
 
@@ -2276,17 +2527,15 @@ def removeBetweenPercentile(requestContext, seriesList, n):
     lowPercentiles = [_getPercentile(col, 100 - n) for col in transposed]
     highPercentiles = [_getPercentile(col, n) for col in transposed]
 
-    returnValue([l for l in seriesList if sum([not lowPercentiles[
-                val_i] < val < highPercentiles[val_i] for (val_i, val) in enumerate(l)]) > 0])
+    return [l for l in seriesList if sum([not lowPercentiles[
+                val_i] < val < highPercentiles[val_i] for (val_i, val) in enumerate(l)]) > 0]
 
 
-@inlineCallbacks
 def removeAbovePercentile(requestContext, seriesList, n):
     """
     Removes data above the nth percentile from the series or list of series provided.
     Values above this percentile are assigned a value of None.
     """
-    yield defer.succeed(None)
     for s in seriesList:
         s.name = 'removeAbovePercentile(%s, %d)' % (s.name, n)
         s.pathExpression = s.name
@@ -2295,16 +2544,14 @@ def removeAbovePercentile(requestContext, seriesList, n):
             if val > percentile:
                 s[index] = None
 
-    returnValue(seriesList)
+    return seriesList
 
 
-@inlineCallbacks
 def removeAboveValue(requestContext, seriesList, n):
     """
     Removes data above the given threshold from the series or list of series provided.
     Values above this threshold are assigned a value of None.
     """
-    yield defer.succeed(None)
     for s in seriesList:
         s.name = 'removeAboveValue(%s, %d)' % (s.name, n)
         s.pathExpression = s.name
@@ -2312,16 +2559,14 @@ def removeAboveValue(requestContext, seriesList, n):
             if val > n:
                 s[index] = None
 
-    returnValue(seriesList)
+    return seriesList
 
 
-@inlineCallbacks
 def removeBelowPercentile(requestContext, seriesList, n):
     """
     Removes data below the nth percentile from the series or list of series provided.
     Values below this percentile are assigned a value of None.
     """
-    yield defer.succeed(None)
     for s in seriesList:
         s.name = 'removeBelowPercentile(%s, %d)' % (s.name, n)
         s.pathExpression = s.name
@@ -2330,16 +2575,14 @@ def removeBelowPercentile(requestContext, seriesList, n):
             if val < percentile:
                 s[index] = None
 
-    returnValue(seriesList)
+    return seriesList
 
 
-@inlineCallbacks
 def removeBelowValue(requestContext, seriesList, n):
     """
     Removes data below the given threshold from the series or list of series provided.
     Values below this threshold are assigned a value of None.
     """
-    yield defer.succeed(None)
     for s in seriesList:
         s.name = 'removeBelowValue(%s, %d)' % (s.name, n)
         s.pathExpression = s.name
@@ -2347,10 +2590,9 @@ def removeBelowValue(requestContext, seriesList, n):
             if val < n:
                 s[index] = None
 
-    returnValue(seriesList)
+    return seriesList
 
 
-@inlineCallbacks
 def limit(requestContext, seriesList, n):
     """
     Takes one metric or a wildcard seriesList followed by an integer N.
@@ -2366,27 +2608,20 @@ def limit(requestContext, seriesList, n):
     Draws only the first 5 instance's memory free.
 
     """
-    yield defer.succeed(None)
-    returnValue(seriesList[0:n])
+    return seriesList[0:n]
 
 
-@inlineCallbacks
 def sortByName(requestContext, seriesList):
     """
     Takes one metric or a wildcard seriesList.
 
     Sorts the list of metrics by the metric name.
     """
-    yield defer.succeed(None)
 
-    def compare(x, y):
-        return cmp(x.name, y.name)
-
-    seriesList.sort(compare)
-    returnValue(seriesList)
+    seriesList.sort(key=lambda s: s.name)
+    return seriesList
 
 
-@inlineCallbacks
 def sortByTotal(requestContext, seriesList):
     """
     Takes one metric or a wildcard seriesList.
@@ -2394,16 +2629,11 @@ def sortByTotal(requestContext, seriesList):
     Sorts the list of metrics by the sum of values across the time period
     specified.
     """
-    yield defer.succeed(None)
 
-    def compare(x, y):
-        return cmp(safeSum(y), safeSum(x))
-
-    seriesList.sort(compare)
-    returnValue(seriesList)
+    seriesList.sort(key=safeSum, reverse=True)
+    return seriesList
 
 
-@inlineCallbacks
 def sortByMaxima(requestContext, seriesList):
     """
     Takes one metric or a wildcard seriesList.
@@ -2419,15 +2649,11 @@ def sortByMaxima(requestContext, seriesList):
       &target=sortByMaxima(server*.instance*.memory.free)
 
     """
-    yield defer.succeed(None)
 
-    def compare(x, y):
-        return cmp(max(y), max(x))
-    seriesList.sort(compare)
-    returnValue(seriesList)
+    seriesList.sort(key=max, reverse=True)
+    return seriesList
 
 
-@inlineCallbacks
 def sortByMinima(requestContext, seriesList):
     """
     Takes one metric or a wildcard seriesList.
@@ -2442,13 +2668,10 @@ def sortByMinima(requestContext, seriesList):
       &target=sortByMinima(server*.instance*.memory.free)
 
     """
-    yield defer.succeed(None)
 
-    def compare(x, y):
-        return cmp(min(x), min(y))
     newSeries = [series for series in seriesList if max(series) > 0]
-    newSeries.sort(compare)
-    returnValue(newSeries)
+    newSeries.sort(key=min)
+    return newSeries
 
 
 @inlineCallbacks
@@ -2479,7 +2702,6 @@ def useSeriesAbove(requestContext, seriesList, value, search, replace):
     returnValue(newSeries)
 
 
-@inlineCallbacks
 def fallbackSeries(requestContext, seriesList, fallback):
     """
     Takes a wildcard seriesList, and a second fallback metric.
@@ -2494,14 +2716,12 @@ def fallbackSeries(requestContext, seriesList, fallback):
     Draws a 0 line when server metric does not exist.
 
     """
-    yield defer.succeed(None)
     if len(seriesList) > 0:
-        returnValue(seriesList)
+        return seriesList
     else:
-        returnValue(fallback)
+        return fallback
 
 
-@inlineCallbacks
 def mostDeviant(requestContext, seriesList, n):
     """
     Takes one metric or a wildcard seriesList followed by an integer N.
@@ -2519,7 +2739,6 @@ def mostDeviant(requestContext, seriesList, n):
 
     """
 
-    yield defer.succeed(None)
     deviants = []
     for series in seriesList:
         mean = safeDiv(safeSum(series), safeLen(series))
@@ -2531,12 +2750,14 @@ def mostDeviant(requestContext, seriesList, n):
         if sigma is None:
             continue
         deviants.append((sigma, series))
-    deviants.sort(key=lambda i: i[0], reverse=True)  # sort by sigma
     # return the n most deviant series
-    returnValue([series for (_, series) in deviants][:n])
+    if isinstance(n, (int, long)) and n > 0:
+        deviants = heapq.nlargest(n, deviants, key=lambda i: i[0])
+    else:
+        deviants.sort(key=lambda i: i[0], reverse=True)  # sort by sigma
+    return [series for (_, series) in deviants][:n]
 
 
-@inlineCallbacks
 def stdev(requestContext, seriesList, points, windowTolerance=0.1):
     """
     Takes one metric or a wildcard seriesList followed by an integer N.
@@ -2554,7 +2775,6 @@ def stdev(requestContext, seriesList, points, windowTolerance=0.1):
       &target=stdev(server*.instance*.cpu.system,30,0.0)
 
     """
-    yield defer.succeed(None)
 
     # For this we take the standard deviation in terms of the moving average
     # and the moving average of series squares.
@@ -2613,19 +2833,17 @@ def stdev(requestContext, seriesList, points, windowTolerance=0.1):
 
         seriesList[seriesIndex] = stddevSeries
 
-    returnValue(seriesList)
+    return seriesList
 
 
-@inlineCallbacks
 def secondYAxis(requestContext, seriesList):
     """
     Graph the series on the secondary Y axis.
     """
-    yield defer.succeed(None)
     for series in seriesList:
         series.options['secondYAxis'] = True
         series.name = 'secondYAxis(%s)' % series.name
-    returnValue(seriesList)
+    return seriesList
 
 
 @inlineCallbacks
@@ -2635,6 +2853,7 @@ def _fetchWithBootstrap(requestContext, seriesList, **delta_kwargs):
     bootstrapContext['startTime'] = requestContext['startTime'] - timedelta(**delta_kwargs)
     bootstrapContext['endTime'] = requestContext['startTime']
     bootstrapContext['bootstrap'] = True
+    bootstrapContext['history'] = True
 
     bootstrapList = []
     for series in seriesList:
@@ -2709,47 +2928,54 @@ def holtWintersDeviation(gamma, actual, prediction, last_seasonal_dev):
         (1 - gamma) * last_seasonal_dev
 
 
-def holtWintersAnalysis(series):
-    alpha = gamma = 0.1
-    beta = 0.0035
-    # season is currently one day
-    season_length = (24 * 60 * 60) / series.step
-    intercept = 0
-    slope = 0
-    intercepts = list()
-    slopes = list()
-    seasonals = list()
-    predictions = list()
-    deviations = list()
-
-    def getLastSeasonal(i):
-        j = i - season_length
-        if j >= 0:
-            return seasonals[j]
-        return 0
+class HoltWintersState(object):
 
-    def getLastDeviation(i):
-        j = i - season_length
-        if j >= 0:
-            return deviations[j]
-        return 0
+    """
+    Holt-Winters analysis state after folding count points. Only the last season
+    of seasonals and deviations is kept, time is the end of the last folded point.
+    """
 
-    last_seasonal = 0
-    last_seasonal_dev = 0
-    next_last_seasonal = 0
-    next_pred = None
+    alpha = gamma = 0.1
+    beta = 0.0035
 
-    for i, actual in enumerate(series):
+    def __init__(self, step, time=None):
+        self.step = step
+        self.time = time
+        # season is currently one day
+        self.season_length = (24 * 60 * 60) / step
+        self.count = 0
+        self.intercept = None
+        self.slope = 0
+        self.next_pred = None
+        self.seasonals = array('d', [0]) * self.season_length
+        self.deviations = array('d', [0]) * self.season_length
+
+    def copy(self):
+        state = copy.copy(self)
+        state.seasonals = self.seasonals[:]
+        state.deviations = self.deviations[:]
+        return state
+
+    def update(self, actual):
+        """
+        Fold next point, returns prediction, deviation, intercept, slope and seasonal for it
+        """
+        i = self.count
+        self.count += 1
+        if self.time is not None:
+            self.time += self.step
+        season_length = self.season_length
         if actual is None:
             # missing input values break all the math
             # do the best we can and move on
-            intercepts.append(None)
-            slopes.append(0)
-            seasonals.append(0)
-            predictions.append(next_pred)
-            deviations.append(0)
-            next_pred = None
-            continue
+            prediction = self.next_pred
+            self.intercept = None
+            self.slope = 0
+            self.next_pred = None
+            if i >= season_length:
+                self.seasonals[i % season_length] = 0
+                self.deviations[i % season_length] = 0
+            return prediction, 0, None, 0, 0
 
         if i == 0:
             last_intercept = actual
@@ -2757,31 +2983,48 @@ def holtWintersAnalysis(series):
             # seed the first prediction as the first actual
             prediction = actual
         else:
-            last_intercept = intercepts[-1]
-            last_slope = slopes[-1]
+            last_intercept = self.intercept
+            last_slope = self.slope
             if last_intercept is None:
                 last_intercept = actual
-            prediction = next_pred
+            prediction = self.next_pred
 
-        last_seasonal = getLastSeasonal(i)
-        next_last_seasonal = getLastSeasonal(i + 1)
-        last_seasonal_dev = getLastDeviation(i)
+        last_seasonal = self.seasonals[i % season_length] if i >= season_length else 0
+        next_last_seasonal = self.seasonals[(i + 1) % season_length] if i + 1 >= season_length else 0
+        last_seasonal_dev = self.deviations[i % season_length] if i >= season_length else 0
 
         intercept = holtWintersIntercept(
-            alpha,
+            self.alpha,
             actual,
             last_seasonal,
             last_intercept,
             last_slope)
-        slope = holtWintersSlope(beta, intercept, last_intercept, last_slope)
-        seasonal = holtWintersSeasonal(gamma, actual, intercept, last_seasonal)
-        next_pred = intercept + slope + next_last_seasonal
+        slope = holtWintersSlope(self.beta, intercept, last_intercept, last_slope)
+        seasonal = holtWintersSeasonal(self.gamma, actual, intercept, last_seasonal)
+        self.next_pred = intercept + slope + next_last_seasonal
         deviation = holtWintersDeviation(
-            gamma,
+            self.gamma,
             actual,
             prediction,
             last_seasonal_dev)
 
+        self.intercept = intercept
+        self.slope = slope
+        self.seasonals[i % season_length] = seasonal
+        self.deviations[i % season_length] = deviation
+        return prediction, deviation, intercept, slope, seasonal
+
+
+def holtWintersAnalysis(series):
+    state = HoltWintersState(series.step)
+    intercepts = list()
+    slopes = list()
+    seasonals = list()
+    predictions = list()
+    deviations = list()
+
+    for actual in series:
+        prediction, deviation, intercept, slope, seasonal = state.update(actual)
         intercepts.append(intercept)
         slopes.append(slope)
         seasonals.append(seasonal)
@@ -2817,19 +3060,107 @@ def holtWintersAnalysis(series):
     return results
 
 
+HOLT_WINTERS_BOOTSTRAP = 7 * 24 * 60 * 60
+# states kept per series for checks with different startTime
+HOLT_WINTERS_STATES = 4
+holtWintersStates = None
+
+
+@inlineCallbacks
+def _holtWintersBootstrap(requestContext, seriesList):
+    """
+    Returns Holt-Winters states of series folded up to the last step boundary before
+    startTime. States are kept between calls, so only points fetched since the last call
+    are folded. Up to HOLT_WINTERS_STATES states are kept per series and the latest one
+    not past startTime is folded, so checks of the same series with different startTime
+    do not replace each other's states. State of HOLT_WINTERS_BOOTSTRAP seconds is folded
+    from scratch after a gap longer than that, retention change or if there is no state yet.
+    None is returned for series whose bootstrap does not fit the series step.
+    """
+    global holtWintersStates
+    if holtWintersStates is None:
+        holtWintersStates = LRUCache(config.HOLT_WINTERS_CACHE_SIZE, HOLT_WINTERS_BOOTSTRAP)
+    startTime = int(epoch(requestContext['startTime']))
+    states = []
+    fetches = {}
+    for series in seriesList:
+        bootstrapEnd = startTime - startTime % series.step
+        kept = [s for s in holtWintersStates.get((series.name, series.step), ())
+                if bootstrapEnd - HOLT_WINTERS_BOOTSTRAP <= s.time <= bootstrapEnd]
+        if kept:
+            state = max(kept, key=lambda s: s.time)
+        else:
+            state = HoltWintersState(series.step, bootstrapEnd - HOLT_WINTERS_BOOTSTRAP)
+        states.append(state)
+        if state.time < bootstrapEnd:
+            fetches[(series.pathExpression, state.time, bootstrapEnd)] = None
+
+    for pathExpression, fromTime, toTime in fetches.keys():
+        bootstrapContext = requestContext.copy()
+        bootstrapContext['startTime'] = requestContext['startTime'] - timedelta(seconds=startTime - fromTime)
+        bootstrapContext['endTime'] = requestContext['startTime'] - timedelta(seconds=startTime - toTime)
+        bootstrapContext['bootstrap'] = True
+        bootstrapContext['history'] = True
+        bootstraps = yield evaluateTarget(bootstrapContext, pathExpression)
+        fetches[(pathExpression, fromTime, toTime)] = dict((b.name, b) for b in bootstraps)
+
+    for i, (series, state) in enumerate(zip(seriesList, states)):
+        bootstrapEnd = startTime - startTime % series.step
+        if state.time == bootstrapEnd:
+            continue
+        bootstrap = fetches[(series.pathExpression, state.time, bootstrapEnd)].get(series.name)
+        if bootstrap is None or bootstrap.step != series.step or \
+                len(bootstrap) != (bootstrapEnd - state.time) / series.step:
+            states[i] = None
+            continue
+        # state may be shared with concurrent checks
+        states[i] = state.copy()
+        for actual in bootstrap:
+            states[i].update(actual)
+        # folded state takes place of the one it is folded from and of concurrently folded ones
+        kept = [s for s in holtWintersStates.get((series.name, series.step), ())
+                if s is not state and s.time != bootstrapEnd]
+        kept.append(states[i])
+        kept.sort(key=lambda s: s.time)
+        holtWintersStates.set((series.name, series.step), kept[-HOLT_WINTERS_STATES:])
+    returnValue(states)
+
+
+@inlineCallbacks
+def _holtWintersAnalyses(requestContext, seriesList):
+    'Returns forecast and deviation series for every series'
+    results = []
+    states = yield _holtWintersBootstrap(requestContext, seriesList)
+    for series, state in zip(seriesList, states):
+        if state is None:
+            [bootstrap] = yield _fetchWithBootstrap(requestContext, [series], seconds=HOLT_WINTERS_BOOTSTRAP)
+            analysis = holtWintersAnalysis(bootstrap)
+            results.append((_trimBootstrap(analysis['predictions'], series),
+                            _trimBootstrap(analysis['deviations'], series)))
+            continue
+        state = state.copy()
+        predictions = []
+        deviations = []
+        for actual in series:
+            prediction, deviation, _, _, _ = state.update(actual)
+            predictions.append(prediction)
+            deviations.append(deviation)
+        start = series.end - len(series) * series.step
+        results.append((TimeSeries("holtWintersForecast(%s)" % series.name,
+                                   start, series.end, series.step, predictions),
+                        TimeSeries("holtWintersDeviation(%s)" % series.name,
+                                   start, series.end, series.step, deviations)))
+    returnValue(results)
+
+
 @inlineCallbacks
 def holtWintersForecast(requestContext, seriesList):
     """
     Performs a Holt-Winters forecast using the series as input data. Data from
     one week previous to the series is used to bootstrap the initial forecast.
     """
-    yield defer.succeed(None)
-    results = []
-    bootstrapList = yield _fetchWithBootstrap(requestContext, seriesList, days=7)
-    for bootstrap, series in zip(bootstrapList, seriesList):
-        analysis = holtWintersAnalysis(bootstrap)
-        results.append(_trimBootstrap(analysis['predictions'], series))
-    returnValue(results)
+    analyses = yield _holtWintersAnalyses(requestContext, seriesList)
+    returnValue([forecast for forecast, _ in analyses])
 
 
 @inlineCallbacks
@@ -2838,13 +3169,9 @@ def holtWintersConfidenceBands(requestContext, seriesList, delta=3):
     Performs a Holt-Winters forecast using the series as input data and plots
     upper and lower bands with the predicted forecast deviations.
     """
-    yield defer.succeed(None)
     results = []
-    bootstrapList = yield _fetchWithBootstrap(requestContext, seriesList, days=7)
-    for bootstrap, series in zip(bootstrapList, seriesList):
-        analysis = holtWintersAnalysis(bootstrap)
-        forecast = _trimBootstrap(analysis['predictions'], series)
-        deviation = _trimBootstrap(analysis['deviations'], series)
+    analyses = yield _holtWintersAnalyses(requestContext, seriesList)
+    for series, (forecast, deviation) in zip(seriesList, analyses):
         seriesLength = len(forecast)
         i = 0
         upperBand = list()
@@ -2888,15 +3215,9 @@ def holtWintersAberration(requestContext, seriesList, delta=3):
     Performs a Holt-Winters forecast using the series as input data and plots the
     positive or negative deviation of the series data from the forecast.
     """
-    yield defer.succeed(None)
     results = []
-    for series in seriesList:
-        confidenceBands = holtWintersConfidenceBands(
-            requestContext,
-            [series],
-            delta)
-        lowerBand = confidenceBands[0]
-        upperBand = confidenceBands[1]
+    confidenceBands = yield holtWintersConfidenceBands(requestContext, seriesList, delta)
+    for series, lowerBand, upperBand in zip(seriesList, confidenceBands[::2], confidenceBands[1::2]):
         aberration = list()
         for i, actual in enumerate(series):
             if series[i] is None:
@@ -2925,9 +3246,8 @@ def holtWintersConfidenceArea(requestContext, seriesList, delta=3):
     Performs a Holt-Winters forecast using the series as input data and plots the
     area between the upper and lower bands of the predicted forecast deviations.
     """
-    yield defer.succeed(None)
-    bands = holtWintersConfidenceBands(requestContext, seriesList, delta)
-    results = areaBetween(requestContext, bands)
+    bands = yield holtWintersConfidenceBands(requestContext, seriesList, delta)
+    results = yield areaBetween(requestContext, bands)
     for series in results:
         series.name = series.name.replace(
             'areaBetween',
@@ -2935,7 +3255,6 @@ def holtWintersConfidenceArea(requestContext, seriesList, delta=3):
     returnValue(results)
 
 
-@inlineCallbacks
 def drawAsInfinite(requestContext, seriesList):
     """
     Takes one metric or a wildcard seriesList.
@@ -2953,14 +3272,12 @@ def drawAsInfinite(requestContext, seriesList):
       drawAsInfinite(Testing.script.exitCode)
 
     """
-    yield defer.succeed(None)
     for series in seriesList:
         series.options['drawAsInfinite'] = True
         series.name = 'drawAsInfinite(%s)' % series.name
-    returnValue(seriesList)
+    return seriesList
 
 
-@inlineCallbacks
 def lineWidth(requestContext, seriesList, width):
     """
     Takes one metric or a wildcard seriesList, followed by a float F.
@@ -2978,13 +3295,11 @@ def lineWidth(requestContext, seriesList, width):
       &target=lineWidth(server01.instance01.memory.free,5)
 
     """
-    yield defer.succeed(None)
     for series in seriesList:
         series.options['lineWidth'] = width
-    returnValue(seriesList)
+    return seriesList
 
 
-@inlineCallbacks
 def dashed(requestContext, *seriesList):
     """
     Takes one metric or a wildcard seriesList, followed by a float F.
@@ -3000,7 +3315,6 @@ def dashed(requestContext, *seriesList):
 
     """
 
-    yield defer.succeed(None)
     if len(seriesList) == 2:
         dashLength = seriesList[1]
     else:
@@ -3008,7 +3322,7 @@ def dashed(requestContext, *seriesList):
     for series in seriesList[0]:
         series.name = 'dashed(%s, %d)' % (series.name, dashLength)
         series.options['dashed'] = dashLength
-    returnValue(seriesList[0])
+    return seriesList[0]
 
 
 @inlineCallbacks
@@ -3054,6 +3368,7 @@ def timeStack(
         innerDelta = delta * shft
         myContext['startTime'] = requestContext['startTime'] + innerDelta
         myContext['endTime'] = requestContext['endTime'] + innerDelta
+        myContext['history'] = shft != 0
         for shiftedSeries in (yield evaluateTarget(myContext, series.pathExpression)):
             shiftedSeries.name = 'timeShift(%s, %s, %s)' % (
                 shiftedSeries.name, timeShiftUnit, shft)
@@ -3101,6 +3416,7 @@ def timeShift(requestContext, seriesList, timeShift, resetEnd=True):
     myContext = requestContext.copy()
     myContext['startTime'] = requestContext['startTime'] + delta
     myContext['endTime'] = requestContext['endTime'] + delta
+    myContext['history'] = True
     results = []
     if len(seriesList) > 0:
         # if len(seriesList) > 1, they will all have the same pathExpression,
@@ -3121,7 +3437,6 @@ def timeShift(requestContext, seriesList, timeShift, resetEnd=True):
     returnValue(results)
 
 
-@inlineCallbacks
 def timeSlice(requestContext, seriesList, startSliceAt, endSliceAt="now"):
     """
     Takes one metric or a wildcard metric, followed by a quoted string with the
@@ -3141,7 +3456,6 @@ def timeSlice(requestContext, seriesList, startSliceAt, endSliceAt="now"):
 
     """
 
-    yield defer.succeed(None)
     results = []
     start = time.mktime(parseATTime(startSliceAt).timetuple())
     end = time.mktime(parseATTime(endSliceAt).timetuple())
@@ -3158,10 +3472,9 @@ def timeSlice(requestContext, seriesList, startSliceAt, endSliceAt="now"):
 
         results.append(slicedSeries)
 
-    returnValue(results)
+    return results
 
 
-@inlineCallbacks
 def constantLine(requestContext, value):
     """
     Takes a float F.
@@ -3175,17 +3488,15 @@ def constantLine(requestContext, value):
       &target=constantLine(123.456)
 
     """
-    yield defer.succeed(None)
     name = "constantLine(%s)" % str(value)
     start = int(epoch(requestContext['startTime']))
     end = int(epoch(requestContext['endTime']))
     step = (end - start) / 1.0
     series = TimeSeries(str(value), start, end, step, [value, value])
     series.pathExpression = name
-    returnValue([series])
+    return [series]
 
 
-@inlineCallbacks
 def aggregateLine(requestContext, seriesList, func='avg'):
     """
     Draws a horizontal line based the function applied to the series.
@@ -3207,7 +3518,6 @@ def aggregateLine(requestContext, seriesList, func='avg'):
       &target=aggregateLine(server.connections.total, 'avg')
 
     """
-    yield defer.succeed(None)
     t_funcs = {'avg': safeAvg, 'min': safeMin, 'max': safeMax}
 
     if func not in t_funcs:
@@ -3219,10 +3529,9 @@ def aggregateLine(requestContext, seriesList, func='avg'):
     series = constantLine(requestContext, value)[0]
     series.name = name
 
-    returnValue([series])
+    return [series]
 
 
-@inlineCallbacks
 def threshold(requestContext, value, label=None, color=None):
     """
     Takes a float F, followed by a label (in double quotes) and a color.
@@ -3238,17 +3547,15 @@ def threshold(requestContext, value, label=None, color=None):
 
     """
 
-    yield defer.succeed(None)
     series = constantLine(requestContext, value)[0]
     if label:
         series.name = label
     if color:
         series.color = color
 
-    returnValue([series])
+    return [series]
 
 
-@inlineCallbacks
 def transformNull(requestContext, seriesList, default=0):
     """
     Takes a metric or wild card seriesList and an optional value
@@ -3264,24 +3571,9 @@ def transformNull(requestContext, seriesList, default=0):
     This would take any page that didn't have values and supply negative 1 as a default.
     Any other numeric value may be used as well.
     """
-    yield defer.succeed(None)
-
-    def transform(v):
-        if v is None:
-            return default
-        else:
-            return v
-
-    for series in seriesList:
-        series.name = "transformNull(%s,%g)" % (series.name, default)
-        series.pathExpression = series.name
-        values = [transform(v) for v in series]
-        series.extend(values)
-        del series[:len(values)]
-    returnValue(seriesList)
+    return applyPointwise(seriesList, [transformNullPoints(default)])
 
 
-@inlineCallbacks
 def isNonNull(requestContext, seriesList):
     """
     Takes a metric or wild card seriesList and counts up how many
@@ -3299,7 +3591,6 @@ def isNonNull(requestContext, seriesList):
     0 is specified for null values.
     """
 
-    yield defer.succeed(None)
 
     def transform(v):
         if v is None:
@@ -3313,10 +3604,9 @@ def isNonNull(requestContext, seriesList):
         values = [transform(v) for v in series]
         series.extend(values)
         del series[:len(values)]
-    returnValue(seriesList)
+    return seriesList
 
 
-@inlineCallbacks
 def identity(requestContext, name):
     """
     Identity function:
@@ -3333,7 +3623,6 @@ def identity(requestContext, name):
     This would create a series named "The.time.series" that contains points where
     x(t) == t.
     """
-    yield defer.succeed(None)
     step = 60
     start = int(epoch(requestContext["startTime"]))
     end = int(epoch(requestContext["endTime"]))
@@ -3341,10 +3630,9 @@ def identity(requestContext, name):
     series = TimeSeries(name, start, end, step, values)
     series.pathExpression = 'identity("%s")' % name
 
-    returnValue([series])
+    return [series]
 
 
-@inlineCallbacks
 def countSeries(requestContext, *seriesLists):
     """
     Draws a horizontal line representing the number of nodes found in the seriesList.
@@ -3354,13 +3642,12 @@ def countSeries(requestContext, *seriesLists):
       &target=countSeries(carbon.agents.*.*)
 
     """
-    yield defer.succeed(None)
     (seriesList, start, end, step) = normalize(seriesLists)
     name = "countSeries(%s)" % formatPathExpressions(seriesList)
     values = (int(len(row)) for row in izip(*seriesList))
     series = TimeSeries(name, start, end, step, values)
     series.pathExpression = name
-    returnValue([series])
+    return [series]
 
 
 def group(requestContext, *seriesLists):
@@ -3375,7 +3662,6 @@ def group(requestContext, *seriesLists):
     return seriesGroup
 
 
-@inlineCallbacks
 def mapSeries(requestContext, seriesList, mapNode):
     """
     Short form: ``map()``
@@ -3396,17 +3682,7 @@ def mapSeries(requestContext, seriesList, mapNode):
           servers.serverN.cpu.*
         ]
     """
-    yield defer.succeed(None)
-    metaSeries = {}
-    keys = []
-    for series in seriesList:
-        key = series.name.split(".")[mapNode]
-        if key not in metaSeries:
-            metaSeries[key] = [series]
-            keys.append(key)
-        else:
-            metaSeries[key].append(series)
-    returnValue([metaSeries[k] for k in keys])
+    return [group for _, group in groupSeriesByNodes(seriesList, [mapNode])]
 
 
 @inlineCallbacks
@@ -3471,7 +3747,7 @@ def reduceSeries(
     keys = []
     for seriesList in seriesLists:
         for series in seriesList:
-            nodes = series.name.split('.')
+            nodes = series.nodes
             node = nodes[reduceNode]
             reduceSeriesName = '.'.join(
                 nodes[
@@ -3506,15 +3782,9 @@ def groupByNode(requestContext, seriesList, nodeNum, callback):
 
     """
     yield defer.succeed(None)
-    metaSeries = {}
-    keys = []
-    for series in seriesList:
-        key = series.name.split(".")[nodeNum]
-        if key not in metaSeries:
-            metaSeries[key] = [series]
-            keys.append(key)
-        else:
-            metaSeries[key].append(series)
+    groups = groupSeriesByNodes(seriesList, [nodeNum])
+    metaSeries = dict(groups)
+    keys = [key for key, _ in groups]
     for key in metaSeries.keys():
         metaSeries[key] = (yield SeriesFunctions[callback](requestContext,
                                                            metaSeries[key]))[0]
@@ -3522,7 +3792,6 @@ def groupByNode(requestContext, seriesList, nodeNum, callback):
     returnValue([metaSeries[key] for key in keys])
 
 
-@inlineCallbacks
 def exclude(requestContext, seriesList, pattern):
     """
     Takes a metric or a wildcard seriesList, followed by a regular expression
@@ -3534,12 +3803,10 @@ def exclude(requestContext, seriesList, pattern):
 
       &target=exclude(servers*.instance*.threads.busy,"server02")
     """
-    yield defer.succeed(None)
     regex = re.compile(pattern)
-    returnValue([s for s in seriesList if not regex.search(s.name)])
+    return [s for s in seriesList if not regex.search(s.name)]
 
 
-@inlineCallbacks
 def grep(requestContext, seriesList, pattern):
     """
     Takes a metric or a wildcard seriesList, followed by a regular expression
@@ -3551,9 +3818,41 @@ def grep(requestContext, seriesList, pattern):
 
       &target=grep(servers*.instance*.threads.busy,"server02")
     """
-    yield defer.succeed(None)
     regex = re.compile(pattern)
-    returnValue([s for s in seriesList if regex.search(s.name)])
+    return [s for s in seriesList if regex.search(s.name)]
+
+
+def _alignStartTime(startTime, interval):
+    """
+    Start time truncated to a day, an hour or a minute for intervals of at least that long.
+    Time zone is kept, fetches take timezone-aware datetimes only.
+    """
+    if interval >= DAY:
+        return startTime.replace(hour=0, minute=0, second=0, microsecond=0)
+    elif interval >= HOUR:
+        return startTime.replace(minute=0, second=0, microsecond=0)
+    elif interval >= MINUTE:
+        return startTime.replace(second=0, microsecond=0)
+    return startTime
+
+
+@inlineCallbacks
+def _fetchAligned(requestContext, seriesList, interval):
+    """
+    Series of seriesList fetched again from the start time aligned to interval.
+    Each distinct pathExpression is evaluated once and its series are matched by name,
+    series without a match are kept as is.
+    """
+    alignedContext = requestContext.copy()
+    alignedContext['startTime'] = _alignStartTime(requestContext['startTime'], interval)
+    alignedContext['history'] = True
+    fetches = {}
+    if alignedContext['startTime'] != requestContext['startTime']:
+        for series in seriesList:
+            if series.pathExpression not in fetches:
+                fetched = yield evaluateTarget(alignedContext, series.pathExpression)
+                fetches[series.pathExpression] = dict((s.name, s) for s in fetched)
+    returnValue([fetches.get(s.pathExpression, {}).get(s.name, s) for s in seriesList])
 
 
 @inlineCallbacks
@@ -3570,88 +3869,39 @@ def smartSummarize(
     Alignment happens automatically for days, hours, and minutes.
     """
 
-    yield defer.succeed(None)
     results = []
     delta = parseTimeOffset(intervalString)
     interval = delta.seconds + (delta.days * 86400)
-
-    # Adjust the start time to fit an entire day for intervals >= 1 day
-    requestContext = requestContext.copy()
-    s = requestContext['startTime']
-    if interval >= DAY:
-        requestContext['startTime'] = datetime(s.year, s.month, s.day)
-    elif interval >= HOUR:
-        requestContext['startTime'] = datetime(s.year, s.month, s.day, s.hour)
-    elif interval >= MINUTE:
-        requestContext['startTime'] = datetime(
-            s.year,
-            s.month,
-            s.day,
-            s.hour,
-            s.minute)
-
-    for i, series in enumerate(seriesList):
-        # XXX: breaks with summarize(metric.{a,b})
-        #      each series.pathExpression == metric.{a,b}
-        newSeries = yield evaluateTarget(requestContext, series.pathExpression)[0]
-        series[0:len(series)] = newSeries
-        series.start = newSeries.start
-        series.end = newSeries.end
-        series.step = newSeries.step
+    seriesList = yield _fetchAligned(requestContext, seriesList, interval)
 
     for series in seriesList:
-        buckets = {}  # { timestamp: [values] }
-
-        timestamps = range(int(series.start),
-                           int(series.end),
-                           int(series.step))
-        datapoints = zip(timestamps, series)
-
-        # Populate buckets
-        for timestamp_, value in datapoints:
-            bucketInterval = int((timestamp_ - series.start) / interval)
-
-            if bucketInterval not in buckets:
-                buckets[bucketInterval] = []
-
-            if value is not None:
-                buckets[bucketInterval].append(value)
-
-        newValues = []
-        for timestamp_ in range(series.start, series.end, interval):
-            bucketInterval = int((timestamp_ - series.start) / interval)
-            bucket = buckets.get(bucketInterval, [])
-
-            if bucket:
-                if func == 'avg':
-                    newValues.append(float(sum(bucket)) / float(len(bucket)))
-                elif func == 'last':
-                    newValues.append(bucket[len(bucket) - 1])
-                elif func == 'max':
-                    newValues.append(max(bucket))
-                elif func == 'min':
-                    newValues.append(min(bucket))
-                else:
-                    newValues.append(sum(bucket))
-            else:
-                newValues.append(None)
-
+        bucketCount = len(xrange(series.start, series.end, interval))
         newName = "smartSummarize(%s, \"%s\", \"%s\")" % (
             series.name, intervalString, func)
-        alignedEnd = series.start + (bucketInterval * interval) + interval
-        newSeries = TimeSeries(
-            newName,
-            series.start,
-            alignedEnd,
-            interval,
-            newValues)
+        alignedEnd = series.start + bucketCount * interval
+        if arraySeriesEnabled():
+            timestamps = numpy.arange(int(series.start), int(series.end), int(series.step))
+            newSeries = ArrayTimeSeries(
+                newName,
+                series.start,
+                alignedEnd,
+                interval,
+                arrayBucketValues(toArray(series), (timestamps - series.start) // interval, bucketCount, func))
+        else:
+            timestamps = xrange(int(series.start), int(series.end), int(series.step))
+            buckets = [(timestamp_ - series.start) // interval for timestamp_ in timestamps]
+            newSeries = TimeSeries(
+                newName,
+                series.start,
+                alignedEnd,
+                interval,
+                bucketValues(series, buckets, bucketCount, func))
         newSeries.pathExpression = newName
         results.append(newSeries)
 
     returnValue(results)
 
 
-@inlineCallbacks
 def summarize(
         requestContext,
         seriesList,
@@ -3688,72 +3938,47 @@ def summarize(
       &target=summarize(queue.size, "1hour", "max") # maximum queue size during each hour
       &target=summarize(metric, "13week", "avg", true)&from=midnight+20100101 # 2010 Q1-4
     """
-    yield defer.succeed(None)
     results = []
     delta = parseTimeOffset(intervalString)
     interval = delta.seconds + (delta.days * 86400)
 
     for series in seriesList:
-        buckets = {}
-
-        timestamps = range(int(series.start),
-                           int(series.end) + int(series.step),
-                           int(series.step))
-        datapoints = zip(timestamps, series)
-
-        for timestamp_, value in datapoints:
-            if alignToFrom:
-                bucketInterval = int((timestamp_ - series.start) / interval)
-            else:
-                bucketInterval = timestamp_ - (timestamp_ % interval)
-
-            if bucketInterval not in buckets:
-                buckets[bucketInterval] = []
-
-            if value is not None:
-                buckets[bucketInterval].append(value)
-
         if alignToFrom:
             newStart = series.start
             newEnd = series.end
         else:
             newStart = series.start - (series.start % interval)
             newEnd = series.end - (series.end % interval) + interval
-
-        newValues = []
-        for timestamp_ in range(newStart, newEnd, interval):
-            if alignToFrom:
-                newEnd = timestamp_
-                bucketInterval = int((timestamp_ - series.start) / interval)
-            else:
-                bucketInterval = timestamp_ - (timestamp_ % interval)
-
-            bucket = buckets.get(bucketInterval, [])
-
-            if bucket:
-                if func == 'avg':
-                    newValues.append(float(sum(bucket)) / float(len(bucket)))
-                elif func == 'last':
-                    newValues.append(bucket[len(bucket) - 1])
-                elif func == 'max':
-                    newValues.append(max(bucket))
-                elif func == 'min':
-                    newValues.append(min(bucket))
-                else:
-                    newValues.append(sum(bucket))
-            else:
-                newValues.append(None)
+        bucketCount = len(xrange(newStart, newEnd, interval))
 
         if alignToFrom:
-            newEnd += interval
+            # end of the last bucket, or end of series plus interval if there are no buckets
+            newEnd = newStart + bucketCount * interval if bucketCount else series.end + interval
 
         newName = "summarize(%s, \"%s\", \"%s\"%s)" % (
             series.name, intervalString, func, alignToFrom and ", true" or "")
-        newSeries = TimeSeries(newName, newStart, newEnd, interval, newValues)
+        # buckets are interval seconds long from newStart
+        if arraySeriesEnabled():
+            timestamps = numpy.arange(int(series.start), int(series.end) + int(series.step), int(series.step))
+            newSeries = ArrayTimeSeries(
+                newName,
+                newStart,
+                newEnd,
+                interval,
+                arrayBucketValues(toArray(series), (timestamps - newStart) // interval, bucketCount, func))
+        else:
+            timestamps = xrange(int(series.start), int(series.end) + int(series.step), int(series.step))
+            buckets = [(timestamp_ - newStart) // interval for timestamp_ in timestamps]
+            newSeries = TimeSeries(
+                newName,
+                newStart,
+                newEnd,
+                interval,
+                bucketValues(series, buckets, bucketCount, func))
         newSeries.pathExpression = newName
         results.append(newSeries)
 
-    returnValue(results)
+    return results
 
 
 @inlineCallbacks
@@ -3773,38 +3998,17 @@ def hitcount(
     or coarse-grained records) and handles rarely-occurring events
     gracefully.
     """
-    yield defer.succeed(None)
     results = []
     delta = parseTimeOffset(intervalString)
     interval = int(delta.seconds + (delta.days * 86400))
 
     if alignToInterval:
-        requestContext = requestContext.copy()
-        s = requestContext['startTime']
-        if interval >= DAY:
-            requestContext['startTime'] = datetime(s.year, s.month, s.day)
-        elif interval >= HOUR:
-            requestContext['startTime'] = datetime(
-                s.year,
-                s.month,
-                s.day,
-                s.hour)
-        elif interval >= MINUTE:
-            requestContext['startTime'] = datetime(
-                s.year,
-                s.month,
-                s.day,
-                s.hour,
-                s.minute)
-
-        for i, series in enumerate(seriesList):
-            newSeries = yield evaluateTarget(requestContext, series.pathExpression)[0]
+        alignedList = yield _fetchAligned(requestContext, seriesList, interval)
+        for i, (series, newSeries) in enumerate(zip(seriesList, alignedList)):
             intervalCount = int((series.end - series.start) / interval)
-            series[0:len(series)] = newSeries
-            series.start = newSeries.start
-            series.end = newSeries.start + \
+            newSeries.end = newSeries.start + \
                 (intervalCount * interval) + interval
-            series.step = newSeries.step
+            seriesList[i] = newSeries
 
     for series in seriesList:
         step = int(series.step)
@@ -3814,8 +4018,10 @@ def hitcount(
                     series.end -
                     series.start) /
                 interval))
-        buckets = [[] for _ in range(bucket_count)]
         newStart = int(series.end - bucket_count * interval)
+        # hits in order of points, each goes to its bucket
+        hits = []
+        buckets = []
 
         for i, value in enumerate(series):
             if value is None:
@@ -3833,41 +4039,44 @@ def hitcount(
             if start_bucket == end_bucket:
                 # All of the hits go to a single bucket.
                 if start_bucket >= 0:
-                    buckets[start_bucket].append(value * (end_mod - start_mod))
+                    hits.append(value * (end_mod - start_mod))
+                    buckets.append(start_bucket)
 
             else:
                 # Spread the hits among 2 or more buckets.
                 if start_bucket >= 0:
-                    buckets[start_bucket].append(
-                        value * (interval - start_mod))
+                    hits.append(value * (interval - start_mod))
+                    buckets.append(start_bucket)
                 hits_per_bucket = value * interval
                 for j in range(start_bucket + 1, end_bucket):
-                    buckets[j].append(hits_per_bucket)
+                    hits.append(hits_per_bucket)
+                    buckets.append(j)
                 if end_mod > 0:
-                    buckets[end_bucket].append(value * end_mod)
-
-        newValues = []
-        for bucket in buckets:
-            if bucket:
-                newValues.append(sum(bucket))
-            else:
-                newValues.append(None)
+                    hits.append(value * end_mod)
+                    buckets.append(end_bucket)
 
         newName = 'hitcount(%s, "%s"%s)' % (
             series.name, intervalString, alignToInterval and ", true" or "")
-        newSeries = TimeSeries(
-            newName,
-            newStart,
-            series.end,
-            interval,
-            newValues)
+        if arraySeriesEnabled():
+            newSeries = ArrayTimeSeries(
+                newName,
+                newStart,
+                series.end,
+                interval,
+                arrayBucketValues(toArray(hits), buckets, bucket_count, 'sum'))
+        else:
+            newSeries = TimeSeries(
+                newName,
+                newStart,
+                series.end,
+                interval,
+                bucketValues(hits, buckets, bucket_count, 'sum'))
         newSeries.pathExpression = newName
         results.append(newSeries)
 
     returnValue(results)
 
 
-@inlineCallbacks
 def timeFunction(requestContext, name, step=60):
     """
     Short Alias: time()
@@ -3885,7 +4094,6 @@ def timeFunction(requestContext, name, step=60):
     Accepts optional second argument as 'step' parameter (default step is 60 sec)
 
     """
-    yield defer.succeed(None)
     delta = timedelta(seconds=step)
     when = requestContext["startTime"]
     values = []
@@ -3902,10 +4110,9 @@ def timeFunction(requestContext, name, step=60):
                 requestContext["endTime"].timetuple())), step, values)
     series.pathExpression = name
 
-    returnValue([series])
+    return [series]
 
 
-@inlineCallbacks
 def sinFunction(requestContext, name, amplitude=1, step=60):
     """
     Short Alias: sin()
@@ -3923,7 +4130,6 @@ def sinFunction(requestContext, name, amplitude=1, step=60):
     Accepts optional second argument as 'amplitude' parameter (default amplitude is 1)
     Accepts optional third argument as 'step' parameter (default step is 60 sec)
     """
-    yield defer.succeed(None)
     delta = timedelta(seconds=step)
     when = requestContext["startTime"]
     values = []
@@ -3932,13 +4138,12 @@ def sinFunction(requestContext, name, amplitude=1, step=60):
         values.append(math.sin(time.mktime(when.timetuple())) * amplitude)
         when += delta
 
-    returnValue([TimeSeries(name,
+    return [TimeSeries(name,
                             int(epoch(requestContext["startTime"])),
                             int(epoch(requestContext["endTime"])),
-                            step, values)])
+                            step, values)]
 
 
-@inlineCallbacks
 def removeEmptySeries(requestContext, seriesList):
     """
     Takes one metric or a wildcard seriesList.
@@ -3953,11 +4158,9 @@ def removeEmptySeries(requestContext, seriesList):
     Draws only live servers with not empty data.
 
     """
-    yield defer.succeed(None)
-    returnValue([series for series in seriesList if safeIsNotEmpty(series)])
+    return [series for series in seriesList if safeIsNotEmpty(series)]
 
 
-@inlineCallbacks
 def randomWalkFunction(requestContext, name, step=60):
     """
     Short Alias: randomWalk()
@@ -3975,7 +4178,6 @@ def randomWalkFunction(requestContext, name, step=60):
     x(t) == x(t-1)+random()-0.5, and x(0) == 0.
     Accepts optional second argument as 'step' parameter (default step is 60 sec)
     """
-    yield defer.succeed(None)
     delta = timedelta(seconds=step)
     when = requestContext["startTime"]
     values = []
@@ -3985,10 +4187,10 @@ def randomWalkFunction(requestContext, name, step=60):
         current += random.random() - 0.5
         when += delta
 
-    returnValue([TimeSeries(name,
+    return [TimeSeries(name,
                             int(epoch(requestContext["startTime"])),
                             int(epoch(requestContext["endTime"])),
-                            step, values)])
+                            step, values)]
 
 
 def pieAverage(requestContext, series):
@@ -4141,5 +4343,39 @@ SeriesFunctions = {
 }
 
 
+# Functions which never modify values of their argument series in place,
+# so read-only ArrayTimeSeries may be passed to them without copying
+ArraySeriesFunctions = set([
+    sumSeries, averageSeries, diffSeries, stddevSeries, minSeries, maxSeries,
+    rangeOfSeries, multiplySeries, countSeries, percentileOfSeries, asPercent, divideSeries,
+    scale, offset, derivative, perSecond, nonNegativeDerivative, integral, logarithm,
+    movingAverage, movingMedian, movingMax, movingMin, stdev, timeShift, timeStack,
+    alias, aliasSub, aliasByNode, aliasByMetric, legendValue, consolidateBy, cumulative,
+    exclude, grep, limit, group, fallbackSeries, removeEmptySeries, mostDeviant, nPercentile,
+    highestCurrent, lowestCurrent, highestMax, highestAverage, lowestAverage,
+    currentAbove, currentBelow, averageAbove, averageBelow,
+    maximumAbove, minimumAbove, maximumBelow, minimumBelow,
+    sortByName, sortByTotal, sortByMaxima, sortByMinima,
+])
+
+
+# Steps of functions transforming every value independently, chains of them
+# are fused by evaluator into one pass over values of each series
+PointwiseFunctions = {
+    scale: scalePoints, scaleToSeconds: scaleToSecondsPoints, pow: powPoints, squareRoot: squareRootPoints,
+    invert: invertPoints, absolute: absolutePoints, offset: offsetPoints, logarithm: logarithmPoints,
+    transformNull: transformNullPoints,
+}
+
+
+# Functions which fetch data or evaluate targets themselves and return Deferred,
+# the rest return series lists and are called synchronously once data is prefetched
+AsyncSeriesFunctions = set([
+    movingMedian, movingAverage, movingMax, movingMin, useSeriesAbove,
+    holtWintersForecast, holtWintersConfidenceBands, holtWintersAberration, holtWintersConfidenceArea,
+    timeStack, timeShift, reduceSeries, groupByNode, smartSummarize, hitcount,
+])
+
+
 # Avoid import circularity
 from moira.graphite.evaluator import evaluateTarget
@@ -0,0 +1,300 @@
+"""
+Recursive descent parser of graphite targets.
+
+It accepts the same language and produces the same tokens as the pyparsing grammar
+in moira.graphite.grammar, which is kept as the reference implementation, but needs
+neither pyparsing import nor packrat parsing. Like grammar.parseString, parseTarget
+matches the longest expression at the start of target and ignores the rest of it.
+"""
+import re
+import string
+
+
+class ParseError(ValueError):
+    pass
+
+
+class Tokens(list):
+
+    """
+    Parse results: a list of tokens with named tokens available as attributes.
+    Missing names are empty strings, as in pyparsing ParseResults.
+    """
+
+    def __init__(self, items, **names):
+        list.__init__(self, items)
+        self.__dict__.update(names)
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return ''
+
+
+SYMBOLS = '''(){},=.'"\\'''
+WHITESPACE = ' \t\n\r'
+IDENT_CHARS = frozenset(string.ascii_letters + string.digits + '_$')
+
+_metricChar = '[%s]' % re.escape(''.join(
+    c for c in string.printable if c not in string.whitespace and c not in SYMBOLS))
+_escapedChar = r'\\[%s]' % re.escape(SYMBOLS)
+_partialPathElem = '(?:%s|%s)+' % (_escapedChar, _metricChar)
+_matchEnum = r'\{%s(?:,%s)*\}' % (_partialPathElem, _partialPathElem)
+# one character or enum per repetition, so failed enums never backtrack exponentially
+_pathElement = '(?:%s|%s|%s)+' % (_escapedChar, _metricChar, _matchEnum)
+
+PATH_EXPRESSION = re.compile(r'%s(?:\.%s)*' % (_pathElement, _pathElement))
+ESCAPED_CHAR = re.compile(r'\\(.)')
+NAME = re.compile('[A-Za-z_][A-Za-z0-9_]*')
+INTEGER = re.compile('-?[0-9]+')
+FLOAT = re.compile(r'-?[0-9]+\.[0-9]+')
+SCIENTIFIC = re.compile(r'(-?[0-9]+(?:\.[0-9]+)?)[eE](-?[0-9]+)')
+# string bodies are matched before closing quotes, as pyparsing quotedString does
+QUOTED_STRING = {
+    '"': re.compile(r'"(?:[^"\n\r\\]|(?:"")|(?:\\(?:[^x]|x[0-9a-fA-F]+)))*'),
+    "'": re.compile(r"'(?:[^'\n\r\\]|(?:'')|(?:\\(?:[^x]|x[0-9a-fA-F]+)))*"),
+}
+
+
+class Parser(object):
+
+    """
+    Parser of a single target. Every method takes a position in target and returns
+    a pair of tokens and position after them or None if nothing is matched.
+    """
+
+    def __init__(self, target):
+        self.target = target
+        self.length = len(target)
+        self.expressions = {}
+        self.calls = {}
+
+    def skip(self, pos):
+        while pos < self.length and self.target[pos] in WHITESPACE:
+            pos += 1
+        return pos
+
+    def literal(self, char, pos):
+        pos = self.skip(pos)
+        if pos < self.length and self.target[pos] == char:
+            return pos + 1
+
+    def regex(self, pattern, pos):
+        return pattern.match(self.target, self.skip(pos))
+
+    def name(self, pos):
+        match = self.regex(NAME, pos)
+        if match is not None:
+            return match.group(), match.end()
+
+    def expression(self, pos):
+        # template and call alternatives may parse the same text again, so results are memoized
+        if pos not in self.expressions:
+            self.expressions[pos] = self._expression(pos)
+        return self.expressions[pos]
+
+    def _expression(self, pos):
+        result = self.template(pos)
+        if result is not None:
+            template, pos = result
+            return Tokens([template], template=template), pos
+        result = self.call(pos)
+        if result is not None:
+            call, pos = result
+            return Tokens([call], call=call), pos
+        result = self.pathExpression(pos)
+        if result is not None:
+            path, pos = result
+            return Tokens([path], pathExpression=path), pos
+
+    def pathExpression(self, pos):
+        match = self.regex(PATH_EXPRESSION, pos)
+        if match is not None:
+            path = match.group()
+            if '\\' in path:
+                path = ESCAPED_CHAR.sub(r'\1', path)
+            return path, match.end()
+
+    def call(self, pos):
+        if pos not in self.calls:
+            self.calls[pos] = self._call(pos)
+        return self.calls[pos]
+
+    def _call(self, pos):
+        result = self.name(pos)
+        if result is None:
+            return
+        funcname, pos = result
+        pos = self.literal('(', pos)
+        if pos is None:
+            return
+        args, kwargs, pos = self.arguments(pos, self.arg)
+        pos = self.literal(')', pos)
+        if pos is not None:
+            return Tokens([funcname] + args + kwargs, funcname=funcname, args=args, kwargs=kwargs), pos
+
+    def template(self, pos):
+        pos = self.skip(pos)
+        if not self.target.startswith('template', pos):
+            return
+        pos = self.literal('(', pos + len('template'))
+        if pos is None:
+            return
+        result = self.call(pos)
+        if result is not None:
+            body, pos = result
+            names = {'call': body}
+        else:
+            result = self.pathExpression(pos)
+            if result is None:
+                return
+            body, pos = result
+            names = {'pathExpression': body}
+        args, kwargs = [], []
+        after = self.literal(',', pos)
+        if after is not None:
+            result = self.positional(after, self.literalArg)
+            if result is not None:
+                args, pos = result
+            else:
+                result = self.keywords(after, self.literalArg)
+                if result is not None:
+                    kwargs, pos = result
+        pos = self.literal(')', pos)
+        if pos is not None:
+            names.update(args=args, kwargs=kwargs)
+            return Tokens(['template', body] + args + kwargs, **names), pos
+
+    def arguments(self, pos, parseArg):
+        """Optional positional arguments optionally followed by keyword arguments"""
+        result = self.positional(pos, parseArg)
+        if result is None:
+            return [], [], pos
+        args, pos = result
+        after = self.literal(',', pos)
+        if after is not None:
+            result = self.keywords(after, parseArg)
+            if result is not None:
+                kwargs, pos = result
+                return args, kwargs, pos
+        return args, [], pos
+
+    def isKeyword(self, pos):
+        # argument failed after "name =" could not be parsed as positional one either
+        result = self.name(pos)
+        return result is not None and self.literal('=', result[1]) is not None
+
+    def positional(self, pos, parseArg):
+        args = []
+        while True:
+            result = None if self.isKeyword(pos) else parseArg(pos)
+            if result is None:
+                break
+            arg, pos = result
+            args.append(arg)
+            after = self.literal(',', pos)
+            if after is None:
+                break
+            last, pos = pos, after
+        if not args:
+            return
+        if result is None:
+            pos = last
+        return args, pos
+
+    def keywords(self, pos, parseArg):
+        kwargs = []
+        while True:
+            result = self.keyword(pos, parseArg)
+            if result is None:
+                break
+            kwarg, pos = result
+            kwargs.append(kwarg)
+            after = self.literal(',', pos)
+            if after is None:
+                break
+            last, pos = pos, after
+        if not kwargs:
+            return
+        if result is None:
+            pos = last
+        return kwargs, pos
+
+    def keyword(self, pos, parseArg):
+        result = self.name(pos)
+        if result is None:
+            return
+        argname, pos = result
+        pos = self.literal('=', pos)
+        if pos is None:
+            return
+        result = parseArg(pos)
+        if result is not None:
+            arg, pos = result
+            return Tokens([argname, arg], argname=argname, args=[arg]), pos
+
+    def arg(self, pos):
+        result = self.boolean(pos) or self.literalArg(pos)
+        if result is not None:
+            return result
+        result = self.expression(pos)
+        if result is not None:
+            expression, pos = result
+            return Tokens([expression], expression=expression), pos
+
+    def literalArg(self, pos):
+        result = self.number(pos)
+        if result is not None:
+            number, pos = result
+            return Tokens([number], number=number), pos
+        result = self.quotedString(pos)
+        if result is not None:
+            text, pos = result
+            return Tokens([text], string=text), pos
+
+    def boolean(self, pos):
+        pos = self.skip(pos)
+        for value in ('true', 'false'):
+            end = pos + len(value)
+            if self.target[pos:end].lower() == value and \
+                    (end >= self.length or self.target[end] not in IDENT_CHARS):
+                return Tokens([value], boolean=Tokens([value])), end
+
+    def afterNumber(self, pos):
+        # followed by comma, right parenthesis or line end
+        while pos < self.length and self.target[pos] in ' \t\r':
+            pos += 1
+        if pos >= self.length or self.target[pos] == '\n':
+            return True
+        pos = self.skip(pos)
+        return pos < self.length and self.target[pos] in ',)'
+
+    def number(self, pos):
+        match = self.regex(SCIENTIFIC, pos)
+        if match is not None and self.afterNumber(match.end()):
+            text = '%se%s' % match.groups()
+            return Tokens([Tokens([text])], scientific=Tokens([text])), match.end()
+        match = self.regex(FLOAT, pos)
+        if match is not None and self.afterNumber(match.end()):
+            return Tokens([match.group()], float=match.group()), match.end()
+        match = self.regex(INTEGER, pos)
+        if match is not None and self.afterNumber(match.end()):
+            return Tokens([match.group()], integer=match.group()), match.end()
+
+    def quotedString(self, pos):
+        pos = self.skip(pos)
+        pattern = QUOTED_STRING.get(self.target[pos:pos + 1])
+        if pattern is None:
+            return
+        end = pattern.match(self.target, pos).end()
+        if self.target[end:end + 1] == self.target[pos]:
+            return self.target[pos:end + 1], end + 1
+
+
+def parseTarget(target):
+    """Parse target into tokens of moira.graphite.grammar"""
+    result = Parser(target.expandtabs()).expression(0)
+    if result is None:
+        raise ParseError("Can not parse target %r" % target)
+    expression, _ = result
+    return Tokens([expression], expression=expression)
@@ -50,3 +50,17 @@ class Spy(object):
 
 TRIGGER_CHECK = Spy()
 TRIGGER_CHECK_ERRORS = Spy()
+METRICS_CACHE_FETCHED = Spy()
+METRICS_CACHE_SERVED = Spy()
+HISTORY_CACHE_FETCHED = Spy()
+HISTORY_CACHE_SERVED = Spy()
+HISTORY_CACHE_HITS = Spy()
+HISTORY_CACHE_MISSES = Spy()
+EVALUATION_MEMO_HITS = Spy()
+EVALUATION_MEMO_MISSES = Spy()
+CACHE_HITS = Spy()
+CACHE_MISSES = Spy()
+CACHE_EVICTIONS = Spy()
+RETENTION_SWEEP_KEYS = Spy()
+RETENTION_SWEEP_DELETED = Spy()
+RETENTION_SWEEP_BYTES = Spy()
@@ -26,4 +26,7 @@ setup(
                             'moira-checker = moira.checker.server:run'],
     },
     install_requires=required,
+    extras_require={
+        'numpy': ['numpy'],
+    },
 )
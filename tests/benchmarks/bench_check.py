@@ -0,0 +1,111 @@
+"""
+Micro-benchmark of per-point trigger state evaluation against whole window evaluation in check.trigger.
+
+    python -m tests.benchmarks.bench_check [metrics] [points]
+"""
+import random
+import sys
+import timeit
+
+from twisted.internet import defer
+
+from moira import config
+from moira.checker import check, event, expression, state
+from moira.checker.timeseries import TargetTimeSeries
+from moira.graphite.datalib import TimeSeries, ArrayTimeSeries
+
+
+class Db(object):
+
+    def pushEvent(self, event, writes=None):
+        return defer.succeed(None)
+
+    def cleanupMetricValues(self, *args, **kwargs):
+        return defer.succeed(None)
+
+    def setTriggerLastCheck(self, trigger_id, check, writes=None):
+        self.check = check
+        return defer.succeed(None)
+
+    def flushWrites(self, writes):
+        return defer.succeed(None)
+
+
+class Trigger(object):
+
+    id = 'bench'
+    maintenance = 0
+    is_simple = False
+    ttl = None
+
+    def __init__(self, seriesList, now):
+        self.db = Db()
+        self.struct = {'warn_value': 60, 'error_value': 90}
+        self.now = now
+        self.seriesList = seriesList
+
+    def init(self, now, fromTime=None):
+        self.last_check = {'metrics': {}, 'state': state.OK, 'timestamp': self.now}
+        time_series = TargetTimeSeries()
+        time_series[1] = [series.copy() for series in self.seriesList]
+        for series in time_series[1]:
+            series.last_state = {'state': state.NODATA, 'timestamp': series.start - 3600}
+        self.time_series = time_series
+        return defer.succeed(True)
+
+    def get_timeseries(self, requestContext):
+        return defer.succeed(self.time_series)
+
+    def isSchedAllows(self, ts):
+        return True
+
+
+@defer.inlineCallbacks
+def pointwise(trigger):
+    """Reference loop evaluating expression and comparing states for every point"""
+    yield trigger.init(trigger.now)
+    time_series = trigger.time_series
+    check = {"metrics": {}}
+    for t1 in time_series[1]:
+        metric_state = check["metrics"][t1.name] = t1.last_state.copy()
+        for value_timestamp in xrange(t1.start, trigger.now + t1.step, t1.step):
+            expression_values = time_series.get_expression_values(t1, value_timestamp)
+            if None in expression_values.values():
+                continue
+            expression_values.update({'warn_value': 60, 'error_value': 90, 'PREV_STATE': metric_state['state']})
+            expression_state = expression.getExpression(None, **expression_values)
+            time_series.update_state(t1, check, expression_state, expression_values, value_timestamp)
+            yield event.compare_states(trigger, metric_state, t1.last_state, value_timestamp,
+                                       value=expression_values["t1"], metric=t1.name)
+    trigger.db.check = check
+
+
+def generateSeriesList(cls, count, points):
+    rnd = random.Random(0)
+    seriesList = []
+    for i in range(count):
+        level = rnd.choice([10, 70, 95])
+        values = [None if rnd.random() < 0.02 else level + rnd.uniform(-3, 3) for _ in range(points)]
+        seriesList.append(cls('server%d.cpu' % i, 0, points * 60, 60, values))
+    return seriesList
+
+
+def main(count=1000, points=360):
+    now = (points - 1) * 60
+    config.ARRAY_SERIES = True
+    for cls in (TimeSeries, ArrayTimeSeries):
+        trigger = Trigger(generateSeriesList(cls, count, points), now)
+        cases = [('pointwise', lambda: pointwise(trigger)), ('window', lambda: check.trigger(trigger, now, now, 0))]
+        results = []
+        timings = []
+        for name, f in cases:
+            timings.append(min(timeit.repeat(f, number=1, repeat=3)))
+            results.append(dict((name, (metric['state'], metric['value'], metric['timestamp']))
+                                for name, metric in trigger.db.check['metrics'].iteritems()))
+        assert results[0] == results[1]
+        print "%-16s %6d metrics x %d points: pointwise %.1f ms, window %.1f ms" % (
+            cls.__name__, count, points, timings[0] * 1000, timings[1] * 1000)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,54 @@
+"""
+Micro-benchmark of trigger expression evaluation: eval per point against compiled closures.
+
+    python -m tests.benchmarks.bench_expression [points]
+"""
+import operator
+import random
+import sys
+import timeit
+
+from moira.checker import expression, state
+
+
+EXPRESSIONS = [None, "ERROR if t1 > t2 * 2 else WARN if t1 > t2 else OK"]
+DEFAULT = compile("ERROR if compare_operator(t1, error_value) else WARN if compare_operator(t1, warn_value) else OK",
+                  '<string>', 'eval')
+codes = {}
+
+
+def evalExpression(trigger_expression, **kwargs):
+    global_dict = {"OK": state.OK, "WARN": state.WARN, "WARNING": state.WARN,
+                   "ERROR": state.ERROR, "NODATA": state.NODATA}
+    global_dict.update(kwargs)
+    if not trigger_expression:
+        global_dict['compare_operator'] = operator.ge if kwargs['warn_value'] <= kwargs['error_value'] \
+            else operator.le
+        return eval(DEFAULT, global_dict)
+    code = codes.get(trigger_expression)
+    if code is None:
+        code = codes[trigger_expression] = compile(trigger_expression, '<string>', 'eval')
+    return eval(code, global_dict)
+
+
+def main(points=100000):
+    rnd = random.Random(0)
+    rows = [(rnd.uniform(0, 100), rnd.uniform(0, 100)) for _ in range(points)]
+
+    for trigger_expression in EXPRESSIONS:
+        def old():
+            return [evalExpression(trigger_expression, t1=t1, t2=t2, warn_value=60, error_value=90,
+                                   PREV_STATE=state.OK) for t1, t2 in rows]
+
+        def new():
+            evaluate = expression.getCompiledExpression(trigger_expression, 2, 60, 90)
+            return [evaluate(t1, t2, PREV_STATE=state.OK) for t1, t2 in rows]
+
+        assert old() == new()
+        timings = [min(timeit.repeat(f, number=1, repeat=3)) for f in (old, new)]
+        print "%-52s %d points: eval %.1f ms, compiled %.1f ms" % (
+            trigger_expression or "default", points, timings[0] * 1000, timings[1] * 1000)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
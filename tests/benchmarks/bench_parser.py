@@ -0,0 +1,43 @@
+"""
+Micro-benchmark of parsing graphite targets with pyparsing grammar and recursive descent parser.
+
+    python -m tests.benchmarks.bench_parser [targets]
+"""
+import random
+import sys
+import timeit
+
+from moira.graphite.grammar import grammar
+from moira.graphite.parser import parseTarget
+
+
+TEMPLATES = [
+    u'{path}',
+    u'sumSeries({path})',
+    u'movingAverage({path}, 10)',
+    u'alias(scale(sumSeries({path}), 0.5), "total {n}")',
+    u'divideSeries(sumSeries({path}), sumSeries({path}.count))',
+    u'aliasByNode(movingAverage(exclude({path}, "test"), "5min", xFilesFactor=0.5), 1, 2)',
+    u'asPercent(nonNegativeDerivative(groupByNode({path}, 2, "sumSeries")), 1e3)',
+]
+
+
+def generateTargets(count):
+    rnd = random.Random(0)
+    targets = []
+    for n in range(count):
+        nodes = [u'Servers', u'srv-%d' % n, u'*', u'{cpu,mem}', u'requests', u'p99']
+        path = u'.'.join(rnd.choice(nodes) for _ in range(4))
+        targets.append(rnd.choice(TEMPLATES).format(path=path, n=n))
+    return targets
+
+
+def main(count=1000):
+    targets = generateTargets(count)
+    for name, parse in (('pyparsing', grammar.parseString), ('parseTarget', parseTarget)):
+        best = min(timeit.repeat(lambda: [parse(target) for target in targets], number=1, repeat=5))
+        print "%-12s %d targets: %.1f ms, %.0f targets/s" % (name, count, best * 1000, count / best)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
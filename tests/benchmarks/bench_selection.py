@@ -0,0 +1,60 @@
+"""
+Micro-benchmark of top-k and percentile selection against full sorts over series lists.
+
+    python -m tests.benchmarks.bench_selection [points] [n]
+"""
+import random
+import sys
+import timeit
+from itertools import izip
+
+from moira.graphite import functions
+from moira.graphite.datalib import TimeSeries
+
+
+SIZES = [10, 100, 1000, 10000, 100000]
+
+
+def generateSeriesList(count, points):
+    rnd = random.Random(0)
+    seriesList = []
+    for i in range(count):
+        values = [None if rnd.random() < 0.05 else round(rnd.uniform(0, 100), 1) for _ in range(points)]
+        series = TimeSeries('server%d.cpu' % i, 0, points * 60, 60, values)
+        series.pathExpression = 'server*.cpu'
+        seriesList.append(series)
+    return seriesList
+
+
+def sortedPercentile(points, n):
+    sortedPoints = sorted([p for p in points if p is not None])
+    rank = int(functions.math.ceil((n / 100.0) * (len(sortedPoints) + 1)))
+    return sortedPoints[min(max(rank, 1), len(sortedPoints)) - 1]
+
+
+def main(points=10, n=5):
+    cases = [
+        ('highestCurrent',
+         lambda seriesList: sorted(seriesList, key=functions.safeLast)[-n:],
+         lambda seriesList: functions.highestCurrent(None, seriesList, n)),
+        ('lowestAverage',
+         lambda seriesList: sorted(seriesList, key=lambda s: functions.safeDiv(
+             functions.safeSum(s), functions.safeLen(s)))[:n],
+         lambda seriesList: functions.lowestAverage(None, seriesList, n)),
+        ('percentileOfSeries(95)',
+         lambda seriesList: [sortedPercentile(row, 95) for row in izip(*seriesList)],
+         lambda seriesList: list(functions.percentileOfSeries(None, seriesList, 95)[0])),
+    ]
+    for count in SIZES:
+        seriesList = generateSeriesList(count, points)
+        number = max(1, 10000 / count)
+        for name, old, new in cases:
+            assert old(seriesList) == new(seriesList), name
+            timings = [min(timeit.repeat(lambda: f(seriesList), number=number, repeat=3)) / number
+                       for f in (old, new)]
+            print "%-24s %6d series x %d points: sort %.2f ms, select %.2f ms" % (
+                name, count, points, timings[0] * 1000, timings[1] * 1000)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,44 @@
+"""
+Micro-benchmark of decoding getMetricsValues reply into time series values.
+
+    python -m tests.benchmarks.bench_unpack [metrics] [points]
+"""
+import random
+import sys
+import timeit
+
+from moira.graphite.datalib import unpackTimeSeries, unpackTimeSeriesMatrix, toList
+
+
+def generateDataList(metrics, points, retention, startTime):
+    rnd = random.Random(0)
+    dataList = []
+    for _ in range(metrics):
+        data = []
+        for slot in range(points):
+            if rnd.random() < 0.05:
+                continue
+            timestamp = startTime + slot * retention + rnd.randint(0, retention - 1)
+            data.append(("%d %f" % (timestamp, rnd.uniform(0, 1000)), float(timestamp)))
+        dataList.append(data)
+    return dataList
+
+
+def main(metrics=5000, points=60):
+    retention = 60
+    startTime = 1500000000
+    endTime = startTime + points * retention
+    dataList = generateDataList(metrics, points, retention, startTime)
+    args = (dataList, retention, startTime, endTime, False, True)
+
+    expected = unpackTimeSeries(*args)
+    matrix, lengths = unpackTimeSeriesMatrix(*args)
+    assert [toList(matrix[i, :length]) for i, length in enumerate(lengths)] == expected
+
+    for name, func in (('unpackTimeSeries', unpackTimeSeries), ('unpackTimeSeriesMatrix', unpackTimeSeriesMatrix)):
+        best = min(timeit.repeat(lambda: func(*args), number=1, repeat=5))
+        print "%-24s %d metrics x %d points: %.1f ms" % (name, metrics, points, best * 1000)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -87,6 +87,9 @@ class TwistedFakeRedis(FakeStrictRedis):
     def pipeline(self, transaction=True):
         return TwistedFakePipeline(self, transaction)
 
+    def scan(self, cursor=0, pattern=None, count=None):
+        return FakeStrictRedis.scan(self, cursor, match=pattern, count=count)
+
     def getset(self, name, value):
         val = self._db.get(name)
         self._db[name] = value
@@ -4,11 +4,14 @@ from moira.graphite import datalib
 from . import trigger, WorkerTests
 from StringIO import StringIO
 from twisted.internet.defer import inlineCallbacks, returnValue
-from twisted.internet.task import deferLater
+from twisted.internet.task import Clock, deferLater
 from twisted.internet import reactor
 from twisted.web import http, client
 from twisted.web.http_headers import Headers
+from moira import cache, config, db
+from moira.db import WriteBuffer
 from moira.checker import state, worker
+from moira.checker.trigger import Trigger
 from moira.checker.worker import TriggersCheck
 
 
@@ -642,6 +645,134 @@ class DataTests(WorkerTests):
         self.assertEquals(total, 2)
         self.assertEquals(events[0]["state"], state.ERROR)
 
+    @trigger('test-window-events')
+    @inlineCallbacks
+    def testWindowEvents(self):
+        metric = 'MoiraFuncTest.metric.one'
+        self.patch(config, 'BAD_STATES_REMINDER', {'ERROR': 300})
+        yield self.sendTrigger('{"name": "test trigger", "targets": ["' +
+                               metric + '"], "warn_value": 60, "error_value": 90, "ttl":600 }')
+        values = [10, 100, 100, 100, 100, 100, 100, 100, None, 70, 80, 10, 10]
+        start = self.now - 60 * len(values)
+        for i, value in enumerate(values):
+            if value is not None:
+                yield self.db.sendMetric(metric, metric, start + 60 * i, value)
+        for array_series in (False, True):
+            yield self.db.rc.delete(db.LAST_CHECK_PREFIX.format(self.trigger.id), db.EVENTS_UI)
+            self.patch(config, 'ARRAY_SERIES', array_series)
+            yield self.trigger.check(now=self.now)
+            yield self.assert_trigger_metric(metric, 10, state.OK)
+            events, total = yield self.db.getEvents()
+            self.assertEquals([(e["state"], e["value"], e["timestamp"] - start) for e in reversed(events)],
+                              [(state.OK, 10, 0), (state.ERROR, 100, 60), (state.ERROR, 100, 360),
+                               (state.WARN, 70, 540), (state.OK, 10, 660)])
+
+    @trigger('test-check-writes')
+    @inlineCallbacks
+    def testCheckWrites(self):
+        pattern = 'MoiraFuncTest.host.*.metric'
+        yield self.sendTrigger('{"name": "test trigger", "targets": ["' + pattern +
+                               '"], "warn_value": 60, "error_value": 90, "ttl":600 }')
+        for i in range(20):
+            metric = 'MoiraFuncTest.host.%d.metric' % i
+            yield self.db.sendMetric(pattern, metric, self.now - 60, 100)
+        multi = self.db.rc.multi
+        transactions = []
+        self.patch(self.db.rc, 'multi', lambda: transactions.append(1) or multi())
+        yield self.trigger.check(now=self.now)
+        self.assertEqual(len(transactions), 1)
+        events, total = yield self.db.getEvents()
+        self.assertEquals(total, 20)
+        self.assertEquals(set(e["state"] for e in events), set([state.ERROR]))
+        yield self.assert_trigger_metric('MoiraFuncTest.host.7.metric', 100, state.ERROR)
+
+    @inlineCallbacks
+    def testQueuedCleanup(self):
+        self.patch(cache, 'CACHE', cache.LRUCache(None, 0))
+        metric = 'MoiraFuncTest.metric.one'
+        yield self.db.sendMetric(metric, metric, self.now - 60, 100)
+        writes = WriteBuffer()
+        for _ in range(2):
+            yield self.db.cleanupMetricValues(metric, self.now, cache_key=metric, cache_ttl=60, writes=writes)
+        self.assertEqual(len(writes), 1)
+        values = yield self.db.getMetricsValues([metric], 0)
+        self.assertEqual(len(values[0]), 1)
+        yield self.db.flushWrites(writes)
+        values = yield self.db.getMetricsValues([metric], 0)
+        self.assertEqual(len(values[0]), 0)
+        yield self.db.cleanupMetricValues(metric, self.now, cache_key=metric, cache_ttl=60, writes=writes)
+        self.assertEqual(len(writes), 0)
+
+    @trigger('test-cleanup-rate')
+    @inlineCallbacks
+    def testCheckCleanupRate(self):
+        self.patch(cache, 'CACHE', cache.LRUCache(None, 0))
+        metric = 'MoiraFuncTest.metric.one'
+        yield self.sendTrigger('{"name": "test trigger", "targets": ["' +
+                               metric + '"], "warn_value": 60, "error_value": 90 }')
+        yield self.db.sendMetric(metric, metric, self.now - 60, 10)
+        cleanups = []
+        flushWrites = self.db.flushWrites
+
+        def recordFlush(writes):
+            cleanups.extend(name for name, args, _ in writes.commands
+                            if name == 'zremrangebyscore' and args == (db.METRIC_PREFIX.format(metric),))
+            return flushWrites(writes)
+        self.patch(self.db, 'flushWrites', recordFlush)
+        yield self.trigger.check(now=self.now, cache_ttl=60)
+        yield self.trigger.check(now=self.now + 60, cache_ttl=60)
+        self.assertEqual(len(cleanups), 1)
+        yield self.trigger.check(now=self.now + 120, cache_ttl=0)
+        self.assertEqual(len(cleanups), 2)
+
+    @trigger('test-trigger-context')
+    @inlineCallbacks
+    def testTriggerContext(self):
+        tags = ["tag%d" % i for i in range(12)]
+        yield self.sendTrigger(anyjson.dumps({"name": "test trigger", "targets": ["devops.m"],
+                                              "warn_value": 1, "error_value": 2, "tags": tags}))
+        yield self.db.setTag("tag7", {"maintenance": self.now})
+        other = Trigger("test-trigger-context-other", self.db)
+        yield self.db.saveTrigger(other.id, {"name": "other", "targets": ["devops.m"], "tags": tags[::-1]})
+        pipelines = []
+        pipeline = self.db.rc.pipeline
+        self.patch(self.db.rc, 'pipeline', lambda: pipelines.append(1) or pipeline())
+        initialized = yield self.trigger.init(self.now)
+        self.assertTrue(initialized)
+        self.assertEqual(len(pipelines), 2)
+        self.assertEqual(self.trigger.maintenance, self.now)
+        self.assertEqual(sorted(self.trigger.struct["tags"]), sorted(tags))
+        self.assertEqual(self.trigger.last_check["metrics"], {})
+        initialized = yield other.init(self.now)
+        self.assertTrue(initialized)
+        self.assertEqual(len(pipelines), 3)
+        self.assertEqual(other.maintenance, self.now)
+        initialized = yield Trigger("test-trigger-context-missing", self.db).init(self.now)
+        self.assertFalse(initialized)
+
+    @trigger('test-tag-cache')
+    @inlineCallbacks
+    def testTagCacheTTL(self):
+        clock = Clock()
+        self.patch(cache, 'reactor', clock)
+        yield self.sendTrigger(anyjson.dumps({"name": "test trigger", "targets": ["devops.m"],
+                                              "warn_value": 1, "error_value": 2, "tags": ["tag1"]}))
+        # checker worker with its own tag cache
+        worker_db = db.Db()
+        worker_db.rc = self.db.rc
+        checked = Trigger(self.trigger.id, worker_db)
+        yield checked.init(self.now)
+        self.assertEqual(checked.maintenance, 0)
+        yield self.db.setTag("tag1", {"maintenance": self.now + 600})
+        clock.advance(config.TAG_CACHE_TTL)
+        yield checked.init(self.now)
+        self.assertEqual(checked.maintenance, 0)
+        yield self.trigger.init(self.now)
+        self.assertEqual(self.trigger.maintenance, self.now + 600)
+        clock.advance(1)
+        yield checked.init(self.now)
+        self.assertEqual(checked.maintenance, self.now + 600)
+
     @trigger('test-nodata-deletion')
     @inlineCallbacks
     def testNodataDeletion(self):
@@ -695,6 +826,20 @@ class DataTests(WorkerTests):
         self.assertEquals(len(values), 1)
         self.assertEquals(len(values[0]), 0)
 
+    @trigger('test-metrics-sweeper')
+    @inlineCallbacks
+    def testMetricsCleanupBySweeper(self):
+        metric = 'MoiraFuncTest.metric.one'
+        self.patch(config, 'RETENTION_SWEEP_INTERVAL', 600)
+        yield self.sendTrigger('{"name": "test trigger", "targets": ["' +
+                               metric + '"], "warn_value": 60, "error_value": 90 }')
+        yield self.db.sendMetric(metric, metric, self.now - 3600, 1)
+        yield self.db.sendMetric(metric, metric, self.now - 60, 1)
+        yield self.trigger.check(now=self.now + 60, cache_ttl=0)
+        yield self.assert_trigger_metric(metric, 1, state.OK)
+        values = yield self.db.getMetricsValues([metric], self.now - 3600)
+        self.assertEquals(len(values[0]), 2)
+
     @trigger('test-schedule')
     @inlineCallbacks
     def testTriggerSchedule(self):
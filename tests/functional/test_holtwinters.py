@@ -0,0 +1,86 @@
+from twisted.internet.defer import inlineCallbacks, returnValue
+
+from moira.graphite import functions
+from moira.graphite.datalib import createRequestContext
+from moira.graphite.evaluator import evaluateTarget
+from . import WorkerTests
+
+
+class HoltWintersTests(WorkerTests):
+
+    @inlineCallbacks
+    def setUp(self):
+        yield WorkerTests.setUp(self)
+        functions.holtWintersStates = None
+        self.addCleanup(setattr, functions, 'holtWintersStates', None)
+        self.now = self.now - self.now % 60 + 17
+        self.calls = []
+        getMetricsValues = self.db.getMetricsValues
+
+        def record(metrics, startTime, endTime='+inf'):
+            self.calls.append((startTime, endTime))
+            return getMetricsValues(metrics, startTime, endTime)
+        self.db.getMetricsValues = record
+
+    @inlineCallbacks
+    def sendMetrics(self, fromTime, toTime):
+        yield self.db.addPatternMetric('hw.*', 'hw.one')
+        for timestamp in range(fromTime - fromTime % 60, toTime, 60):
+            yield self.db.sendMetric('hw.*', 'hw.one', timestamp, timestamp / 60 % 17)
+
+    @inlineCallbacks
+    def evaluate(self, target, now, window=600):
+        del self.calls[:]
+        context = createRequestContext(str(now - window), str(now), allowRealTimeAlerting=True)
+        result = yield evaluateTarget(context, target)
+        returnValue([(s.name, list(s)) for s in result])
+
+    @inlineCallbacks
+    def testIncrementalState(self):
+        yield self.sendMetrics(self.now - 3 * 3600, self.now + 600)
+        target = 'holtWintersConfidenceBands(hw.*)'
+        first = yield self.evaluate(target, self.now)
+        self.assertEqual(len(self.calls), 2)
+        self.assertEqual(self.calls[1][0], self.now - 600 - 17 - functions.HOLT_WINTERS_BOOTSTRAP)
+        self.assertEqual([name for name, _ in first], ['holtWintersConfidenceLower(hw.one)',
+                                                       'holtWintersConfidenceUpper(hw.one)'])
+        self.assertEqual(len(first[0][1]), 10)
+
+        incremental = yield self.evaluate(target, self.now + 300)
+        self.assertEqual(self.calls[1], (self.now - 600 - 17, self.now - 300 - 17 - 1))
+        functions.holtWintersStates = None
+        expected = yield self.evaluate(target, self.now + 300)
+        self.assertNotIn(None, incremental[0][1])
+        # state started a week before the first check still has no points older than a day
+        self.assertEqual(incremental, expected)
+
+    @inlineCallbacks
+    def testAlternatingWindows(self):
+        yield self.sendMetrics(self.now - 3 * 3600, self.now + 1200)
+        target = 'holtWintersForecast(hw.*)'
+        for window in (600, 3600):
+            yield self.evaluate(target, self.now, window)
+            self.assertEqual(self.calls[1][0], self.now - window - 17 - functions.HOLT_WINTERS_BOOTSTRAP)
+        for now in range(self.now + 300, self.now + 1200, 300):
+            for window in (600, 3600):
+                yield self.evaluate(target, now, window)
+                self.assertEqual(self.calls[1], (now - 300 - window - 17, now - window - 17 - 1))
+        self.assertEqual(len(functions.holtWintersStates.get(('hw.one', 60))), 2)
+
+    @inlineCallbacks
+    def testGap(self):
+        yield self.sendMetrics(self.now - 3600, self.now)
+        yield self.evaluate('holtWintersForecast(hw.*)', self.now)
+        later = self.now + functions.HOLT_WINTERS_BOOTSTRAP + 3600
+        yield self.evaluate('holtWintersForecast(hw.*)', later)
+        self.assertEqual(self.calls[1][0], later - 600 - 17 - functions.HOLT_WINTERS_BOOTSTRAP)
+
+    @inlineCallbacks
+    def testAberration(self):
+        yield self.sendMetrics(self.now - 3600, self.now - 60)
+        yield self.db.sendMetric('hw.*', 'hw.one', self.now - 17, 1000)
+        [(name, aberration)] = yield self.evaluate('holtWintersAberration(hw.*)', self.now)
+        self.assertEqual(name, 'holtWintersAberration(hw.one)')
+        self.assertTrue(aberration[-1] > 0)
+        area = yield self.evaluate('holtWintersConfidenceArea(hw.*)', self.now)
+        self.assertEqual(len(area), 2)
@@ -0,0 +1,129 @@
+import anyjson
+
+from twisted.internet.defer import Deferred, inlineCallbacks, gatherResults
+
+from moira import config
+from moira.checker import master
+from moira.db import TRIGGERS_TO_CHECK
+from . import WorkerTests
+
+
+class BatchTests(WorkerTests):
+
+    @inlineCallbacks
+    def setUp(self):
+        yield WorkerTests.setUp(self)
+        self.patch(config, 'BATCH_INTERVAL', 0.01)
+        self.patch(config, 'BATCH_SIZE', 100)
+        master.PATTERN_TRIGGERS.clear()
+        master.SCHEDULED_TRIGGERS.clear()
+        self.calls = []
+        batch = self.db.addPatternsMetricsAndTriggerChecks
+
+        def record(pattern_metrics, trigger_ids):
+            self.calls.append((pattern_metrics, trigger_ids))
+            return batch(pattern_metrics, trigger_ids)
+        self.db.addPatternsMetricsAndTriggerChecks = record
+
+    def receive(self, pattern, metric):
+        message = anyjson.serialize({"pattern": pattern, "metric": metric})
+        return self.protocol.messageReceived(None, "moira-func-test", message)
+
+    @inlineCallbacks
+    def testBatch(self):
+        yield self.db.saveTrigger('one', {"patterns": ["a.*"]})
+        yield self.db.saveTrigger('two', {"patterns": ["a.*", "b.*"]})
+        yield gatherResults([self.receive("a.*", "a.x"), self.receive("a.*", "a.x"),
+                             self.receive("a.*", "a.y"), self.receive("b.*", "b.x"),
+                             self.protocol.messageReceived(None, "moira-func-test", "not json")])
+        self.flushLoggedErrors()
+        self.assertEqual(self.calls, [({"a.*": set(["a.x", "a.y"]), "b.*": set(["b.x"])}, set(["one", "two"]))])
+        metrics = yield self.db.getPatternsMetrics(["a.*", "b.*"])
+        self.assertEqual(metrics, [set(["a.x", "a.y"]), set(["b.x"])])
+        triggers = yield self.db.rc.smembers(TRIGGERS_TO_CHECK)
+        self.assertEqual(triggers, set(["one", "two"]))
+
+        # triggers are added to check once per CHECK_INTERVAL
+        yield self.receive("b.*", "b.y")
+        self.assertEqual(self.calls[-1], ({"b.*": set(["b.y"])}, set()))
+
+    @inlineCallbacks
+    def testBatchSize(self):
+        self.patch(config, 'BATCH_INTERVAL', 60)
+        self.patch(config, 'BATCH_SIZE', 2)
+        yield self.db.saveTrigger('one', {"patterns": ["a.*"]})
+        yield gatherResults([self.receive("a.*", "a.x"), self.receive("a.*", "a.y")])
+        self.assertEqual(len(self.calls), 1)
+        self.assertIdentical(self.protocol.batch, None)
+
+    @inlineCallbacks
+    def testPatternWithoutTriggers(self):
+        yield self.db.sendMetric("c.*", "c.x", self.now, 1)
+        yield self.db.addPatternMetric("c.*", "c.x")
+        yield self.receive("c.*", "c.x")
+        self.assertEqual(self.calls, [({}, set())])
+        metrics = yield self.db.getPatternMetrics("c.*")
+        self.assertEqual(metrics, set())
+        values = yield self.db.getMetricsValues(["c.x"], self.now - 60)
+        self.assertEqual(values, [[]])
+
+
+class PatternTriggersIndexTests(WorkerTests):
+
+    @inlineCallbacks
+    def setUp(self):
+        yield WorkerTests.setUp(self)
+        self.addCleanup(master.PATTERN_TRIGGERS.clear)
+        self.lookups = []
+        getPatternsTriggers = self.db.getPatternsTriggers
+
+        def record(patterns):
+            self.lookups.append(list(patterns))
+            return getPatternsTriggers(patterns)
+        self.db.getPatternsTriggers = record
+        self.published = []
+        self.db.rc.publish = lambda channel, message: self.published.append(
+            self.protocol.messageReceived(None, channel, message))
+
+    @inlineCallbacks
+    def testIndex(self):
+        yield self.db.saveTrigger('one', {"patterns": ["a.*"]})
+        yield self.db.saveTrigger('two', {"patterns": ["a.*", "b.*"]})
+        yield master.PATTERN_TRIGGERS.load(self.db)
+        self.assertEqual(master.PATTERN_TRIGGERS.triggers, {"a.*": set(["one", "two"]), "b.*": set(["two"])})
+
+        del self.lookups[:]
+        triggers = yield master.PATTERN_TRIGGERS.get(self.db, ["b.*", "a.*"])
+        self.assertEqual(triggers, [set(["two"]), set(["one", "two"])])
+        self.assertEqual(self.lookups, [])
+
+        yield self.db.saveTrigger('two', {"patterns": ["c.*"]}, existing={"patterns": ["a.*", "b.*"]})
+        yield self.db.removeTrigger('one', existing={"patterns": ["a.*"]})
+        yield self.db.saveTrigger('three', {"patterns": ["b.*"]})
+        yield gatherResults(self.published)
+        self.assertEqual(self.lookups, [["a.*", "b.*", "c.*"], ["a.*"], ["b.*"]])
+        self.assertEqual(master.PATTERN_TRIGGERS.triggers, {"b.*": set(["three"]), "c.*": set(["two"])})
+
+    @inlineCallbacks
+    def testUnknownPattern(self):
+        yield master.PATTERN_TRIGGERS.load(self.db)
+        # trigger saved, but change message is not received yet
+        yield self.db.rc.sadd("moira-pattern-triggers:a.*", "one")
+        yield self.protocol.messageReceived(None, "moira-func-test", anyjson.serialize({"pattern": "a.*",
+                                                                                        "metric": "a.x"}))
+        self.assertEqual(master.PATTERN_TRIGGERS.triggers, {"a.*": set(["one"])})
+        triggers = yield self.db.rc.smembers(TRIGGERS_TO_CHECK)
+        self.assertEqual(triggers, set(["one"]))
+
+    @inlineCallbacks
+    def testChangesWhileLoading(self):
+        yield self.db.saveTrigger('one', {"patterns": ["a.*"]})
+        patterns = Deferred()
+        self.db.getPatterns = lambda: patterns
+        loading = master.PATTERN_TRIGGERS.load(self.db)
+        yield self.db.saveTrigger('two', {"patterns": ["b.*"]})
+        yield gatherResults(self.published)
+        patterns.callback(["a.*"])
+        yield loading
+        self.assertEqual(master.PATTERN_TRIGGERS.triggers, {"a.*": set(["one"]), "b.*": set(["two"])})
+        self.assertEqual(master.PATTERN_TRIGGERS.changed, None)
@@ -0,0 +1,163 @@
+from twisted.trial import unittest
+from twisted.internet.defer import Deferred, inlineCallbacks
+
+from moira import db
+from moira.checker.metrics_cache import MetricsCache, HistoryCache, POINT_BYTES
+from moira.metrics import spy
+from . import TwistedFakeRedis
+
+
+class MetricsCacheTests(unittest.TestCase):
+
+    @inlineCallbacks
+    def setUp(self):
+        self.db = db.Db()
+        self.db.rc = TwistedFakeRedis()
+        yield self.db.startService()
+        yield self.db.flush()
+        self.ranges = []
+        getMetricsValuesRanges = self.db.getMetricsValuesRanges
+
+        def recordRanges(ranges):
+            self.ranges.append(ranges)
+            return getMetricsValuesRanges(ranges)
+        self.db.getMetricsValuesRanges = recordRanges
+        self.cache = MetricsCache(self.db, size=100)
+        self.now = 1500000000
+
+    @inlineCallbacks
+    def tearDown(self):
+        yield self.db.stopService()
+
+    @inlineCallbacks
+    def sendMetrics(self, metric, timestamps):
+        for timestamp in timestamps:
+            yield self.db.sendMetric('pattern', metric, timestamp, timestamp % 100)
+
+    @inlineCallbacks
+    def assertCached(self, metrics, startTime, endTime):
+        expected = yield self.db.getMetricsValues(metrics, startTime, endTime)
+        actual = yield self.cache.getMetricsValues(metrics, startTime, endTime)
+        self.assertEqual([list(data) for data in actual], [list(data) for data in expected])
+
+    @inlineCallbacks
+    def testIncrementalFetch(self):
+        yield self.sendMetrics('one', range(self.now - 600, self.now + 1, 60))
+        yield self.sendMetrics('two', [self.now - 30])
+        yield self.assertCached(['one', 'two', 'three'], self.now - 600, self.now)
+        self.assertEqual(self.ranges[-1], [('one', self.now - 600, self.now),
+                                           ('two', self.now - 600, self.now),
+                                           ('three', self.now - 600, self.now)])
+
+        yield self.sendMetrics('one', [self.now + 60])
+        yield self.sendMetrics('three', [self.now + 10])
+        yield self.assertCached(['one', 'two', 'three'], self.now - 540, self.now + 60)
+        self.assertEqual(self.ranges[-1], [('one', self.now - 120, self.now + 60),
+                                           ('two', self.now - 150, self.now + 60),
+                                           ('three', self.now - 600, self.now + 60)])
+
+    @inlineCallbacks
+    def testEarlierStartTime(self):
+        yield self.sendMetrics('one', range(self.now - 600, self.now + 1, 60))
+        yield self.assertCached(['one'], self.now - 300, self.now)
+        yield self.assertCached(['one'], self.now - 600, self.now)
+        self.assertEqual(self.ranges[-1], [('one', self.now - 600, '(%s' % (self.now - 300)),
+                                           ('one', self.now - 120, self.now)])
+        yield self.assertCached(['one'], self.now - 500, self.now - 200)
+        self.assertEqual(len(self.ranges), 2)
+
+    @inlineCallbacks
+    def testEviction(self):
+        yield self.sendMetrics('one', range(self.now - 600, self.now + 1))
+        yield self.sendMetrics('two', range(self.now - 50, self.now + 1))
+        yield self.assertCached(['one'], self.now - 600, self.now)
+        self.assertEqual(self.cache.points, 0)
+        yield self.assertCached(['two'], self.now - 600, self.now)
+        self.assertEqual(self.cache.points, 51)
+        self.assertEqual(self.cache.windows.keys(), ['two'])
+
+    @inlineCallbacks
+    def testLateMetrics(self):
+        yield self.sendMetrics('one', [self.now - 60, self.now])
+        yield self.assertCached(['one'], self.now - 600, self.now)
+        yield self.sendMetrics('one', [self.now - 30, self.now + 60])
+        yield self.assertCached(['one'], self.now - 600, self.now + 60)
+
+    @inlineCallbacks
+    def testConcurrentReads(self):
+        yield self.sendMetrics('one', range(self.now - 600, self.now + 1, 60))
+        yield self.sendMetrics('two', [self.now - 30])
+        expected = yield self.db.getMetricsValues(['one', 'two'], self.now - 600, self.now)
+        reads = []
+        held = []
+        getMetricsValuesRanges = self.db.getMetricsValuesRanges
+
+        def holdRanges(ranges):
+            held.append(ranges)
+            read = Deferred()
+            reads.append(read)
+            read.addCallback(lambda _: getMetricsValuesRanges(ranges))
+            return read
+        self.db.getMetricsValuesRanges = holdRanges
+        first = self.cache.getMetricsValues(['one'], self.now - 600, self.now)
+        second = self.cache.getMetricsValues(['two'], self.now - 600, self.now)
+        third = self.cache.getMetricsValues(['two', 'one'], self.now - 600, self.now)
+        # reads of other metrics are not held back, the same metrics wait for them
+        self.assertEqual(held, [[('one', self.now - 600, self.now)], [('two', self.now - 600, self.now)]])
+        reads[0].callback(None)
+        reads[1].callback(None)
+        self.assertEqual(held[2:], [[('two', self.now - 150, self.now), ('one', self.now - 120, self.now)]])
+        reads[2].callback(None)
+        results = yield first
+        self.assertEqual(results, expected[:1])
+        results = yield second
+        self.assertEqual(results, expected[1:])
+        results = yield third
+        self.assertEqual(results, expected[::-1])
+        self.assertEqual(self.cache.weight, sum(map(self.cache.weigh, self.cache.windows.values())))
+
+
+class HistoryCacheTests(MetricsCacheTests):
+
+    @inlineCallbacks
+    def setUp(self):
+        yield MetricsCacheTests.setUp(self)
+        self.cache = HistoryCache(self.db, size=10000)
+
+    def assertWeight(self):
+        windows = self.cache.windows.values()
+        self.assertEqual(self.cache.weight, sum(w.weigh(w.members) for w in windows))
+
+    @inlineCallbacks
+    def testBytes(self):
+        yield self.sendMetrics('one', range(self.now - 600, self.now + 1, 60))
+        yield self.assertCached(['one'], self.now - 300, self.now)
+        self.assertWeight()
+        yield self.assertCached(['one'], self.now - 600, self.now)
+        self.assertWeight()
+        yield self.sendMetrics('one', [self.now + 60])
+        yield self.assertCached(['one'], self.now - 240, self.now + 60)
+        self.assertWeight()
+        members = self.cache.windows['one'].members
+        self.assertEqual(len(members), 12)
+        self.assertEqual(self.cache.weight, sum(len(member) + POINT_BYTES for member in members))
+
+    @inlineCallbacks
+    def testEviction(self):
+        self.cache.size = 3000
+        yield self.sendMetrics('one', range(self.now - 600, self.now + 1))
+        yield self.sendMetrics('two', range(self.now - 10, self.now + 1))
+        yield self.assertCached(['one', 'two'], self.now - 600, self.now)
+        self.assertEqual(self.cache.windows.keys(), ['two'])
+        self.assertTrue(0 < self.cache.weight <= 3000)
+        self.assertWeight()
+
+    @inlineCallbacks
+    def testHits(self):
+        self.patch(spy, 'HISTORY_CACHE_HITS', spy.Spy())
+        self.patch(spy, 'HISTORY_CACHE_MISSES', spy.Spy())
+        yield self.assertCached(['one', 'two'], self.now - 300, self.now)
+        yield self.assertCached(['one', 'two'], self.now - 240, self.now + 60)
+        yield self.assertCached(['one'], self.now - 600, self.now + 60)
+        self.assertEqual(spy.HISTORY_CACHE_HITS.get_metrics()["sum"], 2)
+        self.assertEqual(spy.HISTORY_CACHE_MISSES.get_metrics()["sum"], 3)
@@ -0,0 +1,190 @@
+from twisted.internet.defer import inlineCallbacks, returnValue
+
+from moira import config
+from moira.checker.metrics_cache import HistoryCache
+from moira.db import METRIC_RETENTION_PREFIX
+from moira.metrics import spy
+from moira.graphite import datalib, evaluator
+from moira.graphite.datalib import createRequestContext
+from moira.graphite.evaluator import evaluateTarget, prefetchTargets, plans
+from . import WorkerTests
+
+
+class PrefetchTests(WorkerTests):
+
+    @inlineCallbacks
+    def sendMetrics(self):
+        for pattern, metrics in (('a.*', ['a.one', 'a.two']), ('b.*', ['b.one'])):
+            for value, metric in enumerate(metrics):
+                yield self.db.addPatternMetric(pattern, metric)
+                yield self.db.sendMetric(pattern, metric, self.now - 60, value + 1)
+                yield self.db.sendMetric(pattern, metric, self.now, value + 2)
+
+    def recordCalls(self, name):
+        calls = []
+        method = getattr(self.db, name)
+
+        def record(*args, **kwargs):
+            calls.append(args)
+            return method(*args, **kwargs)
+        setattr(self.db, name, record)
+        return calls
+
+    def context(self):
+        return createRequestContext(str(self.now - 600), str(self.now), allowRealTimeAlerting=True)
+
+    @inlineCallbacks
+    def evaluate(self, targets, prefetch):
+        context = self.context()
+        if prefetch:
+            yield prefetchTargets(context, targets)
+        results = []
+        for target in targets:
+            time_series = yield evaluateTarget(context, target)
+            results.append([(ts.name, list(ts)) for ts in time_series])
+        self.assertEqual(context['metrics'], set(['a.one', 'a.two', 'b.one']))
+        self.assertEqual(context['graphite_patterns'], {u'a.*': set(['a.one', 'a.two']),
+                                                        u'b.*': set(['b.one']),
+                                                        u'c.*': set([u'c.*'])})
+        returnValue(results)
+
+    @inlineCallbacks
+    def testPrefetchTargets(self):
+        yield self.sendMetrics()
+        targets = [u'divideSeries(sumSeries(a.*), sumSeries(b.*))', u'b.*', u'c.*']
+        patternMetrics = self.recordCalls('getPatternMetrics')
+        patternsMetrics = self.recordCalls('getPatternsMetrics')
+        metricsValues = self.recordCalls('getMetricsValues')
+
+        expected = yield self.evaluate(targets, prefetch=False)
+        # b.* is already prefetched with the first target
+        self.assertEqual(len(patternsMetrics), 2)
+        self.assertEqual(len(metricsValues), 1)
+        del patternsMetrics[:]
+        del metricsValues[:]
+
+        results = yield self.evaluate(targets, prefetch=True)
+        self.assertEqual(patternMetrics, [])
+        self.assertEqual(len(patternsMetrics), 1)
+        self.assertEqual(len(metricsValues), 1)
+        self.assertEqual(results, expected)
+        self.assertEqual(results[0], [(u'divideSeries(sumSeries(a.*),sumSeries(b.*))', [None] * 9 + [3.0, 2.5])])
+        self.assertEqual(results[1], [('b.one', [None] * 9 + [1.0, 2.0])])
+        self.assertEqual(results[2], [(u'c.*', [])])
+
+    @inlineCallbacks
+    def testSynchronousEvaluation(self):
+        yield self.sendMetrics()
+        targets = [u'divideSeries(sumSeries(a.*), sumSeries(b.*))', u'b.*', u'c.*',
+                   u'alias(scale(sumSeries(a.*, b.*), 2), "total")',
+                   u'sumSeries(movingAverage(a.*, 2), offset(b.*, 1))',
+                   u'scale(offset(absolute(a.*), -1), 0.5)']
+        context = self.context()
+        yield prefetchTargets(context, targets)
+        for target in targets:
+            plan = plans.get(target)
+            expected = yield plan(context)
+            if plan.synchronous:
+                actual = plan.evaluate(context)
+                self.assertEqual([(ts.name, list(ts)) for ts in actual], [(ts.name, list(ts)) for ts in expected])
+        self.assertEqual([plans.get(target).synchronous for target in targets], [True, True, True, True, False, True])
+
+    @inlineCallbacks
+    def testEvaluationMemo(self):
+        yield self.sendMetrics()
+        self.patch(evaluator, 'memo', evaluator.EvaluationMemo())
+        self.patch(spy, 'EVALUATION_MEMO_HITS', spy.Spy())
+        target = u'alias(sumSeries(a.*, b.*), "total")'
+
+        @inlineCallbacks
+        def evaluate():
+            context = self.context()
+            time_series = yield evaluateTarget(context, target)
+            self.assertEqual(context['metrics'], set(['a.one', 'a.two', 'b.one']))
+            self.assertEqual(context['graphite_patterns'], {u'a.*': set(['a.one', 'a.two']),
+                                                            u'b.*': set(['b.one'])})
+            returnValue(time_series)
+
+        first = yield evaluate()
+        first[0].name = 'changed'
+        second = yield evaluate()
+        self.assertEqual(spy.EVALUATION_MEMO_HITS.get_metrics()["count"], 1)
+        self.assertEqual([(ts.name, list(ts)) for ts in second], [('total', [None] * 9 + [4.0, 7.0])])
+        self.assertIsNot(second[0], first[0])
+
+        yield self.db.sendMetric('b.*', 'b.one', self.now - 120, 5)
+        third = yield evaluate()
+        self.assertEqual(spy.EVALUATION_MEMO_HITS.get_metrics()["count"], 1)
+        self.assertEqual([(ts.name, list(ts)) for ts in third], [('total', [None] * 8 + [5.0, 4.0, 7.0])])
+
+    @inlineCallbacks
+    def testMetricsRetentions(self):
+        yield self.db.addPatternMetric('r.*', 'r.minutely')
+        yield self.db.addPatternMetric('r.*', 'r.secondly')
+        yield self.db.rc.set(METRIC_RETENTION_PREFIX.format('r.secondly'), 10)
+        yield self.db.sendMetric('r.*', 'r.minutely', self.now - 60, 1)
+        yield self.db.sendMetric('r.*', 'r.secondly', self.now - 20, 2)
+        mget = self.recordCalls('getMetricsRetentions')
+
+        context = createRequestContext(str(self.now - 120), str(self.now), allowRealTimeAlerting=False)
+        time_series = yield evaluateTarget(context, u'r.*')
+        self.assertEqual(sorted((ts.name, ts.step, list(ts)) for ts in time_series),
+                         [('r.minutely', 60, [None, 1.0]),
+                          ('r.secondly', 10, [None] * 10 + [2.0, None])])
+        self.assertEqual(len(mget), 1)
+        retentions = yield self.db.getMetricsRetentions(['r.secondly', 'r.minutely'])
+        self.assertEqual(retentions, [10, 60])
+
+    @inlineCallbacks
+    def testHistoryCache(self):
+        for timestamp in range(self.now - 7200, self.now + 1, 60):
+            yield self.db.sendMetric('a.*', 'a.one', timestamp, timestamp % 7)
+        yield self.db.addPatternMetric('a.*', 'a.one')
+        target = u'timeShift(a.*, "1h")'
+
+        @inlineCallbacks
+        def evaluate(now):
+            context = createRequestContext(str(now - 600), str(now), allowRealTimeAlerting=False)
+            time_series = yield evaluateTarget(context, target)
+            returnValue([(ts.name, list(ts)) for ts in time_series])
+
+        expected = [(yield evaluate(self.now - 120)), (yield evaluate(self.now))]
+        self.patch(datalib, 'history_cache', HistoryCache(self.db))
+        ranges = self.recordCalls('getMetricsValuesRanges')
+        results = [(yield evaluate(self.now - 120)), (yield evaluate(self.now))]
+        self.assertEqual(results, expected)
+        # the second check reads only points after the first shifted window
+        self.assertEqual(ranges, [([('a.one', self.now - 4320, self.now - 3720)],),
+                                  ([('a.one', self.now - 3720 - config.CHECKPOINT_GAP, self.now - 3600)],)])
+
+    @inlineCallbacks
+    def testSummarizeSingleFetch(self):
+        now = self.now - self.now % 600
+        for value, metric in enumerate(['a.one', 'a.two']):
+            yield self.db.addPatternMetric('a.*', metric)
+            for timestamp in range(now - 1200, now + 1, 60):
+                yield self.db.sendMetric('a.*', metric, timestamp, value + timestamp % 7)
+        metricsValues = self.recordCalls('getMetricsValues')
+
+        @inlineCallbacks
+        def evaluate(target):
+            context = createRequestContext(str(now - 570), str(now), allowRealTimeAlerting=True)
+            time_series = yield evaluateTarget(context, target)
+            returnValue([(ts.name, ts.start, ts.end, ts.step, list(ts)) for ts in time_series])
+
+        # the window is fetched again from now - 600, once for both series
+        points = dict((metric, [float(value + timestamp % 7) for timestamp in range(now - 600, now, 60)])
+                      for value, metric in enumerate(['a.one', 'a.two']))
+        for func, fold in (('sum', sum), ('avg', lambda p: sum(p) / len(p)), ('min', min), ('max', max),
+                           ('last', lambda p: p[-1])):
+            target = u'smartSummarize(a.*, "10min", "%s")' % func
+            results = yield evaluate(target)
+            self.assertEqual(sorted(results), [
+                ('smartSummarize(%s, "10min", "%s")' % (metric, func), now - 600, now, 600, [fold(points[metric])])
+                for metric in ['a.one', 'a.two']])
+            self.assertEqual([r[1:] for r in metricsValues], [(now - 570, now), (now - 600, now)])
+            del metricsValues[:]
+            self.patch(config, 'ARRAY_SERIES', False)
+            self.assertEqual((yield evaluate(target)), results)
+            self.patch(config, 'ARRAY_SERIES', True)
+            del metricsValues[:]
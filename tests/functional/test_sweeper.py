@@ -0,0 +1,75 @@
+from twisted.trial import unittest
+from twisted.internet.defer import inlineCallbacks
+
+from moira import config, db
+from moira.checker import sweeper
+from moira.checker.sweeper import RetentionSweeper
+from . import TwistedFakeRedis
+
+
+class RetentionSweeperTests(unittest.TestCase):
+
+    @inlineCallbacks
+    def setUp(self):
+        self.db = db.Db()
+        self.db.rc = TwistedFakeRedis()
+        yield self.db.startService()
+        yield self.db.flush()
+        self.patch(config, 'METRICS_TTL', 3600)
+        self.patch(config, 'RETENTION_SWEEP_OPS', 0)
+        self.sweeper = RetentionSweeper(self.db)
+        self.now = 1500000000
+
+    @inlineCallbacks
+    def tearDown(self):
+        yield self.db.stopService()
+
+    @inlineCallbacks
+    def sendMetrics(self, metric, timestamps):
+        for timestamp in timestamps:
+            yield self.db.sendMetric('pattern', metric, timestamp, 1)
+
+    @inlineCallbacks
+    def testSweep(self):
+        old = self.now - 4000
+        yield self.sendMetrics('metric.old', [old, old + 60])
+        yield self.sendMetrics('metric.mixed', [old, self.now - 60, self.now])
+        yield self.sendMetrics('metric.new', [self.now])
+        yield self.db.rc.set('moira-metric-data-other', 1)
+        result = yield self.sweeper.sweepOnce(self.now)
+        self.assertEqual(result, (2, 1, 3 * sweeper.VALUE_BYTES))
+        values = yield self.db.getMetricsValues(['metric.old', 'metric.mixed', 'metric.new'], 0)
+        self.assertEqual([len(v) for v in values], [0, 2, 1])
+        exists = yield self.db.rc.exists(db.METRIC_PREFIX.format('metric.old'))
+        self.assertFalse(exists)
+        result = yield self.sweeper.sweepOnce(self.now)
+        self.assertEqual(result, (0, 0, 0))
+
+    @inlineCallbacks
+    def testBatches(self):
+        metrics = ['metric.%d' % i for i in range(25)]
+        for metric in metrics:
+            yield self.sendMetrics(metric, [self.now - 4000, self.now])
+        self.patch(config, 'RETENTION_SWEEP_BATCH', 4)
+        self.patch(config, 'RETENTION_SWEEP_OPS', 1000)
+        scans = []
+        scanMetrics = self.db.scanMetrics
+
+        def recordScan(cursor, count):
+            scans.append(cursor)
+            return scanMetrics(cursor, count)
+        self.db.scanMetrics = recordScan
+        delays = []
+        deferLater = sweeper.deferLater
+
+        def recordDelay(clock, delay, f):
+            delays.append(delay)
+            return deferLater(clock, delay, f)
+        self.patch(sweeper, 'deferLater', recordDelay)
+        result = yield self.sweeper.sweepOnce(self.now)
+        self.assertEqual(result[:2], (25, 0))
+        self.assertTrue(len(scans) > 1)
+        self.assertEqual(len(delays), len(scans) - 1)
+        self.assertTrue(all(0 < delay <= 9 / 1000.0 for delay in delays))
+        values = yield self.db.getMetricsValues(metrics, 0)
+        self.assertEqual([len(v) for v in values], [1] * 25)
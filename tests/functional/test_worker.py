@@ -0,0 +1,85 @@
+from twisted.internet.defer import Deferred, inlineCallbacks
+
+from moira.checker import worker
+from moira.checker.worker import TriggersCheck
+from moira.db import TRIGGERS_TO_CHECK, TRIGGER_CHECK_LOCK_PREFIX
+from moira.metrics import spy
+from . import WorkerTests
+
+
+class TriggersCheckTests(WorkerTests):
+
+    @inlineCallbacks
+    def setUp(self):
+        yield WorkerTests.setUp(self)
+        self.patch(worker.config, 'MAX_PARALLEL_CHECKS', 2)
+        self.check = TriggersCheck(self.db)
+        self.running = {}
+        self.checked = []
+        test = self
+
+        class Trigger(object):
+
+            def __init__(self, trigger_id, db):
+                self.id = trigger_id
+
+            def check(self):
+                test.running[self.id] = Deferred()
+                return test.running[self.id]
+        self.patch(worker, 'Trigger', Trigger)
+
+    def finish(self, trigger_id):
+        self.checked.append(trigger_id)
+        self.running.pop(trigger_id).callback(None)
+
+    @inlineCallbacks
+    def testParallelChecks(self):
+        yield self.db.rc.sadd(TRIGGERS_TO_CHECK, "one", "two", "three", "locked")
+        yield self.db.setTriggerCheckLock("locked")
+        performed = self.check.perform()
+        self.assertEqual(len(self.running), 2)
+        self.finish(sorted(self.running)[0])
+        self.assertEqual(len(self.running), 2)
+        while self.running:
+            self.finish(self.running.keys()[0])
+        yield performed
+        self.assertEqual(sorted(self.checked), ["one", "three", "two"])
+        self.assertEqual(self.check.slots.tokens, 2)
+        for trigger_id in self.checked:
+            lock = yield self.db.rc.get(TRIGGER_CHECK_LOCK_PREFIX.format(trigger_id))
+            self.assertIdentical(lock, None)
+        locked = yield self.db.rc.get(TRIGGER_CHECK_LOCK_PREFIX.format("locked"))
+        self.assertNotIdentical(locked, None)
+
+    @inlineCallbacks
+    def testFailedCheck(self):
+        self.patch(spy, 'TRIGGER_CHECK_ERRORS', spy.Spy())
+        yield self.db.rc.sadd(TRIGGERS_TO_CHECK, "one", "two", "three")
+        performed = self.check.perform()
+        failed = sorted(self.running)[0]
+        self.running.pop(failed).errback(ValueError("check failed"))
+        # finished checks are not kept
+        self.assertEqual(len(self.check.checks), 2)
+        while self.running:
+            self.finish(self.running.keys()[0])
+        yield performed
+        self.assertEqual(len(self.checked), 2)
+        self.assertNotIn(failed, self.checked)
+        self.assertEqual(self.check.checks, set())
+        self.assertEqual(self.check.slots.tokens, 2)
+        self.assertEqual(spy.TRIGGER_CHECK_ERRORS.get_metrics()["count"], 1)
+        for trigger_id in self.checked:
+            lock = yield self.db.rc.get(TRIGGER_CHECK_LOCK_PREFIX.format(trigger_id))
+            self.assertIdentical(lock, None)
+        lock = yield self.db.rc.get(TRIGGER_CHECK_LOCK_PREFIX.format(failed))
+        self.assertNotIdentical(lock, None)
+
+    @inlineCallbacks
+    def testPopCount(self):
+        yield self.db.rc.sadd(TRIGGERS_TO_CHECK, "one", "two", "three")
+        trigger_ids = yield self.db.getTriggersToCheck(2)
+        self.assertEqual(len(trigger_ids), 2)
+        trigger_ids = yield self.db.getTriggersToCheck(2)
+        self.assertEqual(len(trigger_ids), 1)
+        trigger_ids = yield self.db.getTriggersToCheck(2)
+        self.assertEqual(trigger_ids, [])
@@ -0,0 +1,124 @@
+from twisted.trial import unittest
+
+from moira import config
+from moira.graphite import functions
+from moira.graphite.datalib import TimeSeries, ArrayTimeSeries, asTimeSeries, numpy
+
+
+def series(name, values):
+    s = TimeSeries(name, 0, 10 * len(values), 10, values)
+    s.pathExpression = name
+    return s
+
+
+def arraySeries(name, values):
+    s = ArrayTimeSeries(name, 0, 10 * len(values), 10, values)
+    s.pathExpression = name
+    return s
+
+
+class ArraySeries(unittest.TestCase):
+
+    if numpy is None:
+        skip = "numpy is not installed"
+
+    def setUp(self):
+        self.arraySeries = config.ARRAY_SERIES
+
+    def tearDown(self):
+        config.ARRAY_SERIES = self.arraySeries
+
+    def lists(self):
+        return [series('a', [1.5, None, 3.25, -4.0, 0.0, 7.1, None]),
+                series('b', [0.1, 2.0, None, 4.0, 0.0, 1e17, None]),
+                series('c', [0.2, 0.3, 5.5, 0.0, None, -1e17])]
+
+    def arrays(self):
+        return [arraySeries(s.name, s) for s in self.lists()]
+
+    def call(self, enabled, func, *args, **kwargs):
+        config.ARRAY_SERIES = enabled
+        result = func({}, *args, **kwargs)
+        if isinstance(result, list):
+            return result
+        return self.successResultOf(result)
+
+    def assertSameSeries(self, expected, actual):
+        self.assertEqual([(s.name, s.pathExpression, list(s)) for s in expected],
+                         [(s.name, s.pathExpression, list(s)) for s in actual])
+
+    def assertArrayResult(self, func, *args, **kwargs):
+        expected = self.call(False, func, self.lists(), *args, **kwargs)
+        actual = self.call(True, func, self.arrays(), *args, **kwargs)
+        for s in actual:
+            self.assertIsInstance(s, ArrayTimeSeries)
+        self.assertSameSeries(expected, actual)
+
+    def testBehavesAsList(self):
+        s = arraySeries('a', [1.0, None, 3.0])
+        self.assertEqual(len(s), 3)
+        self.assertEqual(s[1], None)
+        self.assertEqual(s[-1], 3.0)
+        self.assertEqual(s[1:], [None, 3.0])
+        self.assertEqual(list(s), [1.0, None, 3.0])
+        self.assertEqual(s, [1.0, None, 3.0])
+        self.assertTrue(None in s)
+        self.assertEqual(max(s), 3.0)
+
+    def testReadOnly(self):
+        s = arraySeries('a', [1.0, None, 3.0])
+        self.assertRaises(TypeError, s.__setitem__, 0, 2.0)
+        self.assertRaises(TypeError, s.append, 2.0)
+        self.assertRaises(ValueError, s.values.__setitem__, 0, 2.0)
+
+    def testConsolidation(self):
+        s = arraySeries('a', [1.0, None, 3.0, 5.0])
+        expected = series('a', [1.0, None, 3.0, 5.0])
+        s.consolidate(2)
+        expected.consolidate(2)
+        self.assertEqual(list(s), list(expected))
+
+    def testAsTimeSeries(self):
+        s = arraySeries('a', [1.0, None])
+        s.options['stacked'] = True
+        [copy] = asTimeSeries([s])
+        self.assertNotIsInstance(copy, ArrayTimeSeries)
+        self.assertEqual((copy.name, copy.pathExpression, copy.options), ('a', 'a', {'stacked': True}))
+        copy[0] = 2.0
+        self.assertEqual(list(s), [1.0, None])
+
+    def testSumSeries(self):
+        self.assertArrayResult(functions.sumSeries)
+
+    def testAverageSeries(self):
+        self.assertArrayResult(functions.averageSeries)
+
+    def testAsPercent(self):
+        self.assertArrayResult(functions.asPercent)
+        self.assertArrayResult(functions.asPercent, 0)
+        self.assertArrayResult(functions.asPercent, 12.5)
+        self.assertArrayResult(functions.asPercent, [series('t', [2.0, 0.0, None, 4.0, 5.0, 6.0, 7.0])])
+
+    def testDivideSeries(self):
+        self.assertArrayResult(functions.divideSeries, [series('d', [2.0, 0.0, None, 4.0, 0.5, 6.0, 7.0])])
+
+    def testDerivatives(self):
+        self.assertArrayResult(functions.perSecond)
+        self.assertArrayResult(functions.perSecond, 10)
+        self.assertArrayResult(functions.nonNegativeDerivative)
+        self.assertArrayResult(functions.nonNegativeDerivative, 5)
+
+    def testScaleAndOffset(self):
+        self.assertArrayResult(functions.scale, 0.3)
+        self.assertArrayResult(functions.offset, -2)
+
+    def testMovingWindow(self):
+        values = [1.0, None, 2.5, 0.1, None, None, None, 7.0, -3.0, 0.2]
+        windowPoints = 3
+        offset = 4
+        length = len(values) - offset
+        t_funcs = {'avg': functions.safeAvg, 'min': functions.safeMin, 'max': functions.safeMax}
+        for func in t_funcs:
+            expected = [t_funcs[func](values[i + offset - windowPoints + 1:i + offset + 1]) for i in range(length)]
+            array = functions.arrayMovingWindow(numpy.array(values, dtype=float), offset, length, windowPoints, func)
+            self.assertEqual([None if v != v else v for v in array], expected)
@@ -0,0 +1,78 @@
+import random
+
+from twisted.trial import unittest
+
+from moira import config
+from moira.graphite import functions
+from moira.graphite.datalib import TimeSeries, toArray, toList
+
+
+FUNCS = ['sum', 'avg', 'min', 'max', 'last', 'median']
+
+
+def foldBuckets(values, buckets, bucketCount, func):
+    folded = dict((bucket, []) for bucket in range(bucketCount))
+    for value, bucket in zip(values, buckets):
+        if value is not None and bucket in folded:
+            folded[bucket].append(value)
+    result = []
+    for bucket in range(bucketCount):
+        points = folded[bucket]
+        if not points:
+            result.append(None)
+        elif func == 'avg':
+            result.append(float(sum(points)) / float(len(points)))
+        elif func == 'last':
+            result.append(points[len(points) - 1])
+        elif func == 'max':
+            result.append(max(points))
+        elif func == 'min':
+            result.append(min(points))
+        else:
+            result.append(sum(points))
+    return result
+
+
+class Buckets(unittest.TestCase):
+
+    def assertSameBuckets(self, values, buckets, bucketCount):
+        for func in FUNCS:
+            expected = foldBuckets(values, buckets, bucketCount, func)
+            self.assertEqual(functions.bucketValues(values, buckets, bucketCount, func), expected)
+            floats = [None if v is None else float(v) for v in values]
+            self.assertEqual(toList(functions.arrayBucketValues(toArray(floats), buckets, bucketCount, func)),
+                             foldBuckets(floats, buckets, bucketCount, func))
+
+    def testBuckets(self):
+        values = [1.0, None, 2.5, 0.1, None, None, None, 7.0, -3.0, 0.2, 2, 2.0, None, 5]
+        self.assertSameBuckets(values, [i / 3 for i in range(len(values))], 5)
+        self.assertSameBuckets(values, [i / 3 - 1 for i in range(len(values))], 3)
+        self.assertSameBuckets(values, [0] * len(values), 1)
+        self.assertSameBuckets(values, [i / 3 for i in range(len(values) - 2)], 5)
+        self.assertSameBuckets([], [], 2)
+        self.assertSameBuckets([None, None], [0, 1], 2)
+
+    def testRandomBuckets(self):
+        rnd = random.Random(19)
+        for _ in range(200):
+            values = [rnd.choice([None, rnd.randint(-5, 5), rnd.uniform(-100, 100)]) for _ in range(rnd.randint(0, 50))]
+            bucketCount = rnd.randint(0, 10)
+            buckets = sorted(rnd.randint(-1, bucketCount) for _ in values)
+            self.assertSameBuckets(values, buckets, bucketCount)
+
+    def testSummarize(self):
+        rnd = random.Random(3)
+        for _ in range(50):
+            start = 1500000000 + rnd.randint(0, 3600)
+            step = rnd.choice([10, 60, 300])
+            values = [rnd.choice([None, rnd.uniform(0, 10)]) for _ in range(rnd.randint(0, 100))]
+            interval = rnd.choice(['1min', '5min', '1h'])
+            for func in FUNCS:
+                for alignToFrom in (False, True):
+                    series = TimeSeries('metric', start, start + step * len(values), step, values)
+                    self.patch(config, 'ARRAY_SERIES', False)
+                    expected = functions.summarize(None, [series], interval, func, alignToFrom)
+                    self.patch(config, 'ARRAY_SERIES', True)
+                    actual = functions.summarize(None, [series], interval, func, alignToFrom)
+                    self.assertEqual([(s.name, s.start, s.end, s.step, list(s)) for s in actual],
+                                     [(s.name, s.start, s.end, s.step, list(s)) for s in expected])
@@ -1,6 +1,7 @@
 from twisted.trial import unittest
-from moira.cache import cache
-from twisted.internet.defer import inlineCallbacks
+from moira import cache as cache_module
+from moira.cache import cache, LRUCache
+from twisted.internet.defer import inlineCallbacks, Deferred
 
 
 class Cache(unittest.TestCase):
@@ -19,3 +20,95 @@ class Cache(unittest.TestCase):
         self.assertEqual(len(items), 2)
         yield self.function(items, cache_key=1, cache_ttl=10)
         self.assertEqual(len(items), 2)
+
+    def testSingleFlight(self):
+        calls = []
+
+        @cache
+        def function():
+            calls.append(Deferred())
+            return calls[-1]
+        first = function(cache_key=2, cache_ttl=10)
+        second = function(cache_key=2, cache_ttl=10)
+        self.assertEqual(len(calls), 1)
+        calls[0].callback('value')
+        self.assertEqual(self.successResultOf(first), 'value')
+        self.assertEqual(self.successResultOf(second), 'value')
+        self.assertEqual(self.successResultOf(function(cache_key=2, cache_ttl=10)), 'value')
+        self.assertEqual(len(calls), 1)
+
+    def testFailureIsNotCached(self):
+        calls = []
+
+        @cache
+        def function():
+            calls.append(Deferred())
+            return calls[-1]
+        first = function(cache_key=3, cache_ttl=10)
+        second = function(cache_key=3, cache_ttl=10)
+        calls[0].errback(ValueError())
+        self.failureResultOf(first, ValueError)
+        self.failureResultOf(second, ValueError)
+        function(cache_key=3, cache_ttl=10)
+        self.assertEqual(len(calls), 2)
+
+    def testQueuedWrites(self):
+        calls = []
+
+        class Writes(object):
+
+            def __init__(self):
+                self.cached = []
+
+        @cache
+        def function(writes=None):
+            calls.append(writes)
+            return 'value'
+        first, second = Writes(), Writes()
+        function(cache_key=4, cache_ttl=10, writes=first)
+        function(cache_key=4, cache_ttl=10, writes=second)
+        # result is not cached until queued commands are sent
+        self.assertEqual(len(calls), 2)
+        self.assertEqual([result for _, result in first.cached], ['value'])
+        cache_module.store(*first.cached[0])
+        self.assertEqual(self.successResultOf(function(cache_key=4, cache_ttl=10, writes=Writes())), 'value')
+        self.assertEqual(len(calls), 2)
+
+
+class FakeReactor(object):
+
+    def __init__(self):
+        self.now = 0
+
+    def seconds(self):
+        return self.now
+
+
+class LRU(unittest.TestCase):
+
+    def setUp(self):
+        self.reactor = FakeReactor()
+        self.patch(cache_module, 'reactor', self.reactor)
+
+    def testEviction(self):
+        lru = LRUCache(2, 60)
+        lru.set('a', 1)
+        lru.set('b', 2)
+        self.assertEqual(lru.get('a'), 1)
+        lru.set('c', 3)
+        self.assertEqual((lru.get('a'), lru.get('b'), lru.get('c')), (1, None, 3))
+        self.assertEqual(len(lru), 2)
+        self.assertEqual((lru.hits, lru.misses, lru.evictions), (3, 1, 1))
+
+    def testExpiration(self):
+        lru = LRUCache(2, 60)
+        lru.set('a', 1)
+        self.reactor.now = 60
+        self.assertEqual(lru.get('a'), 1)
+        self.reactor.now = 61
+        self.assertEqual(lru.get('a', 0), 0)
+        self.assertEqual(len(lru), 0)
+        lru.set('a', 1)
+        self.reactor.now = 70
+        self.assertEqual(lru.get('a', ttl=10), 1)
+        self.assertEqual(lru.get('a', ttl=5), None)
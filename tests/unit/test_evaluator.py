@@ -0,0 +1,98 @@
+from twisted.trial import unittest
+
+from moira.graphite.datalib import TimeSeries, ArrayTimeSeries, asTimeSeries, numpy
+from moira.graphite.evaluator import PlanCache, CallNode, ExpressionNode, PathNode, PointwiseNode
+
+
+class Plans(unittest.TestCase):
+
+    def testCompile(self):
+        plan = PlanCache(size=10).get(u'movingAverage(sumSeries(a.b.*), "1min", xFilesFactor=0.5)')
+        self.assertIsInstance(plan, ExpressionNode)
+        self.assertEqual(plan.patterns, [])
+        call = plan.body
+        self.assertIsInstance(call, CallNode)
+        self.assertEqual(call.funcname, 'movingAverage')
+        self.assertEqual(len(call.args), 2)
+        self.assertEqual(call.kwargs[0][0], 'xFilesFactor')
+        path = call.args[0].body.args[0].body
+        self.assertIsInstance(path, PathNode)
+        self.assertEqual(path.expression, 'a.b.*')
+        self.assertEqual(PlanCache(size=10).get(u'a.b.*').patterns, [u'a.b.*'])
+
+    def testCounters(self):
+        plans = PlanCache(size=2)
+        first = plans.get(u'a.b')
+        self.assertIs(plans.get(u'a.b'), first)
+        plans.get(u'a.c')
+        plans.get(u'a.d')
+        self.assertIsNot(plans.get(u'a.b'), first)
+        self.assertEqual((plans.hits, plans.misses), (1, 4))
+        self.assertEqual(len(plans.plans), 2)
+
+    def testInvalidate(self):
+        plans = PlanCache(size=2)
+        first = plans.get(u'a.b')
+        plans.invalidate([u'a.b', u'a.c'])
+        self.assertIsNot(plans.get(u'a.b'), first)
+        self.assertEqual((plans.hits, plans.misses), (0, 2))
+
+    def testValues(self):
+        call = PlanCache(size=0).get(u'f(1, 2.5, 1e3, "s", true)').body
+        values = [self.successResultOf(node({})) for node in call.args]
+        self.assertEqual(values, [1, 2.5, 1000.0, 's', True])
+
+    def testSynchronous(self):
+        plans = PlanCache(size=0)
+        self.assertTrue(plans.get(u'divideSeries(sumSeries(a.*), scale(b.*, 2))').synchronous)
+        self.assertTrue(plans.get(u'alias(a.*, "name")').synchronous)
+        self.assertFalse(plans.get(u'sumSeries(movingAverage(a.*, 10))').synchronous)
+        self.assertFalse(plans.get(u'timeShift(a.*, "1h")').synchronous)
+        self.assertFalse(plans.get(u'unknownFunction(a.*)').synchronous)
+
+    def testPointwiseFusion(self):
+        plans = PlanCache(size=0)
+        plan = plans.get(u'scale(offset(absolute(transformNull(a.*, 0)), -5), 0.5)')
+        self.assertIsInstance(plan.body, PointwiseNode)
+        self.assertEqual([call.funcname for call in plan.body.calls], ['transformNull', 'absolute', 'offset', 'scale'])
+        self.assertEqual(plan.body.source.patterns, [u'a.*'])
+        self.assertEqual(list(plan.paths()), [u'a.*'])
+        self.assertTrue(plan.synchronous)
+        # single calls, non-constant arguments and other functions are not fused
+        self.assertIsInstance(plans.get(u'scale(a.*, 2)').body, CallNode)
+        self.assertIsInstance(plans.get(u'scale(sumSeries(offset(a.*, 1)), 2)').body.args[0].body, CallNode)
+        template = plans.get(u'template(scale(offset(a.*, $1), 2), 1)')
+        self.assertIsInstance(template.body.body, CallNode)
+
+    def assertFused(self, target, seriesList):
+        node = PlanCache(size=0).get(target).body
+        self.assertIsInstance(node, PointwiseNode)
+        expected = seriesList()
+        for func, args, kwargs in node.steps:
+            expected = func({}, asTimeSeries(expected), *args, **kwargs)
+        actual = node.apply({}, seriesList())
+        self.assertEqual([(s.name, s.pathExpression, s.step, list(s)) for s in actual],
+                         [(s.name, s.pathExpression, s.step, list(s)) for s in expected])
+
+    def testPointwiseValues(self):
+        values = [None, -2, 0, 0.5, 3, None, 1e3]
+        targets = [u'scale(offset(absolute(transformNull(a.*, 0)), -5), 0.5)',
+                   u'pow(invert(squareRoot(a.*)), 2)',
+                   u'log(scaleToSeconds(offset(a.*, 10), 1), 2)',
+                   u'transformNull(log(a.*), default=-1)']
+
+        def seriesList(consolidate=1):
+            result = [TimeSeries('a.b', 0, 70, 10, values), TimeSeries('a.c', 0, 140, 20, values)]
+            for series in result:
+                series.pathExpression = 'a.*'
+            result[0].consolidate(consolidate)
+            return result
+
+        def arraySeriesList():
+            return [ArrayTimeSeries(s.name, s.start, s.end, s.step, s) for s in seriesList()]
+
+        for target in targets:
+            self.assertFused(target, seriesList)
+            self.assertFused(target, lambda: seriesList(consolidate=2))
+            if numpy is not None:
+                self.assertFused(target, arraySeriesList)
@@ -1,5 +1,7 @@
 from twisted.trial import unittest
+from moira import config
 from moira.checker import state, expression
+from moira.graphite.datalib import numpy
 
 
 class Expression(unittest.TestCase):
@@ -19,3 +21,43 @@ class Expression(unittest.TestCase):
             expression.getExpression("ERROR if f.min(t1,t2) else OK", t1=11, t2=4)
         with self.assertRaises(expression.ExpressionError):
             expression.getExpression("(lambda f: ())", t1=11, t2=4)
+
+    def testPrevState(self):
+        exp = "OK if PREV_STATE == ERROR and t1 < 5 else ERROR if t1 > 10 else PREV_STATE"
+        self.assertEqual(expression.getExpression(exp, t1=1, PREV_STATE=state.ERROR), state.OK)
+        self.assertEqual(expression.getExpression(exp, t1=7, PREV_STATE=state.ERROR), state.ERROR)
+        self.assertEqual(expression.getExpression(exp, t1=7, PREV_STATE=state.WARN), state.WARN)
+        with self.assertRaises(NameError):
+            expression.getExpression("ERROR if t2 > 10 else OK", t1=11)
+        with self.assertRaises(NameError):
+            expression.getExpression("ERROR if unknown else OK", t1=11)
+
+    def testCompiled(self):
+        self.patch(expression, 'cache', None)
+        self.patch(config, 'EXPRESSION_CACHE_SIZE', 2)
+        evaluate = expression.getCompiledExpression(None, 2, 60, 90)
+        self.assertEqual([evaluate(t1, 0, PREV_STATE=state.OK) for t1 in (10, 60, 90)],
+                         [state.OK, state.WARN, state.ERROR])
+        evaluate = expression.getCompiledExpression(None, 1, 30, 10)
+        self.assertEqual([evaluate(t1) for t1 in (40, 20, 10)], [state.OK, state.WARN, state.ERROR])
+        evaluate = expression.getCompiledExpression("WARNING if t1 > warn_value + t2 else OK", 2, 5, None)
+        self.assertEqual([evaluate(8, 2), evaluate(8, 3)], [state.WARN, state.OK])
+        self.assertEqual(len(expression.cache), 2)
+        self.assertEqual(expression.cache.misses, 3)
+        expression.getCompiledExpression(None, 2, 0, 1)
+        self.assertEqual(expression.cache.hits, 0)
+        expression.getCompiledExpression("WARNING if t1 > warn_value + t2 else OK", 2, 1, 2)
+        self.assertEqual(expression.cache.hits, 1)
+
+    def testArray(self):
+        values = [10, 30, 30.5, 60, 70, 90, 100, float('nan')]
+        for warn_value, error_value in ((60, 90), (30, 10), (30, 30), (30.5, 70)):
+            evaluate = expression.getArrayExpression(None, warn_value, error_value)
+            expected = [expression.getExpression(t1=value, warn_value=warn_value, error_value=error_value)
+                        for value in values]
+            self.assertEqual(evaluate(numpy.array(values)).tolist(), expected)
+        self.assertIs(expression.getArrayExpression("ERROR if t1 > 10 else OK", 60, 90), None)
+        self.assertIs(expression.getArrayExpression(None, None, 90), None)
+
+    if numpy is None:
+        testArray.skip = "numpy is not installed"
@@ -1,5 +1,7 @@
+import random
+
 from twisted.trial import unittest
-from moira.graphite.datalib import unpackTimeSeries
+from moira.graphite.datalib import unpackTimeSeries, unpackTimeSeriesMatrix, toList, numpy
 
 
 class FetchData(unittest.TestCase):
@@ -202,3 +204,37 @@ class FetchData(unittest.TestCase):
         dataList[0].append(self.generateRedisDataPoint(20, 300.))
         self.assertEqual(unpackTimeSeries(dataList, retention, startTime, 20, bootstrap=True, allowRealTimeAlerting=True), [[100., 200., 300.]])
         self.assertEqual(unpackTimeSeries(dataList, retention, startTime, 20, bootstrap=True, allowRealTimeAlerting=False), [[100., 200., 300.]])
+
+
+class FetchDataMatrix(unittest.TestCase):
+
+    if numpy is None:
+        skip = "numpy is not installed"
+
+    def assertSameUnpack(self, dataList, retention, startTime, endTime):
+        for bootstrap in (False, True):
+            for allowRealTimeAlerting in (False, True):
+                expected = unpackTimeSeries(dataList, retention, startTime, endTime, bootstrap, allowRealTimeAlerting)
+                matrix, lengths = unpackTimeSeriesMatrix(
+                    dataList, retention, startTime, endTime, bootstrap, allowRealTimeAlerting)
+                self.assertEqual([toList(matrix[i, :length]) for i, length in enumerate(lengths)], expected)
+
+    def testRandomSeries(self):
+        rnd = random.Random(42)
+        for _ in range(50):
+            retention = rnd.choice([1, 10, 60])
+            startTime = rnd.randint(0, 100)
+            endTime = startTime + rnd.randint(0, 20) * retention + rnd.randint(0, retention - 1)
+            dataList = []
+            for _ in range(rnd.randint(0, 5)):
+                timestamps = sorted(rnd.randint(startTime, endTime) for _ in range(rnd.randint(0, 30)))
+                dataList.append([("%d %r" % (ts, rnd.uniform(-1e6, 1e6)), float(ts)) for ts in timestamps])
+            self.assertSameUnpack(dataList, retention, startTime, endTime)
+
+    def testDuplicateSlots(self):
+        dataList = [[("0 1", 0.), ("5 2", 5.), ("12 3", 12.)], [("19 4", 19.), ("11 5", 11.)], []]
+        self.assertSameUnpack(dataList, 10, 0, 20)
+
+    def testMalformedMember(self):
+        dataList = [[("0 1.5 extra", 0.), ("10 2", 10.)]]
+        self.assertSameUnpack(dataList, 10, 0, 20)
@@ -0,0 +1,53 @@
+import random
+
+from twisted.trial import unittest
+
+from moira.graphite import functions
+
+
+SAFE_FUNCS = {'avg': functions.safeAvg, 'min': functions.safeMin,
+              'max': functions.safeMax, 'median': functions.safeMedian}
+
+
+class MovingWindow(unittest.TestCase):
+
+    def sliced(self, values, offset, length, windowPoints, func):
+        return [SAFE_FUNCS[func](values[i + offset - windowPoints + 1:i + offset + 1]) for i in range(length)]
+
+    def assertSameWindows(self, values, offset, length, windowPoints):
+        for func in SAFE_FUNCS:
+            expected = self.sliced(values, offset, length, windowPoints, func)
+            actual = functions.movingWindow(values, offset, length, windowPoints, func)
+            # repr tells apart nan, -0.0 and int from float
+            self.assertEqual(map(repr, actual), map(repr, expected))
+
+    def testWindows(self):
+        values = [1.0, None, 2.5, 0.1, None, None, None, 7.0, -3.0, 0.2, 2, 2.0, None, 5]
+        for windowPoints in range(-1, len(values) + 2):
+            for offset in range(-2, len(values)):
+                self.assertSameWindows(values, offset, len(values) - max(offset, 0), windowPoints)
+
+    def testRandomWindows(self):
+        rnd = random.Random(42)
+        for _ in range(200):
+            values = [rnd.choice([None, rnd.randint(-5, 5), rnd.uniform(-100, 100)]) for _ in range(rnd.randint(0, 50))]
+            offset = rnd.randint(0, len(values))
+            self.assertSameWindows(values, offset, len(values) - offset, rnd.randint(0, len(values) + 1))
+
+    def testNonFinite(self):
+        inf, nan = float('inf'), float('nan')
+        self.assertEqual(functions.movingWindow([1, 2, inf, 1, 2, 3, 4, 5, 6, 7], 4, 6, 5, 'avg'),
+                         [inf, inf, inf, 3.0, 4.0, 5.0])
+        for values in ([1, 2, inf, 1, -inf, 3, None, 5, inf, 7], [1.0, nan, 2, None, 0.5, nan, 3, -inf, 4, 1]):
+            for windowPoints in range(0, len(values) + 2):
+                for offset in range(0, len(values)):
+                    self.assertSameWindows(values, offset, len(values) - offset, windowPoints)
+
+    def testIntegerAverage(self):
+        values = [float(rnd) for rnd in random.Random(1).sample(xrange(10 ** 6), 500)]
+        self.assertEqual(functions.movingWindow(values, 100, 400, 60, 'avg'), self.sliced(values, 100, 400, 60, 'avg'))
+
+    def testTies(self):
+        values = [1, 1.0, None, 1]
+        self.assertEqual(map(type, functions.movingWindow(values, 2, 2, 3, 'max')),
+                         map(type, self.sliced(values, 2, 2, 3, 'max')))
@@ -0,0 +1,71 @@
+from twisted.trial import unittest
+
+from moira.graphite import datalib, functions
+from moira.graphite.datalib import TimeSeries, ArrayTimeSeries
+
+
+def makeSeries(name, values=(1, 2)):
+    series = TimeSeries(name, 0, 60 * len(values), 60, list(values))
+    series.pathExpression = name
+    return series
+
+
+class Nodes(unittest.TestCase):
+
+    def testNodes(self):
+        series = makeSeries('a.b.c')
+        self.assertEqual(series.nodes, ('a', 'b', 'c'))
+        self.assertIs(series.nodes, series.nodes)
+        series.name = 'a.b.c.d'
+        self.assertEqual(series.nodes, ('a', 'b', 'c', 'd'))
+        self.assertEqual(series.copy().nodes, ('a', 'b', 'c', 'd'))
+        self.assertEqual(makeSeries(u'x.y').nodes, (u'x', u'y'))
+        self.assertEqual(ArrayTimeSeries('a.b', 0, 60, 60, [1.0]).nodes, ('a', 'b'))
+
+    def testInterned(self):
+        first = makeSeries('.'.join(['servers', 'host1', 'cpu']))
+        second = makeSeries('.'.join(['servers', 'host2', 'cpu']))
+        self.assertIs(first.nodes[0], second.nodes[0])
+        self.assertIs(first.nodes[2], second.nodes[2])
+
+    def testCacheSize(self):
+        self.patch(datalib, 'NODES_CACHE_SIZE', 2)
+        self.patch(datalib, '_nodesCache', {})
+        for name in ('p.1', 'p.2', 'p.3'):
+            self.assertEqual(makeSeries(name).nodes, tuple(name.split('.')))
+        self.assertEqual(datalib._nodesCache.keys(), ['p.3'])
+
+    def testGroupSeriesByNodes(self):
+        seriesList = [makeSeries(name) for name in ('a.x.1', 'b.y.1', 'a.y.2', 'b.x.2', 'a.x.3')]
+        groups = functions.groupSeriesByNodes(seriesList, [0])
+        self.assertEqual([(key, [s.name for s in group]) for key, group in groups],
+                         [('a', ['a.x.1', 'a.y.2', 'a.x.3']), ('b', ['b.y.1', 'b.x.2'])])
+        groups = functions.groupSeriesByNodes(seriesList, [1, 0])
+        self.assertEqual([key for key, _ in groups], ['x.a', 'y.b', 'y.a', 'x.b'])
+        groups = functions.groupSeriesByNodes(seriesList, [0, 2, 5], exclude=True)
+        self.assertEqual([(key, len(group)) for key, group in groups], [('x', 3), ('y', 2)])
+        groups = functions.groupSeriesByNodes(seriesList, [-1])
+        self.assertEqual([key for key, _ in groups], ['1', '2', '3'])
+        self.assertRaises(IndexError, functions.groupSeriesByNodes, seriesList, [3])
+
+    def testWithWildcards(self):
+        def seriesList():
+            return [makeSeries(name, values) for name, values in (
+                ('host1.cpu.user', [1, 2]), ('host2.cpu.user', [3, None]), ('host1.cpu.system', [5, 6]))]
+        result = functions.sumSeriesWithWildcards(None, seriesList(), 0)
+        self.assertEqual([(s.name, list(s)) for s in result], [('cpu.user', [4, 2]), ('cpu.system', [5, 6])])
+        result = functions.averageSeriesWithWildcards(None, seriesList(), 0)
+        self.assertEqual([(s.name, list(s)) for s in result], [('cpu.user', [2.0, 2.0]), ('cpu.system', [5, 6])])
+        result = functions.multiplySeriesWithWildcards(None, seriesList(), 0, 2)
+        self.assertEqual([(s.name, list(s)) for s in result], [('cpu', [15, None])])
+
+    def testAliases(self):
+        seriesList = [makeSeries(name) for name in ('a.b.c', 'sumSeries(a.b.d)', 'a.{x,y}.e', 'a.b:1.c')]
+        self.assertEqual([s.name for s in functions.aliasByNode(None, seriesList, 1, -1)],
+                         ['b.c', 'b.d', 'y.e', 'b.b'])
+        seriesList = [makeSeries(name) for name in ('a.b.c', 'scale(a.b.d,2)', 'x')]
+        self.assertEqual([s.name for s in functions.aliasByMetric(None, seriesList)], ['c', 'd', 'x'])
+        seriesList = [makeSeries(name) for name in ('a.b.c.d', 'scale(a.b.c.d,2)', 'a.b)')]
+        self.assertEqual([s.name for s in functions.substr(None, seriesList, 1, 3)], ['b.c', 'b.c', 'b'])
+        self.assertEqual([s.name for s in functions.mapSeries(None, [makeSeries('q.w'), makeSeries('e.w')], 1)[0]],
+                         ['q.w', 'e.w'])
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+from pyparsing import ParseException
+from twisted.trial import unittest
+
+from moira.graphite.evaluator import compileTokens, TemplateNode, ExpressionNode, PathNode, CallNode
+from moira.graphite.grammar import grammar
+from moira.graphite.parser import parseTarget, ParseError
+
+
+CORPUS = [
+    u'a.b.c',
+    u'  Servers.srv-1.cpu.*  ',
+    u'a.{b,c}.d*.[0-9]?.$x',
+    u'a.b\\(c\\).d\\,e\\{f\\}\\.g',
+    u'sumSeries(a.*)',
+    u'sumSeries ( a.* , b.* )',
+    u'divideSeries(sumSeries(a.*), sumSeries(b.*))',
+    u'movingAverage(sumSeries(a.b.*), "1min", xFilesFactor=0.5)',
+    u'movingAverage(a.b, 10)',
+    u'scale(a.b, -2.5)',
+    u'scale(a.b, 1e3)',
+    u'scale(a.b, 1.5E-2)',
+    u'scale(a.b, 2\n)',
+    u'scale(a.b, 2\n, 3)',
+    u'alias(a.b, "x, y")',
+    u"alias(a.b, 'x')",
+    u'alias(a.b, "a""b")',
+    u'alias(a.b, "a\\"b")',
+    u'alias(a.b, "a\tb")',
+    u'alias(a.b, "a""")',
+    u'aliasByNode(a.b.c, 1, -1)',
+    u'f(1.5.metric, 1e3x, 10abc)',
+    u'f(true, FALSE, True)',
+    u'f(true.metric)',
+    u'f(trueMetric, false_x, true$)',
+    u'f(a, k=1, n="s", b=true)',
+    u'f(k=1)',
+    u'f(a, k=1, b)',
+    u'f(a, k=)',
+    u'f()',
+    u'f( )',
+    u'f(a,)',
+    u'f(,a)',
+    u'f(a b)',
+    u'f(a) trailing garbage',
+    u'f(g(h(i(a.b))))',
+    u'templateX(a)',
+    u'template(a.$x)',
+    u'template(a.$x, x="b")',
+    u'template(sumSeries(a.$1.$2), "b", 3)',
+    u'template(f($1), 5)',
+    u'template(a.$x, 1, x=2)',
+    u'template(a.$x, b.c)',
+    u'template(a.$x,)',
+    u'f(template(a.$x, x="y"))',
+    u'a..b',
+    u'a.',
+    u'.a',
+    u'a{b',
+    u'a{}',
+    u'a{b,}.c',
+    u'a.б.c',
+    u'"s"',
+    u'1',
+    u'(a)',
+    u'',
+    u'   ',
+]
+
+
+def describe(node):
+    if isinstance(node, TemplateNode):
+        return ('template', [(name, describe(arg)) for name, arg in node.kwargs],
+                [(name, describe(arg)) for name, arg in node.args], describe(node.body))
+    if isinstance(node, ExpressionNode):
+        return ('expression', [(type(p), p) for p in node.patterns], describe(node.body))
+    if isinstance(node, PathNode):
+        return ('path', type(node.expression), node.expression)
+    if isinstance(node, CallNode):
+        return ('call', node.funcname, [describe(arg) for arg in node.args],
+                [(name, describe(arg)) for name, arg in node.kwargs])
+    return ('value', type(node.value), node.value)
+
+
+class Parser(unittest.TestCase):
+
+    def assertSamePlan(self, target):
+        try:
+            expected = describe(compileTokens(grammar.parseString(target)))
+        except ParseException:
+            self.assertRaises(ParseError, parseTarget, target)
+            return
+        self.assertEqual(describe(compileTokens(parseTarget(target))), expected, repr(target))
+
+    def testCorpus(self):
+        for target in CORPUS:
+            self.assertSamePlan(target)
+            self.assertSamePlan(target.encode('utf8'))
+
+    def testTokens(self):
+        tokens = parseTarget(u'f(a.*, 1e3, k="v")')
+        call = tokens.expression.call
+        self.assertEqual(call.funcname, u'f')
+        self.assertEqual(list(tokens.expression.call.args[0].expression), [u'a.*'])
+        self.assertEqual(call.args[1].number.scientific[0], u'1e3')
+        self.assertEqual(call.args[1].number.integer, '')
+        self.assertEqual((call.kwargs[0].argname, call.kwargs[0].args[0].string), (u'k', u'"v"'))
+        self.assertEqual(tokens.template, '')
+
+    def testErrors(self):
+        for target in (u'', u'"s"', u'(a)', u'=a'):
+            self.assertRaises(ParseError, parseTarget, target)
+
+    def testNesting(self):
+        # failed templates and calls are parsed once per position
+        target = u'template(' * 40 + u'a.$x'
+        self.assertEqual(describe(compileTokens(parseTarget(target))),
+                         ('expression', [(unicode, u'template')], ('path', unicode, u'template')))
@@ -0,0 +1,103 @@
+import random
+
+from twisted.trial import unittest
+
+from moira.graphite import functions
+from moira.graphite.datalib import TimeSeries
+
+
+def sortedPercentile(points, n, interpolate=False):
+    sortedPoints = sorted([p for p in points if p is not None])
+    if len(sortedPoints) == 0:
+        return None
+    fractionalRank = (n / 100.0) * (len(sortedPoints) + 1)
+    rank = int(fractionalRank)
+    rankFraction = fractionalRank - rank
+    if not interpolate:
+        rank += int(functions.math.ceil(rankFraction))
+    if rank == 0:
+        percentile = sortedPoints[0]
+    elif rank - 1 == len(sortedPoints):
+        percentile = sortedPoints[-1]
+    else:
+        percentile = sortedPoints[rank - 1]
+    if interpolate and rank != len(sortedPoints):
+        percentile = percentile + rankFraction * (sortedPoints[rank] - percentile)
+    return percentile
+
+
+def generateSeriesList(rnd, count):
+    seriesList = []
+    for i in range(count):
+        values = [rnd.choice([None, rnd.randint(0, 3), float(rnd.randint(0, 3)), rnd.uniform(-10, 10)])
+                  for _ in range(rnd.randint(0, 6))]
+        seriesList.append(TimeSeries('metric%d' % i, 0, 60 * len(values), 60, values))
+    return seriesList
+
+
+class Selection(unittest.TestCase):
+
+    def assertSameObjects(self, actual, expected):
+        self.assertEqual([id(a) for a in actual], [id(e) for e in expected])
+
+    def testTopSeries(self):
+        rnd = random.Random(7)
+        keys = [functions.safeLast, functions.safeSum,
+                lambda s: functions.safeDiv(functions.safeSum(s), functions.safeLen(s))]
+        for _ in range(100):
+            seriesList = generateSeriesList(rnd, rnd.randint(0, 30))
+            for n in (-2, 0, 1, 3, len(seriesList), len(seriesList) + 1):
+                for key in keys:
+                    self.assertSameObjects(functions._nlargest(seriesList, n, key), sorted(seriesList, key=key)[-n:])
+                    self.assertSameObjects(functions._nsmallest(seriesList, n, key), sorted(seriesList, key=key)[:n])
+
+    def testMostDeviant(self):
+        seriesList = [TimeSeries(name, 0, 180, 60, values) for name, values in (
+            ('a', [1, 2, 3]), ('b', [None]), ('c', [3, 2, 1]), ('d', [5, 5, 5]), ('e', [1, 2, 3]), ('f', [0, 9, 0]))]
+        result = functions.mostDeviant(None, seriesList, 3)
+        self.assertEqual([s.name for s in result], ['f', 'a', 'c'])
+        result = functions.mostDeviant(None, seriesList, -1)
+        self.assertEqual([s.name for s in result], ['f', 'a', 'c', 'e'])
+
+    def testSortBy(self):
+        seriesList = [TimeSeries(name, 0, 120, 60, values) for name, values in (
+            ('b', [1, 2]), ('a', [3, None]), ('c', [2, 1]), ('a', [None, 0]))]
+        self.assertEqual([s.name for s in functions.sortByName(None, list(seriesList))], ['a', 'a', 'b', 'c'])
+        self.assertEqual([s.name for s in functions.sortByTotal(None, list(seriesList))], ['b', 'a', 'c', 'a'])
+        self.assertEqual([s.name for s in functions.sortByMaxima(None, list(seriesList))], ['a', 'b', 'c', 'a'])
+        self.assertEqual([s.name for s in functions.sortByMinima(None, list(seriesList))], ['a', 'b', 'c'])
+
+    def testPercentile(self):
+        rnd = random.Random(11)
+        for size in (0, 1, 2, 5, 255, 256, 1000):
+            for _ in range(5):
+                points = [rnd.choice([None, rnd.randint(-3, 3), float(rnd.randint(-3, 3)), -0.0, rnd.uniform(-10, 10)])
+                          for _ in range(size)]
+                for n in (0.1, 1, 25, 50, 90, 95, 99, 99.9, 100):
+                    for interpolate in (False, True):
+                        try:
+                            expected = sortedPercentile(points, n, interpolate)
+                        except IndexError:
+                            self.assertRaises(IndexError, functions._getPercentile, points, n, interpolate)
+                            continue
+                        actual = functions._getPercentile(points, n, interpolate)
+                        self.assertEqual(actual, expected)
+                        self.assertIs(type(actual), type(expected))
+                        self.assertEqual(repr(actual), repr(expected))
+
+    def testSelectRanks(self):
+        points = [1.0, 0.0, 1, -0.0, 2L, 1.0, 0] * 100
+        expected = sorted(points)
+        for rank in (0, 100, 199, 200, 299, 300, 399, 400, -1, -300):
+            actual, = functions._selectRanks(points, [rank])
+            self.assertIs(actual, expected[rank])
+        points = [float(i % 10) for i in range(300)] + [float('nan')]
+        self.assertEqual(functions._selectRanks(points, [0, 150]), [sorted(points)[0], sorted(points)[150]])
+        self.assertRaises(IndexError, functions._selectRanks, [1.0] * 300, [300])
+
+    def testNPercentile(self):
+        series = TimeSeries('metric', 0, 600 * 60, 60, [float(i % 37) if i % 5 else None for i in range(600)])
+        result, = functions.nPercentile(None, [series], 95)
+        self.assertEqual(result.name, 'nPercentile(metric, 95)')
+        self.assertEqual(list(result), [sortedPercentile(series, 95)] * 600)
+        self.assertEqual(functions.nPercentile(None, [TimeSeries('empty', 0, 60, 60, [None])], 50), [])